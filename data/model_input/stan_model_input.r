@@ -37,3 +37,24 @@ pH <- c(7.0, 7.8, 7.4, 7.0, 6.7, 6.4, 7.0, 7.0, 7.0, 7.0, 7.4, 7.03, 6.99, 6.99,
 pMg <- c(3.0, 3.0, 3.0, 3.0, 3.0, 3.0, 3.0, 3.0, 3.0, 3.0, 0.8181818181818182, 0.16, 3.05, 3.0, 3.0, 6.72, 6.71, 6.59, 6.59, 6.66, 6.65, 6.78, 6.78, 6.84, 6.84, 6.02, 6.02, 4.7, 4.69, 2.24, 2.27, 3.12, 3.16, 5.49, 5.48, 4.07, 4.133, 7.12, 7.12, 6.92, 6.93, 6.67, 6.7, 6.46, 6.46, 7.13, 7.15, 6.34, 6.84, 6.97, 7.05, 7.22, 7.24, 3.51, 3.54, 4.5, 4.5, 4.44, 4.44)
 prior_loc_dgf <- c(0.0, 0.0, -472.27, -237.14, 0.0, 0.0, -1156.04, 0.0, 0.0, 0.0, -385.974, 0.0, -793.41, 0.0, 0.0, 0.0, 0.0, -1263.65, 0.0, -1919.86, -1025.491, -369.32167999999996, 0.0, 0.0, 0.0, 0.0)
 prior_regime_dgf <- c(2, 2, 1, 1, 2, 2, 1, 2, 2, 2, 1, 2, 1, 2, 2, 2, 2, 1, 2, 1, 1, 1, 2, 2, 2, 2)
+N_condition <- 58
+N_cpd_cnd <- 195
+N_stoic_kpr <- 199
+temperature_cnd <- c(278.15, 286.05, 286.05, 288.15, 292.15, 292.15, 293.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 298.15, 304.15, 304.15, 308.15, 310.15, 310.15, 310.15, 310.25, 310.25, 311.15, 311.15, 311.15, 318.15)
+I_cnd <- c(0.25, 0.07200000000000001, 0.08, 0.25, 0.071, 0.08, 0.40399999999999997, 0.026000000000000002, 0.034, 0.037000000000000005, 0.038, 0.044000000000000004, 0.048, 0.052000000000000005, 0.055999999999999994, 0.057, 0.061, 0.061, 0.062, 0.063, 0.068, 0.069, 0.07, 0.071, 0.07200000000000001, 0.076, 0.079, 0.08, 0.081, 0.09300000000000001, 0.096, 0.125, 0.132, 0.228, 0.233, 0.25, 0.25, 0.25, 0.25, 0.25, 0.326, 0.32899999999999996, 1.4, 1.4, 1.53, 1.53, 0.07200000000000001, 0.08, 0.25, 0.15, 0.25, 0.25, 0.071, 0.078, 0.245, 0.249, 0.25, 0.25)
+pH_cnd <- c(7.0, 8.68, 8.85, 7.0, 8.46, 8.67, 7.4, 6.04, 6.77, 6.67, 6.88, 7.41, 7.45, 7.79, 8.33, 8.32, 7.93, 8.28, 8.53, 8.5, 8.51, 8.3, 8.34, 8.4, 8.31, 8.5, 8.54, 8.54, 8.54, 8.4, 8.56, 8.49, 8.67, 8.57, 8.73, 6.4, 6.7, 7.0, 7.4, 7.8, 8.87, 8.68, 8.86, 8.87, 8.55, 8.56, 8.16, 8.34, 7.0, 7.5, 6.99, 6.99, 7.98, 8.13, 7.04, 6.83, 7.03, 7.0)
+pMg_cnd <- c(3.0, 6.59, 6.59, 3.0, 6.66, 6.65, 0.8181818181818182, 6.34, 6.97, 6.84, 7.05, 7.22, 7.24, 7.13, 3.12, 4.07, 7.15, 4.7, 3.16, 4.133, 4.69, 5.49, 6.02, 7.12, 6.72, 5.48, 7.12, 6.02, 6.71, 2.24, 2.27, 6.92, 6.93, 6.67, 6.7, 3.0, 3.0, 3.0, 3.0, 3.0, 6.46, 6.46, 4.5, 4.5, 4.44, 4.44, 6.78, 6.78, 3.0, 3.0, 3.0, 3.05, 6.84, 6.84, 3.54, 3.51, 0.16, 3.0)
+cpd_cnd_cpd <- c(3, 5, 12, 18, 5, 6, 12, 5, 6, 12, 3, 5, 12, 18, 5, 6, 12, 5, 6, 12, 7, 10, 11, 13, 17, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 3, 5, 12, 18, 3, 5, 12, 18, 3, 5, 12, 18, 3, 5, 12, 18, 3, 5, 12, 18, 5, 6, 12, 5, 6, 12, 4, 6, 8, 21, 4, 6, 8, 21, 4, 14, 15, 21, 4, 14, 15, 21, 5, 6, 12, 5, 6, 12, 3, 5, 12, 18, 9, 16, 19, 20, 4, 21, 24, 25, 4, 21, 23, 26, 5, 6, 12, 5, 6, 12, 5, 6, 12, 5, 6, 12, 1, 2, 5, 6, 20, 22, 3, 5, 12, 18)
+cpd_cnd_cnd <- c(1, 1, 1, 1, 2, 2, 2, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 6, 6, 6, 7, 7, 7, 7, 7, 8, 8, 8, 9, 9, 9, 10, 10, 10, 11, 11, 11, 12, 12, 12, 13, 13, 13, 14, 14, 14, 15, 15, 15, 16, 16, 16, 17, 17, 17, 18, 18, 18, 19, 19, 19, 20, 20, 20, 21, 21, 21, 22, 22, 22, 23, 23, 23, 24, 24, 24, 25, 25, 25, 26, 26, 26, 27, 27, 27, 28, 28, 28, 29, 29, 29, 30, 30, 30, 31, 31, 31, 32, 32, 32, 33, 33, 33, 34, 34, 34, 35, 35, 35, 36, 36, 36, 36, 37, 37, 37, 37, 38, 38, 38, 38, 39, 39, 39, 39, 40, 40, 40, 40, 41, 41, 41, 42, 42, 42, 43, 43, 43, 43, 44, 44, 44, 44, 45, 45, 45, 45, 46, 46, 46, 46, 47, 47, 47, 48, 48, 48, 49, 49, 49, 49, 50, 50, 50, 50, 51, 51, 51, 51, 52, 52, 52, 52, 53, 53, 53, 54, 54, 54, 55, 55, 55, 56, 56, 56, 57, 57, 57, 57, 57, 57, 58, 58, 58, 58)
+stoic_kpr_w <- c(-1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, 1.0, 1.0, -1.0, 1.0, -1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, -1.0, -1.0, 1.0, 1.0, -1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, -2.0, 1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0, -1.0, -1.0, 1.0, 1.0, -1.0, -1.0, 1.0, 1.0, -1.0)
+stoic_kpr_v <- c(118, 121, 120, 119, 126, 129, 128, 127, 122, 125, 124, 123, 118, 121, 120, 119, 114, 117, 116, 115, 110, 113, 112, 111, 1, 4, 3, 2, 11, 14, 13, 12, 158, 161, 160, 159, 192, 195, 194, 193, 24, 22, 21, 23, 25, 190, 188, 186, 189, 187, 191, 171, 173, 172, 170, 168, 167, 169, 166, 163, 165, 162, 164, 77, 79, 78, 89, 91, 90, 5, 7, 6, 8, 10, 9, 15, 17, 16, 18, 20, 19, 152, 154, 153, 155, 157, 156, 174, 176, 175, 177, 179, 178, 71, 73, 72, 86, 88, 87, 56, 58, 57, 65, 67, 66, 92, 94, 93, 95, 97, 96, 47, 49, 48, 59, 61, 60, 68, 70, 69, 80, 82, 81, 50, 52, 51, 62, 64, 63, 74, 76, 75, 83, 85, 84, 98, 100, 99, 101, 103, 102, 104, 106, 105, 107, 109, 108, 133, 135, 134, 130, 132, 131, 44, 46, 45, 53, 55, 54, 26, 28, 27, 32, 34, 33, 29, 31, 30, 35, 37, 36, 38, 40, 39, 41, 43, 42, 183, 185, 184, 180, 182, 181, 139, 138, 136, 137, 143, 142, 140, 141, 145, 147, 146, 144, 149, 151, 150, 148)
+stoic_kpr_u <- c(1, 5, 9, 13, 17, 21, 25, 29, 33, 37, 41, 46, 52, 56, 60, 64, 67, 70, 73, 76, 79, 82, 85, 88, 91, 94, 97, 100, 103, 106, 109, 112, 115, 118, 121, 124, 127, 130, 133, 136, 139, 142, 145, 148, 151, 154, 157, 160, 163, 166, 169, 172, 175, 178, 181, 184, 188, 192, 196, 200)
+grainsize <- 1
+output_dgr_prime <- 1
+output_kpr_rep <- 1
+output_log_lik <- 1
+n_cpd_cnd <- c(4, 3, 3, 4, 3, 3, 5, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4, 4, 3, 3, 4, 4, 4, 4, 3, 3, 4, 4, 4, 4, 3, 3, 3, 3, 6, 4)
+fst_cpd_cnd <- c(1, 5, 8, 11, 15, 18, 21, 26, 29, 32, 35, 38, 41, 44, 47, 50, 53, 56, 59, 62, 65, 68, 71, 74, 77, 80, 83, 86, 89, 92, 95, 98, 101, 104, 107, 110, 114, 118, 122, 126, 130, 133, 136, 140, 144, 148, 152, 155, 158, 162, 166, 170, 174, 177, 180, 183, 186, 192)
+kpr_by_cnd <- c(7, 18, 19, 8, 20, 21, 11, 48, 50, 49, 51, 52, 53, 46, 32, 36, 47, 28, 33, 37, 29, 34, 26, 38, 16, 35, 39, 27, 17, 30, 31, 40, 41, 42, 43, 6, 5, 1, 4, 3, 2, 45, 44, 56, 57, 58, 59, 22, 23, 9, 15, 14, 13, 24, 25, 55, 54, 12, 10)
+n_kpr_cnd <- c(1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1)
+fst_kpr_cnd <- c(1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36, 37, 38, 40, 41, 42, 43, 44, 45, 46, 47, 48, 49, 50, 51, 52, 53, 54, 55, 56, 57, 58, 59)
@@ -1,14 +1,20 @@
-import arviz as az
 import json
 import matplotlib
-matplotlib.use('TkAgg')
+matplotlib.use('Agg')
 from matplotlib import pyplot as plt
 import numpy as np
 import os
 import pandas as pd
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Tuple
+from draws_store import load_draws, load_manifest
+from instrument import instrumented, stage
+from summary import summarise_draws
 
 RELPATHS = {
-    "samples_folder": "../data/model_output/samples",
+    "draws_folder": "../data/model_output/draws",
     "stan_codes": "../data/model_input/stan_codes.json",
     "tecrdb": "../data/model_input/tecrdb.csv",
     "pkas": "../data/model_input/pkas.csv",
@@ -16,47 +22,42 @@ RELPATHS = {
     "img_folder": "../analysis/img",
 }
 R = 8.314e-3
+PAGE_SIZE = 200  # maximum number of labelled rows per figure
 
 
-
-def plot_predictions(d, img_folder):
+def plot_predictions(d, path):
     y = d["K'"].rank(method="first")
     obs = d["K'"]
     lo, hi = d[0.1], d[0.9]
     f, ax = plt.subplots(figsize=[12.5, 10])
     f.suptitle("K' Observations vs simulated measurements")
-    ax.get_yaxis().set_visible(False)
     ax.set(xlabel="K'")
     ax.scatter(obs, y, label="Observed value")
     ax.hlines(y, hi, lo, color='tab:orange', zorder=0, label="10%-90% credible region")
-    for i, row in d.iterrows():
-        ax.text(hi.loc[i], y.loc[i]-0.2, row["Reaction"], fontsize=8)
-    plt.semilogx()
+    add_labels(ax, y, d["Reaction"])
+    ax.semilogx()
     ax.legend(frameon=False, loc="upper left")
-    plt.savefig(os.path.join(img_folder, "pred.png"))
+    f.savefig(path)
+    plt.close(f)
 
 
-def plot_formation_energy(d, img_folder):
+def plot_formation_energy(d, path):
     med = d[0.5]
     obs = d["dgf_obs"].dropna()
     y = med.rank()
     lo, hi = d[0.1], d[0.9]
     f, ax = plt.subplots(figsize=[12.5, 7])
     f.suptitle("compound formation energy estimates")
-    ax.get_yaxis().set_visible(False)
-    ax.set(
-        xlabel="formation energy (kj/mol)",
-        ylabel="compound"
-    )
+    ax.set(xlabel="formation energy (kj/mol)")
     ax.scatter(obs, y.loc[obs.index], label="observed value")
     ax.hlines(y, hi, lo, color='tab:orange', zorder=0, label="10%-90% credible region")
-    for i, row in d.iterrows():
-        ax.text(hi.loc[i], y.loc[i]-0.2, row["name"], fontsize=8)
+    add_labels(ax, y, d["name"])
     ax.legend(frameon=False, loc="upper left")
-    plt.savefig(os.path.join(img_folder, "form.png"))
+    f.savefig(path)
+    plt.close(f)
 
 
-def plot_pka(d, img_folder):
+def plot_pka(d, path):
     med = d[0.5]
     obs = d["pka"].dropna()
     y = med.rank()
@@ -64,63 +65,131 @@ def plot_pka(d, img_folder):
     labs = d["name"].str.cat(d["nh"].astype(int).astype(str), sep=", nH ")
     f, ax = plt.subplots(figsize=[12.5, 15])
     f.suptitle("pKa estimates")
-    ax.get_yaxis().set_visible(False)
     ax.set(xlabel="pKa")
     ax.scatter(obs, y.loc[obs.index], label="observed value")
     ax.hlines(y, hi, lo, color='tab:orange', zorder=0, label="10%-90% credible region")
-    for i in d.index:
-        ax.text(hi.loc[i], y.loc[i]-0.2, labs.loc[i], fontsize=8)
+    add_labels(ax, y, labs)
     ax.legend(frameon=False, loc="upper left")
-    plt.savefig(os.path.join(img_folder, "pka.png"))
-
-
-def get_infd(csvs, stan_codes, tecrdb):
-    return az.from_cmdstan(
-        csvs,
-        coords={
-            "compound": list(stan_codes["compound_id"].keys()),
-            "measurement": list(tecrdb.index)
-        },
-        dims={
-            "dgf": ["compound"],
-            "dgr_prime": ["measurement"],
-            "log_lik_dgr": ["measurement"],
-            "kpr_rep": ["measurement"]
-        },
-        log_likelihood='log_lik_dgr'
-    )
+    f.savefig(path)
+    plt.close(f)
+
+
+def add_labels(ax, y, labels):
+    """Label each interval on the y axis, in one call rather than one text
+    artist per label.
+
+    """
+    ax.set_yticks(y.to_numpy())
+    ax.set_yticklabels(labels.to_numpy(), fontsize=8)
+    ax.tick_params(axis="y", length=0)
+
+
+def paginate(d: pd.DataFrame, sort_col, page_size: int) -> List[pd.DataFrame]:
+    """Split a table into pages of at most page_size rows, ordered by sort_col
+    so that each page covers a contiguous range of the y axis.
+
+    """
+    d = d.sort_values(sort_col, kind="mergesort")
+    return [d.iloc[i:i + page_size] for i in range(0, max(len(d), 1), page_size)]
+
+
+def get_page_path(img_folder: str, filename: str, page: int) -> str:
+    """Get the path of a page of a figure: the first page keeps the original
+    filename and later ones are numbered, e.g. pred.png, pred-2.png, ...
+
+    """
+    if page == 1:
+        return os.path.join(img_folder, filename)
+    stem, ext = os.path.splitext(filename)
+    return os.path.join(img_folder, f"{stem}-{page}{ext}")
+
 
+def remove_pages(img_folder: str, filename: str):
+    """Remove the numbered pages of a figure, e.g. pred-2.png, so that a
+    rerun with fewer pages doesn't leave stale ones behind.
+
+    """
+    stem, ext = os.path.splitext(filename)
+    pattern = re.compile(re.escape(stem) + r"-\d+" + re.escape(ext))
+    for f in os.listdir(img_folder):
+        if pattern.fullmatch(f):
+            os.remove(os.path.join(img_folder, f))
+
+
+def render(plot_function: Callable, d: pd.DataFrame, path: str, style: str):
+    plt.style.use(style)
+    plot_function(d, path)
+
+
+def render_figures(
+    figures: List[Tuple[Callable, pd.DataFrame, str, str]],
+    img_folder: str,
+    style: str,
+    page_size: int = PAGE_SIZE,
+    n_processes: int = None,
+) -> List[str]:
+    """Render figures in parallel and return the paths of the files written.
+
+    :param figures: list of (plot function, table, column to sort pages by,
+    filename) tuples.
+
+    """
+    os.makedirs(img_folder, exist_ok=True)
+    for _, _, _, filename in figures:
+        remove_pages(img_folder, filename)
+    jobs = [
+        (plot_function, page, get_page_path(img_folder, filename, i + 1), style)
+        for plot_function, d, sort_col, filename in figures
+        for i, page in enumerate(paginate(d, sort_col, page_size))
+    ]
+    if n_processes == 1:
+        for job in jobs:
+            render(*job)
+    else:
+        with ProcessPoolExecutor(n_processes) as executor:
+            list(executor.map(render, *zip(*jobs)))
+    return [job[2] for job in jobs]
+
+
+@instrumented("analyse_output")
 def main():
     here = os.path.dirname(os.path.realpath(__file__))
     img_folder = os.path.join(here, RELPATHS["img_folder"])
-    plt.style.use(os.path.join(here, 'sparse.mplstyle'))
-    sample_folder_path = os.path.join(here, RELPATHS["samples_folder"])
+    draws_folder = (
+        sys.argv[1] if len(sys.argv) > 1
+        else os.path.join(here, RELPATHS["draws_folder"])
+    )
     stan_codes = json.load(open(os.path.join(here, RELPATHS["stan_codes"]), "r"))
     tecrdb = pd.read_csv(os.path.join(here, RELPATHS["tecrdb"]), index_col=0)
     pkas = pd.read_csv(os.path.join(here, RELPATHS["pkas"]), index_col=0)
     compounds = pd.read_csv(os.path.join(here, RELPATHS["compounds"]), index_col=0)
-    csvs = [
-        os.path.join(sample_folder_path, f)
-        for f in os.listdir(sample_folder_path)
-        if f.endswith("csv")
-    ]
-    infd = get_infd(csvs, stan_codes, tecrdb)
-    posterior_samples = {
-        p: infd.posterior[p].to_series().unstack()
-        for p in ["dgf", "dgr_prime", "pka", "pkmg", "kpr_rep"]
-    }
-    ll_samples = {
-        "log_lik_dgr": infd.log_likelihood["log_lik_dgr"].to_series().unstack()
-    }
-    samples = {**posterior_samples, **ll_samples}
-    tecrdb = tecrdb.join(samples["kpr_rep"].quantile([0.1, 0.5, 0.9]).T)
-    compounds = compounds.join(samples["dgf"].quantile([0.1, 0.5, 0.9]).T, on="compound_id")
-    pkas = pkas.join(samples["pka"].quantile([0.1, 0.5, 0.9]).T)
-    plot_predictions(tecrdb, img_folder)
-    plot_formation_energy(compounds, img_folder)
-    plot_pka(pkas, img_folder)
-    plt.close("all")
-
+    draws = {v: load_draws(draws_folder, v) for v in ["dgf", "pka"]}
+    # kpr_rep isn't written with the "minimal" output profile
+    if "kpr_rep" in load_manifest(draws_folder)["variables"]:
+        draws["kpr_rep"] = load_draws(draws_folder, "kpr_rep")
+    figures = []
+    with stage("summarise_draws"):
+        if "kpr_rep" in draws:
+            tecrdb = tecrdb.join(
+                summarise_draws(draws["kpr_rep"], index=tecrdb.index)
+            )
+            figures.append((plot_predictions, tecrdb, "K'", "pred.png"))
+        else:
+            print("No kpr_rep draws, so not plotting predictions.")
+        compounds = compounds.join(
+            summarise_draws(draws["dgf"], index=list(stan_codes["compound_id"].keys())),
+            on="compound_id"
+        )
+        pkas = pkas.join(summarise_draws(draws["pka"], index=pkas.index))
+    with stage("render_figures"):
+        render_figures(
+            figures + [
+                (plot_formation_energy, compounds, 0.5, "form.png"),
+                (plot_pka, pkas, 0.5, "pka.png"),
+            ],
+            img_folder,
+            os.path.join(here, 'sparse.mplstyle'),
+        )
 
 
 if __name__ == "__main__":
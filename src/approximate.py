@@ -0,0 +1,127 @@
+"""Fit the model approximately, much faster than sampling with NUTS.
+
+Two of cmdstan's methods are supported: "variational" (ADVI), which gives
+draws from a fitted normal approximation to the posterior, and "optimize",
+which gives a single draw at the posterior mode. Either way the draws are
+written to a draws store with the same layout and coordinates as the NUTS
+store, so everything downstream, e.g. analyse_output.py, works unchanged.
+
+When there is also a NUTS fit, compare_approximation reports how far the
+approximate quantiles of dgf and pka are from the NUTS ones.
+
+"""
+
+import numpy as np
+import os
+import pandas as pd
+from typing import Any, Dict, List, Sequence, Tuple
+from draws_store import MANIFEST, load_draws, load_manifest, write_draws_array
+from summary import QUANTILES, summarise_draws
+
+METHODS = ["variational", "optimize"]
+METHOD_ARGS = {
+    "variational": {
+        "algorithm": "meanfield",
+        "iter": 10000,
+        "output_samples": 1000,
+        "require_converged": False,
+    },
+    "optimize": {"algorithm": "lbfgs", "iter": 2000},
+}
+REPORT_VARIABLES = ["dgf", "pka"]
+
+
+def fit_approximation(
+    model, data: Dict, method: str, seed: int = None
+) -> Tuple[np.ndarray, List[str]]:
+    """Get a (1, draw, column) array of approximate draws and their column
+    names.
+
+    """
+    if method == "variational":
+        vb = model.variational(data=data, seed=seed, **METHOD_ARGS[method])
+        draws = np.asarray(vb.variational_sample, dtype=float)[np.newaxis]
+        return draws, list(vb.column_names)
+    elif method == "optimize":
+        mle = model.optimize(data=data, seed=seed, **METHOD_ARGS[method])
+        draws = np.asarray(mle.optimized_params_np, dtype=float).reshape(1, 1, -1)
+        return draws, list(mle.column_names)
+    raise ValueError(f"Unknown method {method}; choose one of {METHODS}.")
+
+
+def write_approximation(
+    model,
+    data: Dict,
+    method: str,
+    store_folder: str,
+    coords: Dict[str, List[Any]] = None,
+    dims: Dict[str, List[str]] = None,
+    seed: int = None,
+) -> Dict[str, Any]:
+    """Fit the model approximately and write the draws to a draws store."""
+    draws, columns = fit_approximation(model, data, method, seed)
+    return write_draws_array(draws, columns, store_folder, method, coords, dims)
+
+
+def get_variable_index(store_folder: str, variable: str) -> List[Any]:
+    """Get the coordinates of a variable's last dimension in a draws store."""
+    manifest = load_manifest(store_folder)
+    entry = manifest["variables"][variable]
+    return manifest["coords"].get(entry["dims"][-1], list(range(entry["shape"][-1])))
+
+
+def compare_approximation(
+    nuts_folder: str,
+    approx_folder: str,
+    variables: Sequence[str] = REPORT_VARIABLES,
+    quantiles: Sequence[float] = QUANTILES,
+) -> pd.DataFrame:
+    """Get a table comparing approximate and NUTS quantiles.
+
+    There is one row per element of each variable, with columns for the
+    quantiles from each store, "median_error", the difference in medians as
+    a multiple of the NUTS posterior sd, and "width_ratio", the ratio of the
+    widths of the outer quantile intervals. For optimize fits the quantiles
+    are all the posterior mode, so width_ratio is zero.
+
+    """
+    out = []
+    for v in variables:
+        index = get_variable_index(nuts_folder, v)
+        nuts = summarise_draws(load_draws(nuts_folder, v), index, quantiles)
+        approx = summarise_draws(load_draws(approx_folder, v), index, quantiles)
+        lo, hi = min(quantiles), max(quantiles)
+        table = pd.concat(
+            [
+                nuts[list(quantiles)].add_prefix("nuts_"),
+                approx[list(quantiles)].add_prefix("approx_"),
+            ],
+            axis=1,
+        )
+        median = approx[0.5] if 0.5 in quantiles else approx["mean"]
+        nuts_median = nuts[0.5] if 0.5 in quantiles else nuts["mean"]
+        table["median_error"] = (median - nuts_median) / nuts["sd"]
+        table["width_ratio"] = (approx[hi] - approx[lo]) / (nuts[hi] - nuts[lo])
+        table.insert(0, "variable", v)
+        out.append(table)
+    return pd.concat(out).rename_axis("label")
+
+
+def write_report(nuts_folder: str, approx_folder: str, report_path: str):
+    """Write a comparison of the approximate and NUTS fits, if both exist,
+    and print the largest discrepancies.
+
+    """
+    if not all(
+        os.path.exists(os.path.join(f, MANIFEST))
+        for f in [nuts_folder, approx_folder]
+    ):
+        print("No NUTS draws to compare the approximation with.")
+        return
+    report = compare_approximation(nuts_folder, approx_folder)
+    report.to_csv(report_path)
+    print(
+        report.groupby("variable")[["median_error", "width_ratio"]]
+        .agg(lambda x: x.abs().max())
+        .rename(columns=lambda c: "max abs " + c)
+    )
@@ -0,0 +1,338 @@
+"""Time the expensive stages of the pipeline, and compare timings with a baseline.
+
+Each stage is run on the real data and on synthetic networks of increasing
+size (see simulate.py). The stages are:
+
+   - read_sheets and process_data: reading and processing the spreadsheet
+     (real data only)
+   - get_stoichiometry: parsing reaction formulas, with an empty memo
+   - get_stan_input: making the model input from the tables
+   - get_dgr_prime: the scalar Legendre transform, per measurement
+   - get_dgr_prime_batch: the vectorised Legendre transform of every
+     measurement
+   - stan_diagnose_process: the wall time of a whole process running the
+     compiled model's diagnose method. This includes starting up, reading
+     the data, transformed data, one gradient and two log density
+     evaluations per parameter for the finite differences, so it grows with
+     the number of parameters (recorded as "n_parameters") and is not the
+     cost of one gradient evaluation
+
+Timings, and some information about the machine and the code, are written
+to a json file. The comparison exits with status 1 if any stage is slower
+than in the baseline by more than a factor of the threshold.
+
+Usage:
+
+    python benchmark.py run [--sizes small medium] [--no-stan] [--output results.json]
+    python benchmark.py compare results.json baseline.json [--threshold 1.2]
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Tuple
+import util
+from legendre import get_dgr_prime, get_dgr_prime_batch, get_legendre_index
+from prepare_stan_input import get_model_tables, get_output_flags, get_stan_codes, get_stan_input
+from process_data import (
+    SHEET_CACHE_DIR, SHEET_PATH, get_compounds, get_microspecies, process_tecrdb,
+    read_sheets
+)
+from simulate import simulate_network
+from util import FORMULA_COL, get_stoichiometry
+
+RELPATHS = {
+    "model": "stan/model.stan",
+    "results": "../data/benchmarks/latest.json",
+}
+SIZES = {  # number of compounds, reactions and measurements
+    "small": (200, 100, 2000),
+    "medium": (2000, 1000, 20000),
+    "large": (20000, 10000, 200000),
+}
+DEFAULT_SIZES = ["small", "medium"]
+REPEATS = 5
+STAN_REPEATS = 3
+N_SCALAR = 50  # measurements for the scalar Legendre transform
+THRESHOLD = 1.2
+R = 8.314e-3
+SEED = 1234
+
+
+def time_function(
+    f: Callable, repeats: int = REPEATS, setup: Callable = None, n: int = 1
+) -> Dict[str, Any]:
+    """Time some calls of a function.
+
+    :param setup: optional function returning the arguments of each call,
+    which isn't timed.
+
+    :param n: number of units of work per call, e.g. measurements; the
+    reported times are per unit.
+
+    """
+    times = []
+    for _ in range(repeats):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        f(*args)
+        times.append((time.perf_counter() - start) / n)
+    return {
+        "min": min(times),
+        "median": float(np.median(times)),
+        "repeats": repeats,
+        "n": n,
+    }
+
+
+def get_system_info() -> Dict[str, Any]:
+    here = os.path.dirname(os.path.realpath(__file__))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=here, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def add_formulas(tecrdb: pd.DataFrame, stoichiometry: pd.DataFrame) -> pd.DataFrame:
+    """Add a TECRDB-style formula column to a synthetic measurement table."""
+    formulas = stoichiometry.groupby("reaction_id").apply(
+        lambda df: str(dict(zip(df["compound_id"], df["coefficient"])))
+    )
+    return tecrdb.assign(**{FORMULA_COL: tecrdb["reaction_id"].map(formulas)})
+
+
+def get_legendre_args(
+    tables: Dict[str, pd.DataFrame]
+) -> Tuple[Dict[str, float], Dict[str, List[float]], Dict[str, List[float]]]:
+    """Get some plausible dgf, pka and pkmg dictionaries for the compounds in
+    some model input tables.
+
+    """
+    dgf = tables["compounds"].set_index("compound_id")["dgf_obs"].fillna(0).to_dict()
+    pka, pkmg = (
+        tables[k].groupby("compound_id")[pk].apply(list).to_dict()
+        for k, pk in [("pkas", "pka"), ("pkmgs", "pkmg")]
+    )
+    return dgf, pka, pkmg
+
+
+def benchmark_tables(
+    tables: Dict[str, pd.DataFrame], repeats: int = REPEATS
+) -> Dict[str, Dict[str, Any]]:
+    """Time the stages that start from model input tables."""
+    out = {}
+    tecrdb = tables["tecrdb"]
+
+    def clear_memo():
+        util.STOICHIOMETRY_CACHE.clear()
+        return (tecrdb,)
+
+    out["get_stoichiometry"] = time_function(get_stoichiometry, repeats, clear_memo)
+    stan_codes = get_stan_codes(tables["stoichiometry"])
+    out["get_stan_input"] = time_function(
+        lambda copies: get_stan_input(**copies, stan_codes=stan_codes),
+        repeats,
+        lambda: ({k: v.copy() for k, v in tables.items()},),
+    )
+    dgf, pka, pkmg = get_legendre_args(tables)
+    index = get_legendre_index(tables["microspecies"], tables["stoichiometry"])
+    stoichiometries = {
+        rxn: dict(zip(df["compound_id"], df["coefficient"]))
+        for rxn, df in tables["stoichiometry"].groupby("reaction_id")
+    }
+    sample = tecrdb.loc[lambda df: df["reaction_id"].isin(stoichiometries)].head(N_SCALAR)
+
+    def scalar():
+        for _, row in sample.iterrows():
+            get_dgr_prime(
+                row["Ionic strength"], row["T(K)"], row["pH"], row["pMg"], R,
+                tables["microspecies"], pka, pkmg, stoichiometries[row["reaction_id"]],
+                dgf,
+            )
+
+    out["get_dgr_prime"] = time_function(scalar, repeats, n=len(sample))
+    measured = tecrdb.loc[lambda df: df["reaction_id"].isin(index.reaction_ids)]
+    out["get_dgr_prime_batch"] = time_function(
+        lambda: get_dgr_prime_batch(
+            index, measured["reaction_id"], measured["Ionic strength"],
+            measured["T(K)"], measured["pH"], measured["pMg"], R, pka, pkmg, dgf
+        ),
+        repeats,
+    )
+    return out
+
+
+def benchmark_stan(
+    stan_input: Dict[str, Any], repeats: int = STAN_REPEATS
+) -> Dict[str, Any]:
+    """Time whole runs of the compiled model's diagnose method, or explain
+    why not.
+
+    """
+    from model_cache import get_model
+    from run_model import CPP_OPTIONS, GRAINSIZE, OUTPUT_PROFILE
+    here = os.path.dirname(os.path.realpath(__file__))
+    try:
+        model = get_model(os.path.join(here, RELPATHS["model"]), cpp_options=CPP_OPTIONS)
+    except Exception as e:
+        return {"skipped": f"Couldn't compile the model: {e!r}"}
+    data = {**stan_input, "grainsize": GRAINSIZE, **get_output_flags(OUTPUT_PROFILE)}
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, "data.json")
+        with open(data_path, "w") as f:
+            json.dump(data, f)
+        command = [
+            model.exe_file, "diagnose", "test=gradient",
+            "data", f"file={data_path}",
+            "random", f"seed={SEED}",
+            "output", f"file={os.path.join(tmp, 'diagnose.csv')}",
+        ]
+        out = time_function(
+            lambda: subprocess.run(command, check=True, capture_output=True), repeats
+        )
+    # dgf_z, first_pka, first_pkmg, pka_diffs and pkmg_diffs
+    out["n_parameters"] = sum(
+        stan_input[k] for k in ["N_compound", "N_pka", "N_pkmg"]
+    )
+    return out
+
+
+def benchmark_real(stan: bool, repeats: int = REPEATS) -> Dict[str, Any]:
+    here = os.path.dirname(os.path.realpath(__file__))
+    sheet_path = os.path.join(here, SHEET_PATH)
+    cache_dir = os.path.join(here, SHEET_CACHE_DIR)
+    out = {}
+    sheets = read_sheets(sheet_path, cache_dir)  # fill the cache first
+    out["read_sheets"] = time_function(
+        lambda: read_sheets(sheet_path, cache_dir), repeats
+    )
+
+    def process():
+        microspecies = get_microspecies(sheets["pka"], sheets["pkmg"])
+        tecrdb = process_tecrdb(sheets["tecrdb"])
+        get_compounds(sheets["dgf"], tecrdb, microspecies, sheets["pka"])
+
+    out["process_data"] = time_function(process, repeats)
+    tables = get_model_tables()
+    out.update(benchmark_tables(tables, repeats))
+    if stan:
+        stan_input = get_stan_input(**tables, stan_codes=get_stan_codes(tables["stoichiometry"]))
+        out["stan_diagnose_process"] = benchmark_stan(stan_input)
+    return out
+
+
+def benchmark_synthetic(
+    size: Tuple[int, int, int], stan: bool, repeats: int = REPEATS
+) -> Dict[str, Any]:
+    network = simulate_network(*size, seed=SEED)
+    tables = {
+        k: network[k]
+        for k in ["tecrdb", "stoichiometry", "microspecies", "compounds", "pkas", "pkmgs"]
+    }
+    tables["tecrdb"] = add_formulas(tables["tecrdb"], tables["stoichiometry"])
+    out = benchmark_tables(tables, repeats)
+    if stan:
+        out["stan_diagnose_process"] = benchmark_stan(network["stan_input"])
+    return out
+
+
+def run_benchmarks(
+    sizes: List[str] = DEFAULT_SIZES, stan: bool = True, real: bool = True,
+    repeats: int = REPEATS,
+) -> Dict[str, Any]:
+    """Get a dictionary with system info and the timings of every dataset and
+    stage, keyed like "real/get_stan_input" or "small/get_stan_input".
+
+    """
+    results = {}
+    datasets = (["real"] if real else []) + list(sizes)
+    for dataset in datasets:
+        print(f"Benchmarking {dataset} data...")
+        if dataset == "real":
+            timings = benchmark_real(stan, repeats)
+        else:
+            timings = benchmark_synthetic(SIZES[dataset], stan, repeats)
+        results.update({f"{dataset}/{stage}": t for stage, t in timings.items()})
+    return {"system": get_system_info(), "results": results}
+
+
+def compare_results(
+    results: Dict[str, Any], baseline: Dict[str, Any], threshold: float = THRESHOLD
+) -> pd.DataFrame:
+    """Get a table comparing the median times of the benchmarks in both
+    results, with a column "slower" flagging ratios above the threshold.
+
+    """
+    rows = []
+    for name, timing in results["results"].items():
+        base = baseline["results"].get(name)
+        if base is None or "median" not in timing or "median" not in base:
+            continue
+        rows.append({
+            "benchmark": name,
+            "baseline": base["median"],
+            "current": timing["median"],
+            "ratio": timing["median"] / base["median"],
+        })
+    out = pd.DataFrame(rows, columns=["benchmark", "baseline", "current", "ratio"])
+    return out.assign(slower=lambda df: df["ratio"] > threshold).set_index("benchmark")
+
+
+def main():
+    here = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--sizes", nargs="*", choices=list(SIZES), default=DEFAULT_SIZES)
+    run_parser.add_argument("--no-real", action="store_true", help="skip the real data")
+    run_parser.add_argument("--no-stan", action="store_true", help="skip the Stan model")
+    run_parser.add_argument("--repeats", type=int, default=REPEATS)
+    run_parser.add_argument("--output", default=os.path.join(here, RELPATHS["results"]))
+    compare_parser = subparsers.add_parser("compare", help="compare with a baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args()
+    if args.command == "run":
+        results = run_benchmarks(
+            args.sizes, stan=not args.no_stan, real=not args.no_real, repeats=args.repeats
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+    else:
+        with open(args.results, "r") as f:
+            results = json.load(f)
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        comparison = compare_results(results, baseline, args.threshold)
+        print(comparison.to_string(float_format=lambda x: f"{x:.4g}"))
+        if comparison["slower"].any():
+            print(f"Slower than the baseline: {list(comparison.index[comparison['slower']])}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Compare fitted model variants using PSIS-LOO and WAIC.
+
+Each variant is a draws store (see draws_store.py) containing log_lik_dgr.
+The log likelihood is read from the memory-mapped store a chunk of
+measurements at a time, and chunks are processed in parallel. Results are
+cached in the store's CACHE_FOLDER subfolder, keyed by a hash of the log
+likelihood file, so comparing against an unchanged variant is free. The
+cache is kept out of the store's top level so that it doesn't count as one
+of the draws_store stage's outputs.
+
+Usage:
+
+    python compare_models.py [draws_folder ...]
+
+"""
+
+import arviz as az
+import json
+import numpy as np
+import os
+import pandas as pd
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from scipy.special import logsumexp
+from typing import Any, Dict, List, Tuple
+from draws_store import load_draws, load_manifest
+from util import hash_file
+
+RELPATHS = {
+    "draws_folder": "../data/model_output/draws",
+    "comparison_output": "../data/model_output/model_comparison.csv",
+}
+LOG_LIK = "log_lik_dgr"
+REFF_VARIABLES = ["dgf", "pka", "pkmg"]
+CHUNK_SIZE = 1000
+K_THRESHOLD = 0.7
+CACHE_FOLDER = "loo"
+CACHE_FILES = {"summary": "summary.json", "pointwise": "pointwise.npy"}
+
+
+def get_log_lik_entry(store_folder: str) -> Dict[str, Any]:
+    """Get the manifest entry of a draws store's log likelihood."""
+    variables = load_manifest(store_folder)["variables"]
+    if LOG_LIK not in variables:
+        raise ValueError(
+            f"Draws store {store_folder} has no {LOG_LIK}: run \"python "
+            "run_model.py --generate-quantities --output-profile full\" to add it."
+        )
+    return variables[LOG_LIK]
+
+
+def get_reff(store_folder: str) -> float:
+    """Get the relative efficiency of the posterior draws, i.e. the mean
+    effective sample size of the parameters in REFF_VARIABLES divided by the
+    number of draws.
+
+    """
+    variables = load_manifest(store_folder)["variables"]
+    draws = [load_draws(store_folder, v) for v in REFF_VARIABLES if v in variables]
+    if len(draws) == 0 or draws[0].shape[0] == 1:
+        return 1.0
+    ess = np.concatenate([
+        np.ravel(az.ess(az.convert_to_dataset(np.asarray(d)), method="mean").to_array())
+        for d in draws
+    ])
+    n_sample = draws[0].shape[0] * draws[0].shape[1]
+    return float(np.nanmean(ess) / n_sample)
+
+
+def get_pointwise_chunk(
+    store_folder: str, start: int, stop: int, reff: float
+) -> np.ndarray:
+    """Get a (measurement, 3) array of pointwise elpd_loo, elpd_waic and
+    pareto k for measurements start to stop.
+
+    """
+    log_lik = load_draws(store_folder, LOG_LIK)
+    ll = np.asarray(log_lik[:, :, start:stop]).reshape(-1, stop - start).T
+    n_sample = ll.shape[1]
+    log_weights, pareto_k = az.psislw(-ll, reff)
+    elpd_loo = logsumexp(log_weights + ll, axis=1)
+    lppd = logsumexp(ll, axis=1) - np.log(n_sample)
+    elpd_waic = lppd - np.var(ll, axis=1)
+    return np.stack([elpd_loo, elpd_waic, pareto_k], axis=1)
+
+
+def get_pointwise(
+    store_folder: str,
+    reff: float,
+    chunk_size: int = CHUNK_SIZE,
+    n_processes: int = None,
+) -> np.ndarray:
+    """Get a (measurement, 3) array of pointwise elpd_loo, elpd_waic and
+    pareto k for every measurement.
+
+    """
+    n_measurement = get_log_lik_entry(store_folder)["shape"][-1]
+    bounds = [
+        (start, min(start + chunk_size, n_measurement))
+        for start in range(0, n_measurement, chunk_size)
+    ]
+    args = [(store_folder, start, stop, reff) for start, stop in bounds]
+    if n_processes == 1:
+        chunks = [get_pointwise_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(n_processes) as executor:
+            chunks = list(executor.map(get_pointwise_chunk, *zip(*args)))
+    return np.concatenate(chunks)
+
+
+def summarise_pointwise(pointwise: np.ndarray) -> Dict[str, float]:
+    """Get the total elpd, its standard error and the number of high pareto
+    ks from pointwise results.
+
+    """
+    n = len(pointwise)
+    elpd_loo, elpd_waic, pareto_k = pointwise.T
+    return {
+        "elpd_loo": float(elpd_loo.sum()),
+        "se_loo": float(np.sqrt(n * np.var(elpd_loo))),
+        "elpd_waic": float(elpd_waic.sum()),
+        "se_waic": float(np.sqrt(n * np.var(elpd_waic))),
+        "n_high_k": int((pareto_k > K_THRESHOLD).sum()),
+        "max_k": float(pareto_k.max()),
+    }
+
+
+def get_loo(
+    store_folder: str, chunk_size: int = CHUNK_SIZE, n_processes: int = None
+) -> Tuple[Dict[str, float], np.ndarray]:
+    """Get summary and pointwise PSIS-LOO and WAIC results for a draws store,
+    using cached results if the log likelihood hasn't changed.
+
+    """
+    key = hash_file(os.path.join(store_folder, get_log_lik_entry(store_folder)["file"]))
+    cache_folder = os.path.join(store_folder, CACHE_FOLDER)
+    summary_path = os.path.join(cache_folder, CACHE_FILES["summary"])
+    pointwise_path = os.path.join(cache_folder, CACHE_FILES["pointwise"])
+    if os.path.exists(summary_path) and os.path.exists(pointwise_path):
+        with open(summary_path, "r") as f:
+            cached = json.load(f)
+        if cached["key"] == key:
+            return cached["summary"], np.load(pointwise_path)
+    reff = get_reff(store_folder)
+    pointwise = get_pointwise(store_folder, reff, chunk_size, n_processes)
+    summary = {**summarise_pointwise(pointwise), "reff": reff}
+    os.makedirs(cache_folder, exist_ok=True)
+    np.save(pointwise_path, pointwise)
+    with open(summary_path, "w") as f:
+        json.dump({"key": key, "summary": summary}, f, indent=2)
+    return summary, pointwise
+
+
+def compare_models(
+    store_folders: List[str], chunk_size: int = CHUNK_SIZE, n_processes: int = None
+) -> pd.DataFrame:
+    """Get a table ranking model variants by elpd_loo.
+
+    The elpd_diff and se_diff columns compare each variant with the best one,
+    using pointwise differences, so all variants must be fitted to the same
+    measurements.
+
+    """
+    results = {f: get_loo(f, chunk_size, n_processes) for f in store_folders}
+    n_measurement = {len(pointwise) for _, pointwise in results.values()}
+    if len(n_measurement) > 1:
+        raise ValueError("Variants have different numbers of measurements.")
+    out = pd.DataFrame(
+        {f: summary for f, (summary, _) in results.items()}
+    ).T.sort_values("elpd_loo", ascending=False)
+    best = results[out.index[0]][1][:, 0]
+    diffs = {f: best - results[f][1][:, 0] for f in out.index}
+    out["elpd_diff"] = [diffs[f].sum() for f in out.index]
+    out["se_diff"] = [np.sqrt(len(best) * np.var(diffs[f])) for f in out.index]
+    out.insert(0, "rank", np.arange(1, len(out) + 1))
+    return out
+
+
+def main():
+    here = os.path.dirname(os.path.realpath(__file__))
+    store_folders = sys.argv[1:] or [os.path.join(here, RELPATHS["draws_folder"])]
+    comparison = compare_models(store_folders)
+    comparison.to_csv(os.path.join(here, RELPATHS["comparison_output"]))
+    print(comparison)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""Tabulate compounds' dgf_prime on a grid of conditions.
+
+The posterior draws of every compound's dgf_prime are pushed through the
+Legendre transform once per point of a grid of ionic strength,
+temperature, pH and pMg, and their mean and quantiles, or a thinned set of
+the draws themselves, are saved as a memory-mappable array. Conditions
+between the grid points are then answered by multilinear interpolation,
+which is much cheaper than transforming the draws again, e.g. for plotting
+how a reaction's dgr_prime depends on pH and pMg.
+
+Ionic strength is interpolated on the scale sqrt(I) / (1 + 1.6 sqrt(I)),
+on which the Debye-Hückel term is linear. After tabulating, the interpolation
+error is estimated at random points between the grid points; a warning is
+printed if it is bigger than TOLERANCE.
+
+Interpolated means and draws of dgf_prime can be added up to get the same
+statistics for reactions, but quantiles can't: use a table of draws to get
+reactions' quantiles.
+
+Usage:
+
+    python condition_grid.py [n_draw_table]
+
+Without an argument the table contains each compound's mean and quantiles;
+with one it contains n_draw_table evenly thinned draws.
+
+"""
+
+import itertools
+import json
+import numpy as np
+import os
+import pandas as pd
+import sys
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
+from draws_store import load_flat_draws
+from legendre import (
+    LOG10, LegendreIndex, cap_pk_orders, get_dgr_prime_from_arrays,
+    get_formation_index, get_ms_condition_terms, get_ms_pk_sums
+)
+from predict import CONDITION_COLS, R, get_pk_counts
+from summary import QUANTILES
+
+RELPATHS = {
+    "draws_folder": "../data/model_output/draws",
+    "stan_codes": "../data/model_input/stan_codes.json",
+    "microspecies": "../data/processed/microspecies.csv",
+    "grid_folder": "../data/model_output/condition_grid",
+}
+
+
+def dh_scale(I: np.ndarray) -> np.ndarray:
+    """The ionic strength scale on which legendre.dh is linear."""
+    return np.sqrt(I) / (1 + 1.6 * np.sqrt(I))
+
+
+def inverse_dh_scale(s: np.ndarray) -> np.ndarray:
+    return (s / (1 - 1.6 * s)) ** 2
+
+
+GRID = {
+    "I": inverse_dh_scale(np.linspace(0, dh_scale(0.5), 13)).round(6).tolist(),
+    "t": np.arange(283.15, 323.16, 5).round(2).tolist(),
+    "pH": np.arange(4, 10.01, 0.25).round(2).tolist(),
+    "pMg": np.arange(0, 6.01, 0.5).round(2).tolist(),
+}
+AXIS_SCALES = {"I": dh_scale}  # interpolate on these scales
+N_DRAW = 400  # draws used for the mean and quantiles
+CHUNK_SIZE = 10000  # grid points transformed at once
+N_ERROR_POINTS = 2000
+TOLERANCE = 0.5  # kJ/mol
+TABLE_FILE = "dgf_prime.npy"
+METADATA_FILE = "grid.json"
+
+
+class ConditionGrid(NamedTuple):
+    """A table of compound dgf_prime values on a grid of conditions.
+
+    The table has axes (compound, I, t, pH, pMg, value), where values are
+    labelled e.g. "mean", "0.1", ... or "draw_0", "draw_1", ...
+
+    """
+    compound_ids: List[str]
+    axes: Dict[str, List[float]]
+    values: List[str]
+    table: np.ndarray
+    max_error: float = np.nan
+
+
+def get_grid_conditions(axes: Dict[str, Sequence[float]]) -> Dict[str, np.ndarray]:
+    """Get the conditions of every grid point, in C order."""
+    mesh = np.meshgrid(*(axes[k] for k in CONDITION_COLS), indexing="ij")
+    return {k: m.ravel().astype(float) for k, m in zip(CONDITION_COLS, mesh)}
+
+
+def get_value_labels(quantiles: Sequence[float], n_draw_table: int = None) -> List[str]:
+    """Get the value labels of a table of the mean and quantiles, or of
+    n_draw_table draws.
+
+    """
+    if n_draw_table is not None:
+        return [f"draw_{i}" for i in range(n_draw_table)]
+    return ["mean"] + [str(q) for q in quantiles]
+
+
+def get_transform_arrays(
+    microspecies: pd.DataFrame,
+    compound_ids: List[str],
+    draws: Dict[str, np.ndarray],
+    n_pka_cpd: np.ndarray,
+    n_pkmg_cpd: np.ndarray,
+) -> Tuple[LegendreIndex, np.ndarray, np.ndarray, np.ndarray]:
+    """Get the arguments of get_dgr_prime_from_arrays that don't depend on
+    conditions, with one "reaction" per compound.
+
+    :param draws: dictionary with two-dimensional arrays "dgf", "pka" and
+    "pkmg", each with one row per draw, laid out as in the Stan model.
+
+    """
+    index = cap_pk_orders(
+        get_formation_index(microspecies, compound_ids), n_pka_cpd, n_pkmg_cpd
+    )
+    pka_sum, pkmg_sum = (
+        get_ms_pk_sums(np.asarray(draws[p]), n, index.ms_cpd, order)
+        for p, n, order in [
+            ("pka", n_pka_cpd, index.pka_order),
+            ("pkmg", n_pkmg_cpd, index.pkmg_order),
+        ]
+    )
+    return index, np.asarray(draws["dgf"]), pka_sum, pkmg_sum
+
+
+def summarise_values(draws: np.ndarray, values: List[str]) -> np.ndarray:
+    """Get a (condition, value) array from a (draw, condition) array."""
+    if values[0] != "mean":
+        thin = np.linspace(0, len(draws) - 1, len(values)).round().astype(int)
+        return draws[thin].T
+    quantiles = [float(v) for v in values[1:]]
+    return np.column_stack([draws.mean(axis=0), *np.quantile(draws, quantiles, axis=0)])
+
+
+def get_compound_dgf_prime(
+    arrays: Tuple[LegendreIndex, np.ndarray, np.ndarray, np.ndarray],
+    cpd: int,
+    conditions: Dict[str, np.ndarray],
+) -> np.ndarray:
+    """Get a (draw, condition) array of one compound's dgf_prime.
+
+    Each microspecies's ddg_over_rt is the sum of a term that depends only on
+    the draw (its pk sums) and one that depends only on the condition, so the
+    sum over microspecies inside the logsumexp is a matrix product. This is
+    equivalent to get_dgr_prime_from_arrays, but much faster for many draws
+    and conditions. Conditions where the product underflows are computed the
+    slow way.
+
+    """
+    index, dgf, pka_sum, pkmg_sum = arrays
+    ms = np.arange(index.fst_ms[cpd], index.fst_ms[cpd] + index.n_ms[cpd])
+    I, t, pH, pMg = (conditions[k] for k in CONDITION_COLS)
+    a = LOG10 * (pka_sum[:, ms] + pkmg_sum[:, ms])
+    b = -get_ms_condition_terms(
+        index, ms[None, :], I[:, None], t[:, None], pH[:, None], pMg[:, None], R
+    )
+    a_max, b_max = a.max(axis=1, keepdims=True), b.max(axis=1, keepdims=True)
+    with np.errstate(divide="ignore"):
+        log_sum = np.log(np.exp(a - a_max) @ np.exp(b - b_max).T) + a_max + b_max.T
+    out = dgf[:, [cpd]] - R * t * log_sum
+    underflow = ~np.isfinite(out).all(axis=0)
+    if underflow.any():
+        out[:, underflow] = get_dgr_prime_from_arrays(
+            index, np.full(underflow.sum(), cpd), I[underflow], t[underflow],
+            pH[underflow], pMg[underflow], R, dgf, pka_sum, pkmg_sum,
+        )
+    return out
+
+
+def tabulate_dgf_prime(
+    microspecies: pd.DataFrame,
+    compound_ids: List[str],
+    draws: Dict[str, np.ndarray],
+    n_pka_cpd: np.ndarray,
+    n_pkmg_cpd: np.ndarray,
+    axes: Dict[str, Sequence[float]] = GRID,
+    values: List[str] = None,
+    table: np.ndarray = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> ConditionGrid:
+    """Tabulate the dgf_prime of some compounds on a grid of conditions.
+
+    :param values: labels of the tabulated values (see get_value_labels).
+    Defaults to the mean and QUANTILES.
+
+    :param table: optional output array with the right shape, e.g. a memmap.
+
+    """
+    arrays = get_transform_arrays(microspecies, compound_ids, draws, n_pka_cpd, n_pkmg_cpd)
+    if values is None:
+        values = get_value_labels(QUANTILES)
+    axes = {k: [float(x) for x in axes[k]] for k in CONDITION_COLS}
+    if table is None:
+        table = np.empty(get_table_shape(compound_ids, axes, values), dtype=np.float32)
+    conditions = get_grid_conditions(axes)
+    n_grid = len(conditions["I"])
+    for cpd in range(len(compound_ids)):
+        flat = table[cpd].reshape(n_grid, len(values))
+        for start in range(0, n_grid, chunk_size):
+            chunk = {k: v[start:start + chunk_size] for k, v in conditions.items()}
+            dgf_prime = get_compound_dgf_prime(arrays, cpd, chunk)
+            flat[start:start + chunk_size] = summarise_values(dgf_prime, values)
+    return ConditionGrid(list(compound_ids), axes, values, table)
+
+
+def get_table_shape(
+    compound_ids: List[str], axes: Dict[str, Sequence[float]], values: List[str]
+) -> Tuple[int, ...]:
+    return (len(compound_ids), *(len(axes[k]) for k in CONDITION_COLS), len(values))
+
+
+def get_cell_weights(
+    axis: Sequence[float], x: np.ndarray, scale: Callable = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the lower grid position and upper weight of each x along an axis."""
+    axis = np.asarray(axis, dtype=float)
+    x = np.asarray(x, dtype=float)
+    if (x < axis[0]).any() or (x > axis[-1]).any():
+        raise ValueError(f"Conditions outside the grid [{axis[0]}, {axis[-1]}].")
+    if len(axis) == 1:
+        return np.zeros(len(x), dtype=int), np.zeros(len(x))
+    if scale is not None:
+        axis, x = scale(axis), scale(x)
+    lo = np.clip(np.searchsorted(axis, x, side="right") - 1, 0, len(axis) - 2)
+    return lo, (x - axis[lo]) / (axis[lo + 1] - axis[lo])
+
+
+def interpolate_dgf_prime(
+    grid: ConditionGrid,
+    compound_ids: Sequence[str],
+    I: np.ndarray,
+    t: np.ndarray,
+    pH: np.ndarray,
+    pMg: np.ndarray,
+) -> np.ndarray:
+    """Get a (query, value) array of interpolated dgf_prime for some
+    (compound, condition) pairs.
+
+    """
+    cpd = pd.Index(grid.compound_ids).get_indexer(list(compound_ids))
+    if (cpd == -1).any():
+        raise ValueError("Some compounds are not in the grid.")
+    cells = [
+        get_cell_weights(grid.axes[k], x, AXIS_SCALES.get(k))
+        for k, x in zip(CONDITION_COLS, (I, t, pH, pMg))
+    ]
+    out = np.zeros((len(cpd), len(grid.values)))
+    for corner in itertools.product([0, 1], repeat=len(cells)):
+        weight = np.ones(len(cpd))
+        ix = [cpd]
+        for (lo, w), upper, k in zip(cells, corner, CONDITION_COLS):
+            weight *= w if upper else 1 - w
+            ix.append(np.minimum(lo + upper, len(grid.axes[k]) - 1))
+        out += weight[:, None] * grid.table[tuple(ix)]
+    return out
+
+
+def interpolate_dgr_prime(
+    grid: ConditionGrid,
+    reaction: Dict[str, float],
+    I: np.ndarray,
+    t: np.ndarray,
+    pH: np.ndarray,
+    pMg: np.ndarray,
+) -> np.ndarray:
+    """Get a reaction's interpolated dgr_prime.
+
+    The conditions are broadcast together, e.g. a column of pH values and a
+    row of pMg values give a pH/pMg landscape, and the output has their
+    shape plus one axis for values. Only meaningful for tables of means or
+    draws (see the module docstring).
+
+    """
+    conditions = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (I, t, pH, pMg)))
+    flat = [c.ravel() for c in conditions]
+    n = len(flat[0])
+    out = sum(
+        coef * interpolate_dgf_prime(grid, [c] * n, *flat)
+        for c, coef in reaction.items()
+    )
+    return out.reshape(conditions[0].shape + (len(grid.values),))
+
+
+def get_interpolation_error(
+    grid: ConditionGrid,
+    microspecies: pd.DataFrame,
+    draws: Dict[str, np.ndarray],
+    n_pka_cpd: np.ndarray,
+    n_pkmg_cpd: np.ndarray,
+    n_point: int = N_ERROR_POINTS,
+    seed: int = 1234,
+) -> float:
+    """Get the biggest absolute difference between interpolated values and
+    exact ones at random conditions.
+
+    The draws must be the ones that the grid was tabulated from.
+
+    """
+    rng = np.random.default_rng(seed)
+    cpd = rng.integers(len(grid.compound_ids), size=n_point)
+    conditions = {
+        k: rng.uniform(grid.axes[k][0], grid.axes[k][-1], n_point) for k in CONDITION_COLS
+    }
+    arrays = get_transform_arrays(
+        microspecies, grid.compound_ids, draws, n_pka_cpd, n_pkmg_cpd
+    )
+    index, dgf, pka_sum, pkmg_sum = arrays
+    exact = summarise_values(
+        get_dgr_prime_from_arrays(
+            index, cpd, *(conditions[k] for k in CONDITION_COLS), R,
+            dgf, pka_sum, pkmg_sum,
+        ),
+        grid.values,
+    )
+    interpolated = interpolate_dgf_prime(
+        grid,
+        [grid.compound_ids[c] for c in cpd],
+        *(conditions[k] for k in CONDITION_COLS),
+    )
+    return float(np.abs(interpolated - exact).max())
+
+
+def write_grid(grid: ConditionGrid, grid_folder: str):
+    """Write a grid's metadata, and its table unless it is already a memmap
+    of the table file.
+
+    """
+    os.makedirs(grid_folder, exist_ok=True)
+    table_path = os.path.join(grid_folder, TABLE_FILE)
+    if getattr(grid.table, "filename", None) != os.path.abspath(table_path):
+        np.save(table_path, grid.table)
+    metadata = {
+        "compound_ids": grid.compound_ids,
+        "axes": grid.axes,
+        "values": grid.values,
+        "max_error": grid.max_error,
+    }
+    with open(os.path.join(grid_folder, METADATA_FILE), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+def load_grid(grid_folder: str, mmap_mode: str = "r") -> ConditionGrid:
+    """Load a grid, by default memory-mapping its table."""
+    with open(os.path.join(grid_folder, METADATA_FILE), "r") as f:
+        metadata = json.load(f)
+    table = np.load(os.path.join(grid_folder, TABLE_FILE), mmap_mode=mmap_mode)
+    return ConditionGrid(table=table, **metadata)
+
+
+def main():
+    here = os.path.dirname(os.path.realpath(__file__))
+    n_draw_table = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    grid_folder = os.path.join(here, RELPATHS["grid_folder"])
+    draws_folder = os.path.join(here, RELPATHS["draws_folder"])
+    stan_codes = json.load(open(os.path.join(here, RELPATHS["stan_codes"]), "r"))
+    compound_ids = list(stan_codes["compound_id"].keys())
+    microspecies = pd.read_csv(
+        os.path.join(here, RELPATHS["microspecies"]), index_col=0
+    ).loc[lambda df: df["compound_id"].isin(compound_ids)]
+    n_pka_cpd, n_pkmg_cpd = get_pk_counts(microspecies, compound_ids)
+    draws = {}
+    for p, d in load_flat_draws(draws_folder, ["dgf", "pka", "pkmg"]).items():
+        thin = np.linspace(0, len(d) - 1, min(N_DRAW, len(d))).round().astype(int)
+        draws[p] = d[thin]
+    values = get_value_labels(QUANTILES, n_draw_table)
+    os.makedirs(grid_folder, exist_ok=True)
+    table = np.lib.format.open_memmap(
+        os.path.join(grid_folder, TABLE_FILE),
+        mode="w+",
+        dtype=np.float32,
+        shape=get_table_shape(compound_ids, GRID, values),
+    )
+    print(f"Tabulating dgf_prime with shape {table.shape}.")
+    grid = tabulate_dgf_prime(
+        microspecies, compound_ids, draws, n_pka_cpd, n_pkmg_cpd,
+        values=values, table=table,
+    )
+    table.flush()
+    max_error = get_interpolation_error(
+        grid, microspecies, draws, n_pka_cpd, n_pkmg_cpd
+    )
+    print(f"Largest interpolation error: {max_error:.3f} kJ/mol.")
+    if max_error > TOLERANCE:
+        print(f"Warning: this is more than the tolerance of {TOLERANCE} kJ/mol.")
+    write_grid(grid._replace(max_error=max_error), grid_folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Convert cmdstan output csv files into a binary draws store.
+
+The store is a folder with one .npy file per variable, each holding a
+(chain, draw, dim) float array, and a manifest.json file with the variables'
+shapes, dimension names and coordinates. Consumers open variables with
+load_draws, which memory-maps the .npy file rather than parsing any text.
+
+"""
+
+import json
+import math
+import numpy as np
+import os
+import pandas as pd
+from typing import Any, Dict, List, Tuple
+from instrument import instrumented
+from stan_csv import (
+    CHUNKSIZE, get_variable_columns, get_variable_names, iter_stan_csv,
+    read_stan_csv_header
+)
+
+RELPATHS = {
+    "samples_folder": "../data/model_output/samples",
+    "stan_codes": "../data/model_input/stan_codes.json",
+    "tecrdb": "../data/model_input/tecrdb.csv",
+    "pkas": "../data/model_input/pkas.csv",
+    "pkmgs": "../data/model_input/pkmgs.csv",
+    "draws_folder": "../data/model_output/draws",
+}
+MANIFEST = "manifest.json"
+DIMS = {
+    "dgf": ["compound"],
+    "dgf_z": ["compound"],
+    "pka": ["pka"],
+    "pkmg": ["pkmg"],
+    "dgr_prime": ["measurement"],
+    "log_lik_dgr": ["measurement"],
+    "kpr_rep": ["measurement"],
+}
+
+
+def get_model_coords(
+    stan_codes: Dict, tecrdb: pd.DataFrame, pkas: pd.DataFrame, pkmgs: pd.DataFrame
+) -> Dict[str, List[Any]]:
+    """Get the coordinates of the dimensions in DIMS."""
+    return {
+        "compound": list(stan_codes["compound_id"].keys()),
+        "pka": pkas.index.tolist(),
+        "pkmg": pkmgs.index.tolist(),
+        "measurement": tecrdb.index.tolist(),
+    }
+
+
+def get_n_draws(path: str, config: Dict[str, str]) -> int:
+    """Get the number of saved post-warmup draws in a csv file.
+
+    Output of the generate_quantities method doesn't record the number of
+    draws in its header, so in that case the rows are counted.
+
+    """
+    if "num_samples" in config:
+        return math.ceil(int(config["num_samples"]) / int(config.get("thin", "1")))
+    with open(path, "r") as f:
+        return sum(1 for line in f if not line.startswith("#")) - 1
+
+
+def get_variable_entry(
+    variable: str, shape: Tuple[int, ...], dims: Dict[str, List[str]]
+) -> Dict[str, Any]:
+    """Get a variable's entry in a draws store manifest."""
+    return {
+        "file": variable + ".npy",
+        "shape": list(shape),
+        "dims": ["chain", "draw"] + dims.get(variable, [variable + "_dim_0"]),
+    }
+
+
+def write_draws_store(
+    csvs: List[str],
+    store_folder: str,
+    coords: Dict[str, List[Any]] = None,
+    dims: Dict[str, List[str]] = None,
+    chunksize: int = CHUNKSIZE,
+    update: bool = False,
+) -> Dict[str, Any]:
+    """Write the post-warmup draws in some csv files to a draws store, one
+    chain per file, and return its manifest.
+
+    The csvs are read one chunk at a time, so the draws never need to fit in
+    memory.
+
+    :param update: if True, add the csvs' variables to an existing store with
+    the same number of chains and draws, e.g. after re-running generated
+    quantities, rather than replacing it.
+
+    """
+    coords = coords or {}
+    dims = dims or {}
+    config, columns = read_stan_csv_header(csvs[0])
+    n_draws = get_n_draws(csvs[0], config)
+    variables = get_variable_names(columns)
+    variable_columns = get_variable_columns(columns, variables)
+    os.makedirs(store_folder, exist_ok=True)
+    manifest: Dict[str, Any] = {
+        "method": config.get("method", "sample"),
+        "chains": len(csvs),
+        "draws": n_draws,
+        "coords": coords,
+        "variables": {},
+    }
+    if update and os.path.exists(os.path.join(store_folder, MANIFEST)):
+        existing = load_manifest(store_folder)
+        if (existing["chains"], existing["draws"]) != (len(csvs), n_draws):
+            raise ValueError(
+                f"Can't add {len(csvs)} chains of {n_draws} draws to a store "
+                f"with {existing['chains']} chains of {existing['draws']} draws."
+            )
+        manifest["method"] = existing.get("method", manifest["method"])
+        manifest["variables"] = existing["variables"]
+        manifest["coords"] = {**existing["coords"], **coords}
+    arrays = {}
+    for v, cols in variable_columns.items():
+        shape = (len(csvs), n_draws, len(cols))
+        arrays[v] = np.lib.format.open_memmap(
+            os.path.join(store_folder, v + ".npy"), mode="w+", shape=shape
+        )
+        manifest["variables"][v] = get_variable_entry(v, shape, dims)
+    for chain, csv in enumerate(csvs):
+        start = 0
+        for chunk in iter_stan_csv(csv, variables, chunksize):
+            stop = start + len(chunk[variables[0]])
+            if stop > n_draws:
+                raise ValueError(f"{csv} has more than {n_draws} draws.")
+            for v, draws in chunk.items():
+                arrays[v][chain, start:stop] = draws
+            start = stop
+        if start != n_draws:
+            raise ValueError(f"{csv} has {start} draws, expected {n_draws}.")
+    for a in arrays.values():
+        a.flush()
+    with open(os.path.join(store_folder, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def write_draws_array(
+    draws: np.ndarray,
+    columns: List[str],
+    store_folder: str,
+    method: str,
+    coords: Dict[str, List[Any]] = None,
+    dims: Dict[str, List[str]] = None,
+) -> Dict[str, Any]:
+    """Write a (chain, draw, column) array of draws with cmdstan column names
+    to a draws store, and return its manifest.
+
+    This is for draws that are already in memory, such as the output of
+    cmdstan's variational or optimize methods.
+
+    """
+    coords = coords or {}
+    dims = dims or {}
+    columns = [
+        c.replace("[", ".").replace("]", "").replace(",", ".") for c in columns
+    ]
+    variable_columns = get_variable_columns(columns, get_variable_names(columns))
+    os.makedirs(store_folder, exist_ok=True)
+    manifest: Dict[str, Any] = {
+        "method": method,
+        "chains": draws.shape[0],
+        "draws": draws.shape[1],
+        "coords": coords,
+        "variables": {},
+    }
+    for v, cols in variable_columns.items():
+        ix = [columns.index(c) for c in cols]
+        np.save(os.path.join(store_folder, v + ".npy"), draws[:, :, ix])
+        manifest["variables"][v] = get_variable_entry(
+            v, (draws.shape[0], draws.shape[1], len(ix)), dims
+        )
+    with open(os.path.join(store_folder, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(store_folder: str) -> Dict[str, Any]:
+    """Get the manifest of a draws store."""
+    with open(os.path.join(store_folder, MANIFEST), "r") as f:
+        return json.load(f)
+
+
+def load_draws(store_folder: str, variable: str, mmap_mode: str = "r") -> np.ndarray:
+    """Get a memory-mapped (chain, draw, dim) array of a variable's draws."""
+    manifest = load_manifest(store_folder)
+    if variable not in manifest["variables"]:
+        raise ValueError(f"Variable {variable} not in draws store {store_folder}.")
+    path = os.path.join(store_folder, manifest["variables"][variable]["file"])
+    return np.load(path, mmap_mode=mmap_mode)
+
+
+def load_flat_draws(store_folder: str, variables: List[str]) -> Dict[str, np.ndarray]:
+    """Get memory-mapped (chain * draw, dim) arrays of some variables' draws."""
+    out = {}
+    for v in variables:
+        d = load_draws(store_folder, v)
+        out[v] = d.reshape(-1, d.shape[-1])
+    return out
+
+
+def load_model_coords() -> Dict[str, List[Any]]:
+    """Get the model's coordinates from the model input files."""
+    here = os.path.dirname(os.path.realpath(__file__))
+    stan_codes = json.load(open(os.path.join(here, RELPATHS["stan_codes"]), "r"))
+    tecrdb = pd.read_csv(os.path.join(here, RELPATHS["tecrdb"]), index_col=0)
+    pkas, pkmgs = (
+        pd.read_csv(os.path.join(here, RELPATHS[k]), index_col=0)
+        for k in ["pkas", "pkmgs"]
+    )
+    return get_model_coords(stan_codes, tecrdb, pkas, pkmgs)
+
+
+def write_model_draws_store(csv_folder: str, update: bool = False):
+    """Write the csvs in a folder to the model's draws store, with
+    coordinates from the model input files.
+
+    """
+    here = os.path.dirname(os.path.realpath(__file__))
+    csvs = sorted(
+        os.path.join(csv_folder, f)
+        for f in os.listdir(csv_folder)
+        if f.endswith("csv")
+    )
+    write_draws_store(
+        csvs,
+        os.path.join(here, RELPATHS["draws_folder"]),
+        coords=load_model_coords(),
+        dims=DIMS,
+        update=update,
+    )
+
+
+@instrumented("draws_store")
+def main():
+    here = os.path.dirname(os.path.realpath(__file__))
+    write_model_draws_store(os.path.join(here, RELPATHS["samples_folder"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,12 @@
 
 import os
 from urllib.request import urlretrieve
+from instrument import instrumented
 
 URL = "https://www.ncbi.nlm.nih.gov/pmc/articles/PMC6129446/bin/mmc2.xlsx"
 OUTPATH = "../data/raw/mmc2.xlsx"
 
+@instrumented("fetch_data")
 def main(url, outpath):
     urlretrieve(url, outpath)
 
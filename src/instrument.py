@@ -0,0 +1,247 @@
+"""Record how long the pipeline's stages take and how much memory they use.
+
+A script's main function is decorated with instrumented, and its stages are
+wrapped in "with stage(name):" blocks, which can be nested and are no-ops
+outside an instrumented run. Every run writes a json log to the log folder
+with, for each stage, its wall time, CPU time of this process and of its
+child processes (e.g. CmdStan), and peak resident memory.
+
+On Linux the peak memory of this process is reset at the start of each
+stage, so it is the stage's own peak; elsewhere it is the peak of the whole
+run so far, as recorded in "peak_rss_scope". Child processes' peak memory is
+always the biggest of any child so far.
+
+To profile a stage, set the environment variable FORMATION_PROFILE to its
+name, optionally followed by ":tracemalloc" (the default is cProfile), e.g.
+
+    FORMATION_PROFILE=get_microspecies python process_data.py
+
+which writes a .prof file, readable with pstats or snakeviz, next to the
+log. Set FORMATION_LOG_DIR to write the logs somewhere else.
+
+"""
+
+import cProfile
+import functools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+RELPATHS = {"log_folder": "../data/logs"}
+ENV_LOG_FOLDER = "FORMATION_LOG_DIR"
+ENV_PROFILE = "FORMATION_PROFILE"
+PROFILERS = ["cprofile", "tracemalloc"]
+N_TRACEMALLOC_LINES = 30
+
+ACTIVE_RUN: Optional["Run"] = None
+
+
+def get_peak_rss() -> Dict[str, Optional[int]]:
+    """Get the peak resident memory in bytes of this process and of its
+    biggest finished child process.
+
+    """
+    out: Dict[str, Optional[int]] = {"self": None, "children": None}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    out["self"] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        # ru_maxrss is in kilobytes on linux and bytes on macos
+        unit = 1 if sys.platform == "darwin" else 1024
+        if out["self"] is None:
+            out["self"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+        out["children"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+    return out
+
+
+def reset_peak_rss() -> bool:
+    """Try to reset this process's peak resident memory, which only works on
+    Linux, and return whether it worked.
+
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_cpu_times() -> Dict[str, float]:
+    t = os.times()
+    return {
+        "self": t.user + t.system,
+        "children": t.children_user + t.children_system,
+    }
+
+
+class Run:
+    """The stages of one instrumented run of a script."""
+
+    def __init__(self, script: str, log_folder: str, profile: str = None):
+        self.script = script
+        self.log_folder = log_folder
+        self.started = datetime.now(timezone.utc)
+        self.stem = f"{script}-{self.started.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.stages: List[Dict[str, Any]] = []
+        self.stack: List[str] = []
+        self.peaks: List[int] = []  # peak memory so far of each open stage
+        self.start = time.perf_counter()
+        self.profile_stage, self.profiler = None, None
+        if profile:
+            name, _, profiler = profile.partition(":")
+            profiler = profiler or "cprofile"
+            if profiler not in PROFILERS:
+                raise ValueError(f"Unknown profiler {profiler}; choose from {PROFILERS}.")
+            self.profile_stage, self.profiler = name, profiler
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+        self.stack.append(name)
+        full_name = "/".join(self.stack)
+        record: Dict[str, Any] = {
+            "name": full_name, "start": time.perf_counter() - self.start
+        }
+        profile = self.profile_stage in (name, full_name)
+        if profile and self.profiler == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif profile:
+            tracemalloc.start()
+        self.update_peaks(get_peak_rss()["self"])
+        scope = "stage" if reset_peak_rss() else "process"
+        self.peaks.append(0)
+        cpu_start = get_cpu_times()
+        wall_start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = repr(e)
+            raise
+        finally:
+            record["wall"] = time.perf_counter() - wall_start
+            cpu_end = get_cpu_times()
+            record["cpu"] = cpu_end["self"] - cpu_start["self"]
+            record["cpu_children"] = cpu_end["children"] - cpu_start["children"]
+            peak = get_peak_rss()
+            self.update_peaks(peak["self"])
+            record["peak_rss"] = self.peaks.pop()
+            self.update_peaks(record["peak_rss"])
+            record["peak_rss_children"] = peak["children"]
+            record["peak_rss_scope"] = scope
+            if profile:
+                record["profile"] = self.write_profile(
+                    full_name, profiler if self.profiler == "cprofile" else None
+                )
+            self.stages.append(record)
+            self.stack.pop()
+
+    def update_peaks(self, rss: Optional[int]):
+        """Include a measurement of peak memory in the open stages' peaks,
+        which is necessary because starting a stage resets the peak.
+
+        """
+        if rss is not None:
+            self.peaks = [max(p, rss) for p in self.peaks]
+
+    def write_profile(self, name: str, profiler: cProfile.Profile = None) -> str:
+        """Write the profile of a stage and return its path."""
+        os.makedirs(self.log_folder, exist_ok=True)
+        stem = os.path.join(self.log_folder, f"{self.stem}-{name.replace('/', '.')}")
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(stem + ".prof")
+            return stem + ".prof"
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(stem + ".tracemalloc.txt", "w") as f:
+            f.write(f"traced memory: current {current} bytes, peak {peak} bytes\n")
+            for s in snapshot.statistics("lineno")[:N_TRACEMALLOC_LINES]:
+                f.write(f"{s}\n")
+        return stem + ".tracemalloc.txt"
+
+    def write(self, error: str = None) -> str:
+        """Write the run's json log and return its path."""
+        os.makedirs(self.log_folder, exist_ok=True)
+        path = os.path.join(self.log_folder, self.stem + ".json")
+        log = {
+            "script": self.script,
+            "argv": sys.argv,
+            "started": self.started.isoformat(timespec="seconds"),
+            "wall": time.perf_counter() - self.start,
+            "python": platform.python_version(),
+            "error": error,
+            "stages": sorted(self.stages, key=lambda s: s["start"]),
+        }
+        with open(path, "w") as f:
+            json.dump(log, f, indent=2)
+        return path
+
+
+@contextmanager
+def stage(name: str) -> Iterator[Optional[Dict[str, Any]]]:
+    """Record a stage of the active run, if there is one.
+
+    The yielded record can be given extra information, e.g. the number of
+    rows processed.
+
+    """
+    if ACTIVE_RUN is None:
+        yield None
+    else:
+        with ACTIVE_RUN.stage(name) as record:
+            yield record
+
+
+def instrumented(script: str, log_folder: str = None) -> Callable:
+    """Decorate a script's main function so that calling it records a run.
+
+    If a run is already active, e.g. when one script's main calls another's,
+    the call is recorded as a stage of that run instead.
+
+    """
+    if log_folder is None:
+        here = os.path.dirname(os.path.realpath(__file__))
+        log_folder = os.path.join(here, RELPATHS["log_folder"])
+
+    def decorator(main: Callable) -> Callable:
+        @functools.wraps(main)
+        def wrapper(*args, **kwargs):
+            global ACTIVE_RUN
+            if ACTIVE_RUN is not None:
+                with stage(script):
+                    return main(*args, **kwargs)
+            ACTIVE_RUN = Run(
+                script,
+                os.environ.get(ENV_LOG_FOLDER, log_folder),
+                os.environ.get(ENV_PROFILE),
+            )
+            error = None
+            try:
+                return main(*args, **kwargs)
+            except BaseException as e:
+                error = repr(e)
+                raise
+            finally:
+                run, ACTIVE_RUN = ACTIVE_RUN, None
+                print(f"Wrote timings to {run.write(error)}")
+
+        return wrapper
+
+    return decorator
@@ -3,7 +3,35 @@
 import numpy as np
 import pandas as pd
 from scipy.special import logsumexp
-from typing import Dict, List
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+LOG10 = np.log(10)
+# source for these numbers:
+# https://gitlab.com/equilibrator/equilibrator-cache/-/blob/develop/src/equilibrator_cache/thermodynamic_constants.py
+DGFMG = -455.3
+DHFMG = -467.0
+
+
+class LegendreIndex(NamedTuple):
+    """Precompiled array layout of some reactions, compounds and microspecies.
+
+    Compound and reaction positions are zero-based. Microspecies are sorted so
+    that each compound's microspecies are contiguous, starting at fst_ms.
+
+    """
+    reaction_ids: List[str]
+    compound_ids: List[str]
+    fst_stoic: np.ndarray
+    n_stoic: np.ndarray
+    stoic_cpd: np.ndarray
+    stoic_coef: np.ndarray
+    fst_ms: np.ndarray
+    n_ms: np.ndarray
+    ms_cpd: np.ndarray
+    nh: np.ndarray
+    charge: np.ndarray
+    pka_order: np.ndarray
+    pkmg_order: np.ndarray
 
 
 def dh(temperature: float, ionic_strength: float) -> float:
@@ -34,14 +62,11 @@ def lt(
 ) -> float:
     """Get the condition-specific formation energy of a microspecies using a
     Legendre transform.
-
-    source for the hardcoded numbers: 
-    https://gitlab.com/equilibrator/equilibrator-cache/-/blob/develop/src/equilibrator_cache/thermodynamic_constants.py
     """
-    log10 = np.log(10)
+    log10 = LOG10
     RT = R * t
-    dgfmg = -455.3
-    dhfmg = -467.0
+    dgfmg = DGFMG
+    dhfmg = DHFMG
     dgfmg_prime = (t / 298.15) * dgfmg + (1.0 - t / 298.15) * dhfmg
     nMg = len(pkmgs) + 1;
     ddg_over_rt = (
@@ -118,3 +143,277 @@ def get_dgr_prime(
         dgf_prime = -RT * logsumexp(-1 * np.array(ms_dgf_primes) / RT);
         out += coef * dgf_prime
     return out
+
+
+def get_legendre_index(
+    microspecies: pd.DataFrame,
+    stoichiometry: pd.DataFrame,
+    compound_ids: List[str] = None,
+) -> LegendreIndex:
+    """Compile microspecies and stoichiometry tables into a LegendreIndex.
+
+    :param microspecies: dataframe with columns "compound_id", "nh", "nmg" and
+    "charge".
+
+    :param stoichiometry: dataframe with columns "reaction_id", "compound_id"
+    and "coefficient".
+
+    :param compound_ids: optional compound order, e.g. matching the order of a
+    vector of Stan parameters. Defaults to sorted compound ids.
+
+    """
+    if compound_ids is None:
+        compound_ids = sorted(stoichiometry["compound_id"].unique())
+    compound_ids = list(compound_ids)
+    cpd_ix = pd.Index(compound_ids)
+    stoichiometry = stoichiometry.sort_values("reaction_id", kind="stable")
+    stoic_cpd = cpd_ix.get_indexer(stoichiometry["compound_id"])
+    if (stoic_cpd == -1).any():
+        raise ValueError("Stoichiometry contains compounds not in compound_ids.")
+    ms = (
+        microspecies
+        .assign(cpd=cpd_ix.get_indexer(microspecies["compound_id"]))
+        .loc[lambda df: df["cpd"] != -1]
+        .sort_values(["cpd", "nh", "nmg"], kind="stable")
+    )
+    n_ms = np.bincount(ms["cpd"], minlength=len(compound_ids))
+    if (n_ms == 0).any():
+        missing = [c for c, n in zip(compound_ids, n_ms) if n == 0]
+        raise ValueError(f"No microspecies for compounds {missing}.")
+    pka_order, pkmg_order = (
+        ms.groupby("cpd")[n].rank(method="dense").subtract(1).astype(int)
+        for n in ["nh", "nmg"]
+    )
+    rxn_codes, rxn_ids = pd.factorize(stoichiometry["reaction_id"], sort=True)
+    n_stoic = np.bincount(rxn_codes, minlength=len(rxn_ids))
+    return LegendreIndex(
+        reaction_ids=list(rxn_ids),
+        compound_ids=compound_ids,
+        fst_stoic=np.cumsum(n_stoic) - n_stoic,
+        n_stoic=n_stoic,
+        stoic_cpd=stoic_cpd,
+        stoic_coef=stoichiometry["coefficient"].to_numpy(dtype=float),
+        fst_ms=np.cumsum(n_ms) - n_ms,
+        n_ms=n_ms,
+        ms_cpd=ms["cpd"].to_numpy(),
+        nh=ms["nh"].to_numpy(dtype=float),
+        charge=ms["charge"].to_numpy(dtype=float),
+        pka_order=pka_order.to_numpy(),
+        pkmg_order=pkmg_order.to_numpy(),
+    )
+
+
+def get_formation_index(
+    microspecies: pd.DataFrame, compound_ids: List[str]
+) -> LegendreIndex:
+    """Get a LegendreIndex with one "reaction" per compound, with the same id
+    and position as the compound, whose dgr_prime is the compound's dgf_prime.
+
+    """
+    formation = pd.DataFrame({
+        "reaction_id": compound_ids, "compound_id": compound_ids, "coefficient": 1.0
+    })
+    index = get_legendre_index(microspecies, formation, compound_ids)
+    if index.reaction_ids != list(compound_ids):
+        # get_legendre_index sorts reactions, so keep the compound order
+        index = index._replace(
+            reaction_ids=list(compound_ids),
+            fst_stoic=np.arange(len(compound_ids)),
+            stoic_cpd=np.arange(len(compound_ids)),
+        )
+    return index
+
+
+def cap_pk_orders(
+    index: LegendreIndex, n_pka_cpd: np.ndarray, n_pkmg_cpd: np.ndarray
+) -> LegendreIndex:
+    """Truncate the index's pk orders to the number of pks each compound has.
+
+    This matches get_dgr_prime, where a microspecies's number of bound ions
+    and its pk sums both come from the pks that are available.
+
+    """
+    return index._replace(
+        pka_order=np.minimum(index.pka_order, n_pka_cpd[index.ms_cpd]),
+        pkmg_order=np.minimum(index.pkmg_order, n_pkmg_cpd[index.ms_cpd]),
+    )
+
+
+def ragged_range(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatenate the ranges starts[i]:starts[i]+lengths[i]."""
+    offsets = np.cumsum(lengths) - lengths
+    within = np.arange(lengths.sum()) - np.repeat(offsets, lengths)
+    return np.repeat(starts, lengths) + within
+
+
+def segment_logsumexp(x: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """logsumexp over contiguous, non-empty segments of the last axis of x."""
+    starts = np.cumsum(lengths) - lengths
+    seg_max = np.maximum.reduceat(x, starts, axis=-1)
+    summed = np.add.reduceat(
+        np.exp(x - np.repeat(seg_max, lengths, axis=-1)), starts, axis=-1
+    )
+    return np.log(summed) + seg_max
+
+
+def get_ms_pk_sums(
+    pk: np.ndarray,
+    n_pk_cpd: np.ndarray,
+    ms_cpd: np.ndarray,
+    ms_order: np.ndarray,
+) -> np.ndarray:
+    """Get each microspecies's sum of the pks separating it from its compound's
+    least-bound state.
+
+    :param pk: array whose last axis contains every compound's pks, ordered as
+    in the compound index and then by binding order.
+
+    :param n_pk_cpd: number of pks of every compound in the index (can be
+    zero).
+
+    :param ms_cpd: compound position of every microspecies.
+
+    :param ms_order: number of pks separating each microspecies from its
+    compound's least-bound state. Following get_dgr_prime, this is truncated
+    to the number of pks available.
+
+    """
+    cumulative = np.concatenate(
+        [np.zeros(pk.shape[:-1] + (1,)), np.cumsum(pk, axis=-1)], axis=-1
+    )
+    fst_pk = np.cumsum(n_pk_cpd) - n_pk_cpd
+    n_pk = np.minimum(ms_order, n_pk_cpd[ms_cpd])
+    first = fst_pk[ms_cpd]
+    return cumulative[..., first + n_pk] - cumulative[..., first]
+
+
+def flatten_pk_dict(
+    pk: Dict[str, List[float]], compound_ids: List[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Get a flat pk array and per-compound counts from a dictionary of pks."""
+    lists = [list(pk.get(cid, [])) for cid in compound_ids]
+    n_pk_cpd = np.array([len(pks) for pks in lists], dtype=int)
+    return np.array([p for pks in lists for p in pks], dtype=float), n_pk_cpd
+
+
+def get_ms_condition_terms(
+    index: LegendreIndex,
+    ms: np.ndarray,
+    I: np.ndarray,
+    t: np.ndarray,
+    pH: np.ndarray,
+    pMg: np.ndarray,
+    R: float,
+) -> np.ndarray:
+    """Get the part of some microspecies's ddg_over_rt that depends on the
+    condition, i.e. everything except the pk sums.
+
+    :param ms: microspecies positions, broadcastable with the conditions.
+
+    """
+    RT = R * t
+    nH = index.nh[ms]
+    n_bound_mg = index.pkmg_order[ms]
+    nMg = n_bound_mg + 1
+    dgfmg_prime = (t / 298.15) * DGFMG + (1.0 - t / 298.15) * DHFMG
+    return (
+        nH * RT * LOG10 * pH
+        + nMg * (RT * LOG10 * pMg - dgfmg_prime)
+        + dh(t, I) * (nH + 4 * nMg - index.charge[ms] ** 2)
+        + n_bound_mg * DGFMG / RT
+    )
+
+
+def get_dgr_prime_from_arrays(
+    index: LegendreIndex,
+    rxn: np.ndarray,
+    I: np.ndarray,
+    t: np.ndarray,
+    pH: np.ndarray,
+    pMg: np.ndarray,
+    R: float,
+    dgf: np.ndarray,
+    pka_sum: np.ndarray,
+    pkmg_sum: np.ndarray,
+) -> np.ndarray:
+    """Get the Gibbs energy change of reactions in many conditions at once.
+
+    The parameter arrays dgf (one column per compound in the index), pka_sum
+    and pkmg_sum (one column per microspecies, see get_ms_pk_sums) may have
+    leading axes, for example one per posterior draw, in which case the output
+    has the same leading axes followed by one axis for conditions.
+
+    :param rxn: zero-based index position of each condition's reaction.
+
+    """
+    rxn = np.asarray(rxn)
+    # one entry per (condition, reactant) pair
+    n_pair = index.n_stoic[rxn]
+    pair_stoic = ragged_range(index.fst_stoic[rxn], n_pair)
+    pair_cpd = index.stoic_cpd[pair_stoic]
+    pair_cond = np.repeat(np.arange(len(rxn)), n_pair)
+    # one entry per (condition, reactant, microspecies) triple
+    n_flat = index.n_ms[pair_cpd]
+    flat_ms = ragged_range(index.fst_ms[pair_cpd], n_flat)
+    flat_cond = np.repeat(pair_cond, n_flat)
+    RT = R * t[flat_cond]
+    ddg_over_rt = (
+        get_ms_condition_terms(
+            index,
+            flat_ms,
+            I[flat_cond],
+            t[flat_cond],
+            pH[flat_cond],
+            pMg[flat_cond],
+            R,
+        )
+        - LOG10 * (pka_sum[..., flat_ms] + pkmg_sum[..., flat_ms])
+    )
+    ms_dgf_prime = dgf[..., np.repeat(pair_cpd, n_flat)] + ddg_over_rt * RT
+    RT_pair = R * t[pair_cond]
+    dgf_prime = -RT_pair * segment_logsumexp(-ms_dgf_prime / RT, n_flat)
+    return np.add.reduceat(
+        index.stoic_coef[pair_stoic] * dgf_prime,
+        np.cumsum(n_pair) - n_pair,
+        axis=-1,
+    )
+
+
+def get_dgr_prime_batch(
+    index: LegendreIndex,
+    reaction_ids: Iterable[str],
+    I: Iterable[float],
+    t: Iterable[float],
+    pH: Iterable[float],
+    pMg: Iterable[float],
+    R: float,
+    pka: Dict[str, List[float]],
+    pkmg: Dict[str, List[float]],
+    dgf: Dict[str, float],
+    chunk_size: int = 100000,
+) -> np.ndarray:
+    """Get the Gibbs energy change of many (reaction, condition) pairs.
+
+    Equivalent to calling get_dgr_prime once per condition, but vectorised.
+    Conditions are processed chunk_size at a time to bound memory use.
+
+    """
+    rxn = pd.Index(index.reaction_ids).get_indexer(list(reaction_ids))
+    if (rxn == -1).any():
+        raise ValueError("Some reactions are not in the index.")
+    I, t, pH, pMg = (np.asarray(a, dtype=float) for a in (I, t, pH, pMg))
+    dgf_arr = np.array([dgf[cid] for cid in index.compound_ids], dtype=float)
+    (pka_arr, n_pka_cpd), (pkmg_arr, n_pkmg_cpd) = (
+        flatten_pk_dict(pk, index.compound_ids) for pk in (pka, pkmg)
+    )
+    index = cap_pk_orders(index, n_pka_cpd, n_pkmg_cpd)
+    pka_sum = get_ms_pk_sums(pka_arr, n_pka_cpd, index.ms_cpd, index.pka_order)
+    pkmg_sum = get_ms_pk_sums(pkmg_arr, n_pkmg_cpd, index.ms_cpd, index.pkmg_order)
+    out = np.empty(len(rxn))
+    for start in range(0, len(rxn), chunk_size):
+        c = slice(start, start + chunk_size)
+        out[c] = get_dgr_prime_from_arrays(
+            index, rxn[c], I[c], t[c], pH[c], pMg[c], R,
+            dgf_arr, pka_sum, pkmg_sum
+        )
+    return out
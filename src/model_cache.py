@@ -0,0 +1,131 @@
+"""A content-addressed cache of compiled Stan models.
+
+Executables are stored in a directory named after a hash of the Stan program,
+every file it includes, the compiler options and the cmdstan version, so an
+unchanged model is never recompiled, whatever the file modification times.
+Set the environment variable FORMATION_MODEL_CACHE to share the cache
+between checkouts, CI jobs or worker nodes.
+
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+from cmdstanpy import CmdStanModel, cmdstan_path
+from typing import Dict, List
+
+here = os.path.dirname(os.path.realpath(__file__))
+MODEL_CACHE_DIR = os.environ.get(
+    "FORMATION_MODEL_CACHE", os.path.join(here, "../.model_cache")
+)
+INCLUDE_REGEX = re.compile(r'^\s*#include\s+[<"]?([^\s">]+)[">]?', re.MULTILINE)
+
+
+def find_include(name: str, directories: List[str]) -> str:
+    """Get the path of an included file, searching directories in order."""
+    for d in directories:
+        path = os.path.join(d, name)
+        if os.path.exists(path):
+            return os.path.realpath(path)
+    raise FileNotFoundError(f"Could not find included file {name} in {directories}")
+
+
+def get_stan_sources(stan_file: str, include_paths: List[str] = None) -> List[str]:
+    """Get the paths of a Stan file and everything it includes, recursively,
+    in the order they are included.
+
+    """
+    include_paths = include_paths or []
+    out: List[str] = []
+    to_visit = [os.path.realpath(stan_file)]
+    while to_visit:
+        path = to_visit.pop(0)
+        if path in out:
+            continue
+        out.append(path)
+        with open(path, "r") as f:
+            names = INCLUDE_REGEX.findall(f.read())
+        directories = [os.path.dirname(path)] + include_paths
+        to_visit += [find_include(name, directories) for name in names]
+    return out
+
+
+def get_model_hash(
+    stan_file: str,
+    cmdstan_version: str,
+    include_paths: List[str] = None,
+    stanc_options: Dict = None,
+    cpp_options: Dict = None,
+) -> str:
+    """Get a hash of everything that affects a compiled model.
+
+    Included files are hashed by name and contents, so the include
+    directories themselves are left out and the hash doesn't depend on where
+    the repository is checked out.
+
+    """
+    h = hashlib.sha256()
+    for path in get_stan_sources(stan_file, include_paths):
+        with open(path, "rb") as f:
+            h.update(os.path.basename(path).encode())
+            h.update(f.read())
+    stanc_options = {
+        k: v for k, v in (stanc_options or {}).items() if k != "include_paths"
+    }
+    options = {
+        "stanc_options": stanc_options,
+        "cpp_options": cpp_options or {},
+        "cmdstan_version": cmdstan_version,
+    }
+    h.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def get_model(
+    stan_file: str,
+    include_paths: List[str] = None,
+    cpp_options: Dict = None,
+    cache_dir: str = MODEL_CACHE_DIR,
+) -> CmdStanModel:
+    """Get a CmdStanModel, compiling it only if it is not already cached.
+
+    :param include_paths: extra directories to search for included files,
+    apart from the directory containing stan_file.
+
+    """
+    include_paths = [os.path.realpath(p) for p in include_paths or []]
+    stanc_options = {"include_paths": include_paths} if include_paths else None
+    cmdstan_version = os.path.basename(os.path.realpath(cmdstan_path()))
+    key = get_model_hash(
+        stan_file, cmdstan_version, include_paths, stanc_options, cpp_options
+    )
+    name = os.path.splitext(os.path.basename(stan_file))[0]
+    model_dir = os.path.join(cache_dir, key)
+    exe_files = (
+        [f for f in os.listdir(model_dir) if os.path.splitext(f)[0] == name]
+        if os.path.isdir(model_dir) else []
+    )
+    if not exe_files:
+        compiled = CmdStanModel(
+            stan_file=stan_file,
+            compile=False,
+            stanc_options=stanc_options,
+            cpp_options=cpp_options,
+        )
+        # force, as cmdstanpy would otherwise reuse any newer executable
+        compiled.compile(force=True)
+        os.makedirs(model_dir, exist_ok=True)
+        exe_name = os.path.basename(compiled.exe_file)
+        tmp = os.path.join(model_dir, f".{exe_name}.{os.getpid()}")
+        shutil.copy2(compiled.exe_file, tmp)
+        os.replace(tmp, os.path.join(model_dir, exe_name))
+        exe_files = [exe_name]
+    return CmdStanModel(
+        stan_file=stan_file,
+        exe_file=os.path.join(model_dir, exe_files[0]),
+        compile=False,
+        stanc_options=stanc_options,
+        cpp_options=cpp_options,
+    )
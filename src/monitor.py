@@ -0,0 +1,232 @@
+"""Sample while monitoring convergence, stopping as soon as possible.
+
+The chains are run as cmdstan processes whose output csvs are tailed while
+they are written. Every few seconds the new post-warmup draws of a few key
+variables are appended to what has been read so far, and rank-normalised
+R-hat and bulk and tail effective sample sizes are computed. Sampling stops
+early once every monitored quantity has converged with the target ESS, and
+is aborted if the chains are clearly failing to mix.
+
+When sampling stops early, the chains' csvs are truncated to the same
+number of draws, and their headers are corrected, so they can be used
+exactly like the output of a full run.
+
+"""
+
+import arviz as az
+import json
+import numpy as np
+import os
+import subprocess
+import time
+from typing import Any, Dict, List
+from cmdstanpy.cmdstan_args import CmdStanArgs, SamplerArgs
+from cmdstanpy.stanfit import RunSet
+from stan_csv import get_n_warmup_rows, get_variable_columns, read_stan_csv_header
+
+MONITOR_VARIABLES = ["dgf", "pka"]
+TARGET_ESS = 400
+TARGET_RHAT = 1.01
+ABORT_RHAT = 2.0  # chains with an R-hat this big after MIN_DRAWS have failed
+MIN_DRAWS = 100
+CHECK_INTERVAL = 10.0  # seconds
+SAMPLER_ARGS = [
+    "iter_warmup", "iter_sampling", "save_warmup", "thin", "max_treedepth",
+    "metric", "step_size", "adapt_delta", "adapt_init_phase",
+    "adapt_metric_window", "adapt_step_size",
+]
+
+
+class SamplingAborted(RuntimeError):
+    """The chains were stopped because they weren't converging."""
+
+
+def get_runset(
+    model, data: Dict, sample_args: Dict[str, Any], output_dir: str
+) -> RunSet:
+    """Get cmdstan commands and output files for some CmdStanModel.sample
+    arguments.
+
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    data_path = os.path.join(output_dir, "data.json")
+    with open(data_path, "w") as f:
+        json.dump(data, f)
+    chains = sample_args.get("chains", 4)
+    args = CmdStanArgs(
+        model.name,
+        model.exe_file,
+        chain_ids=list(range(1, chains + 1)),
+        data=data_path,
+        seed=sample_args.get("seed"),
+        inits=sample_args.get("inits"),
+        output_dir=output_dir,
+        method_args=SamplerArgs(
+            **{k: v for k, v in sample_args.items() if k in SAMPLER_ARGS}
+        ),
+    )
+    args.validate()
+    return RunSet(args=args, chains=chains)
+
+
+def new_tail() -> Dict[str, Any]:
+    """Get the state of a csv file that hasn't been read yet."""
+    return {"offset": 0, "columns": None, "n_skip": 0, "draws": []}
+
+
+def read_new_draws(path: str, tail: Dict[str, Any], variables: List[str]):
+    """Read the complete rows that have been written to a csv since it was
+    last read, appending a (draw, column) array of the variables' post-warmup
+    draws to tail["draws"].
+
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        f.seek(tail["offset"])
+        new = f.read()
+    complete = new[:new.rfind(b"\n") + 1]
+    tail["offset"] += len(complete)
+    rows = []
+    for line in complete.decode().splitlines():
+        if line.startswith("#"):
+            continue
+        elif tail["columns"] is None:
+            config, columns = read_stan_csv_header(path)
+            variable_columns = get_variable_columns(columns, variables)
+            tail["columns"] = [
+                columns.index(c) for cols in variable_columns.values() for c in cols
+            ]
+            tail["n_skip"] = get_n_warmup_rows(config)
+        elif tail["n_skip"] > 0:
+            tail["n_skip"] -= 1
+        else:
+            rows.append(line.split(","))
+    if rows:
+        tail["draws"].append(np.array(rows)[:, tail["columns"]].astype(float))
+
+
+def get_diagnostics(draws: np.ndarray) -> Dict[str, float]:
+    """Get the worst R-hat and ESS of any column of a (chain, draw, column)
+    array.
+
+    """
+    dataset = az.convert_to_dataset(draws)
+    return {
+        "rhat": float(np.nanmax(az.rhat(dataset, method="rank").to_array())),
+        "ess_bulk": float(np.nanmin(az.ess(dataset, method="bulk").to_array())),
+        "ess_tail": float(np.nanmin(az.ess(dataset, method="tail").to_array())),
+    }
+
+
+def check_convergence(
+    diagnostics: Dict[str, float],
+    target_ess: float = TARGET_ESS,
+    target_rhat: float = TARGET_RHAT,
+    abort_rhat: float = ABORT_RHAT,
+) -> str:
+    """Get "converged", "diverged" or "running" from some diagnostics."""
+    if diagnostics["rhat"] > abort_rhat:
+        return "diverged"
+    elif (
+        diagnostics["rhat"] < target_rhat
+        and min(diagnostics["ess_bulk"], diagnostics["ess_tail"]) >= target_ess
+    ):
+        return "converged"
+    return "running"
+
+
+def truncate_csv(path: str, n_draws: int):
+    """Keep only the first n_draws post-warmup draws of a csv, and record the
+    new number of draws in its header.
+
+    """
+    config, _ = read_stan_csv_header(path)
+    n_keep = get_n_warmup_rows(config) + n_draws
+    thin = int(config.get("thin", "1"))
+    tmp_path = path + ".tmp"
+    with open(path, "r") as f_in, open(tmp_path, "w") as f_out:
+        seen_columns = False
+        for line in f_in:
+            if line.startswith("#"):
+                if not seen_columns and line.lstrip(" #").startswith("num_samples"):
+                    line = line.split("=")[0] + f"= {n_draws * thin}\n"
+                f_out.write(line)
+            elif not seen_columns:
+                seen_columns = True
+                f_out.write(line)
+            elif n_keep > 0 and line.endswith("\n"):
+                f_out.write(line)
+                n_keep -= 1
+    os.replace(tmp_path, path)
+
+
+def sample_with_monitor(
+    model,
+    data: Dict,
+    sample_args: Dict[str, Any],
+    output_dir: str,
+    variables: List[str] = MONITOR_VARIABLES,
+    target_ess: float = TARGET_ESS,
+    check_interval: float = CHECK_INTERVAL,
+) -> List[str]:
+    """Sample with all chains in parallel, stopping once the variables have
+    converged, and return the output csv files.
+
+    :raises SamplingAborted: if the chains are diverging from each other.
+
+    """
+    runset = get_runset(model, data, sample_args, output_dir)
+    env = {
+        **os.environ,
+        "STAN_NUM_THREADS": str(sample_args.get("threads_per_chain", 1))
+    }
+    procs = []
+    for cmd, stdout_file in zip(runset.cmds, runset.stdout_files):
+        with open(stdout_file, "w") as stdout:
+            procs.append(subprocess.Popen(
+                cmd, stdout=stdout, stderr=subprocess.STDOUT, env=env
+            ))
+    tails = [new_tail() for _ in procs]
+    n_draws, status = 0, "running"
+    try:
+        while status == "running":
+            finished = all(p.poll() is not None for p in procs)
+            if not finished:
+                time.sleep(check_interval)
+            for path, tail in zip(runset.csv_files, tails):
+                read_new_draws(path, tail, variables)
+            n_draws = min(sum(len(d) for d in t["draws"]) for t in tails)
+            if n_draws >= MIN_DRAWS:
+                draws = np.stack([np.concatenate(t["draws"])[:n_draws] for t in tails])
+                diagnostics = get_diagnostics(draws)
+                status = check_convergence(diagnostics, target_ess)
+                print(
+                    f"{n_draws} draws per chain: max R-hat {diagnostics['rhat']:.3f}, "
+                    f"min bulk ESS {diagnostics['ess_bulk']:.0f}, "
+                    f"min tail ESS {diagnostics['ess_tail']:.0f}",
+                    flush=True,
+                )
+            if finished:
+                break
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.terminate()
+            p.wait()
+    if status == "diverged":
+        raise SamplingAborted(
+            f"Stopped sampling after {n_draws} draws per chain, as the chains "
+            f"aren't mixing (max R-hat {diagnostics['rhat']:.2f})."
+        )
+    if status == "running":  # every chain ran to the end
+        failed = [i + 1 for i, p in enumerate(procs) if p.returncode != 0]
+        if failed:
+            raise RuntimeError(
+                f"Chains {failed} failed; see {runset.stdout_files[failed[0] - 1]}."
+            )
+        return runset.csv_files
+    print(f"Converged after {n_draws} draws per chain.", flush=True)
+    for path in runset.csv_files:
+        truncate_csv(path, n_draws)
+    return runset.csv_files
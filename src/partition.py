@@ -0,0 +1,293 @@
+"""Split the model into independent parts and fit them in parallel.
+
+Reactions and compounds form a bipartite graph, and reactions in different
+connected components of this graph share no parameters, so their posteriors
+are independent. The components are grouped into shards with similar numbers
+of measurements, each shard is fitted as a separate, smaller model in its own
+process, and the shards' draws are merged into the usual draws store, with
+the same coordinates as a fit of the whole model.
+
+Some compounds, like water, take part in so many reactions that they would
+join almost everything into one component. Compounds in SHARED_COMPOUNDS
+don't link reactions: they are fitted in every shard that they appear in,
+and their merged draws come from the shard with most measurements involving
+them. This is an approximation, which is only sensible for compounds whose
+formation energy is pinned down by its prior.
+
+Usage:
+
+    python partition.py [n_shards]
+
+"""
+
+import json
+import numpy as np
+import os
+import pandas as pd
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from typing import Any, Dict, List
+from draws_store import (
+    DIMS, MANIFEST, get_model_coords, get_variable_entry, load_draws,
+    load_manifest, write_draws_store
+)
+from model_cache import get_model
+from prepare_stan_input import (
+    get_model_tables, get_output_flags, get_stan_codes, get_stan_input
+)
+from run_model import CPP_OPTIONS, GRAINSIZE, OUTPUT_PROFILE, SAMPLE_ARGS
+
+RELPATHS = {
+    "model": "stan/model.stan",
+    "partition_folder": "../data/model_output/partition",
+    "draws_folder": "../data/model_output/draws",
+}
+SHARED_COMPOUNDS = ["CHB_15377"]  # water
+N_SHARDS = max(1, (os.cpu_count() or 1) // SAMPLE_ARGS["chains"])
+
+
+def get_components(
+    stoichiometry: pd.DataFrame, shared_compounds: List[str] = SHARED_COMPOUNDS
+) -> pd.Series:
+    """Get the connected component of each reaction, numbered from 0."""
+    reactions = pd.Index(sorted(stoichiometry["reaction_id"].unique()))
+    links = stoichiometry.loc[~stoichiometry["compound_id"].isin(shared_compounds)]
+    compounds = pd.Index(links["compound_id"].unique())
+    n = len(reactions) + len(compounds)
+    graph = coo_matrix(
+        (
+            np.ones(len(links)),
+            (
+                reactions.get_indexer(links["reaction_id"]),
+                len(reactions) + compounds.get_indexer(links["compound_id"]),
+            ),
+        ),
+        shape=(n, n),
+    )
+    _, labels = connected_components(graph, directed=False)
+    return pd.Series(pd.factorize(labels[:len(reactions)])[0], index=reactions)
+
+
+def get_shards(
+    components: pd.Series, tecrdb: pd.DataFrame, n_shards: int
+) -> pd.Series:
+    """Get the shard of each reaction, numbered from 0.
+
+    Components are assigned, biggest first, to the shard with the fewest
+    measurements so far.
+
+    """
+    sizes = (
+        tecrdb["reaction_id"].map(components).value_counts()
+        .reindex(components.unique(), fill_value=0)
+        .sort_values(ascending=False, kind="stable")
+    )
+    loads = np.zeros(min(n_shards, len(sizes)))
+    shard_of = {}
+    for component, size in sizes.items():
+        shard_of[component] = int(np.argmin(loads))
+        loads[shard_of[component]] += size
+    return components.map(shard_of)
+
+
+def get_shard_input(
+    tables: Dict[str, pd.DataFrame],
+    stan_codes: Dict[str, Dict[str, int]],
+    reaction_ids: List[str],
+    owner: pd.Series,
+    shard: int,
+) -> Dict[str, Any]:
+    """Get the Stan input and coordinates of a shard, and where its elements go
+    in the whole model.
+
+    The returned "index" maps each of the dimensions "compound", "pka", "pkmg"
+    and "measurement" to the global position of each of the shard's elements, or
+    -1 for elements that the shard doesn't own.
+
+    """
+    in_shard = tables["tecrdb"]["reaction_id"].isin(reaction_ids)
+    tecrdb = tables["tecrdb"].loc[in_shard].copy()
+    stoichiometry = (
+        tables["stoichiometry"]
+        .loc[lambda df: df["reaction_id"].isin(reaction_ids)]
+        .reset_index(drop=True)
+    )
+    cids = stoichiometry["compound_id"].unique()
+    compounds, microspecies = (
+        tables[k].loc[lambda df: df["compound_id"].isin(cids)].copy()
+        for k in ["compounds", "microspecies"]
+    )
+    pka_in_shard = tables["pkas"]["compound_id"].isin(cids)
+    pkas = tables["pkas"].loc[pka_in_shard]
+    pkmg_in_shard = tables["pkmgs"]["compound_id"].isin(cids)
+    pkmgs = tables["pkmgs"].loc[pkmg_in_shard]
+    shard_codes = get_stan_codes(stoichiometry)
+    stan_input = get_stan_input(
+        tecrdb,
+        stoichiometry,
+        microspecies,
+        compounds,
+        pkas.reset_index(drop=True),
+        pkmgs.reset_index(drop=True),
+        shard_codes,
+    )
+    shard_cpds = list(shard_codes["compound_id"].keys())
+    is_owner = owner.loc[shard_cpds].to_numpy() == shard
+    cpd_ix = np.array([stan_codes["compound_id"][c] - 1 for c in shard_cpds])
+    pka_ix, pkmg_ix = (
+        np.flatnonzero(pk_in_shard.to_numpy())
+        for pk_in_shard in [pka_in_shard, pkmg_in_shard]
+    )
+    pka_owned, pkmg_owned = (
+        owner.loc[pks["compound_id"]].to_numpy() == shard for pks in [pkas, pkmgs]
+    )
+    return {
+        "stan_input": stan_input,
+        "coords": get_model_coords(shard_codes, tecrdb, pkas, pkmgs),
+        "index": {
+            "compound": np.where(is_owner, cpd_ix, -1).tolist(),
+            "pka": np.where(pka_owned, pka_ix, -1).tolist(),
+            "pkmg": np.where(pkmg_owned, pkmg_ix, -1).tolist(),
+            "measurement": np.flatnonzero(in_shard.to_numpy()).tolist(),
+        },
+    }
+
+
+def get_owners(tables: Dict[str, pd.DataFrame], shards: pd.Series) -> pd.Series:
+    """Get the shard with the most measurements involving each compound."""
+    n_measurement = tables["tecrdb"]["reaction_id"].value_counts()
+    stoichiometry = tables["stoichiometry"]
+    return (
+        pd.DataFrame({
+            "compound_id": stoichiometry["compound_id"],
+            "shard": stoichiometry["reaction_id"].map(shards),
+            "n": stoichiometry["reaction_id"].map(n_measurement).fillna(0),
+        })
+        .groupby(["compound_id", "shard"])["n"].sum()
+        .reset_index()
+        .sort_values(["n", "shard"], ascending=[False, True], kind="stable")
+        .groupby("compound_id")["shard"].first()
+    )
+
+
+def get_partition(
+    tables: Dict[str, pd.DataFrame],
+    stan_codes: Dict[str, Dict[str, int]],
+    n_shards: int = N_SHARDS,
+    shared_compounds: List[str] = SHARED_COMPOUNDS,
+) -> List[Dict[str, Any]]:
+    """Get the inputs of each shard (see get_shard_input)."""
+    components = get_components(tables["stoichiometry"], shared_compounds)
+    shards = get_shards(components, tables["tecrdb"], n_shards)
+    owner = get_owners(tables, shards)
+    return [
+        get_shard_input(
+            tables, stan_codes, shards.index[shards == s].tolist(), owner, s
+        )
+        for s in sorted(shards.unique())
+    ]
+
+
+def fit_shard(
+    stan_input: Dict[str, Any],
+    coords: Dict[str, List[Any]],
+    shard_folder: str,
+    sample_args: Dict[str, Any],
+) -> str:
+    """Sample from a shard's model and return the folder of its draws store."""
+    here = os.path.dirname(os.path.realpath(__file__))
+    model = get_model(os.path.join(here, RELPATHS["model"]), cpp_options=CPP_OPTIONS)
+    sample_dir = os.path.join(shard_folder, "samples")
+    os.makedirs(sample_dir, exist_ok=True)
+    mcmc = model.sample(data=stan_input, output_dir=sample_dir, **sample_args)
+    store_folder = os.path.join(shard_folder, "draws")
+    write_draws_store(mcmc.runset.csv_files, store_folder, coords=coords, dims=DIMS)
+    return store_folder
+
+
+def merge_draws(
+    store_folders: List[str],
+    indexes: List[Dict[str, List[int]]],
+    store_folder: str,
+    coords: Dict[str, List[Any]],
+    dims: Dict[str, List[str]] = DIMS,
+) -> Dict[str, Any]:
+    """Merge the draws stores of some shards into one store, and return its
+    manifest.
+
+    Only the variables in dims are merged. Chain i of the merged store is
+    made of chain i of every shard, which is a valid draw from the joint
+    posterior because the shards are independent.
+
+    """
+    manifests = [load_manifest(f) for f in store_folders]
+    n_chains = {m["chains"] for m in manifests}
+    if len(n_chains) > 1:
+        raise ValueError(f"Shards have different numbers of chains: {n_chains}.")
+    n_chain = n_chains.pop()
+    n_draw = min(m["draws"] for m in manifests)
+    variables = [
+        v for v in dims if all(v in m["variables"] for m in manifests)
+    ]
+    os.makedirs(store_folder, exist_ok=True)
+    manifest: Dict[str, Any] = {
+        "method": manifests[0].get("method", "sample"),
+        "chains": n_chain,
+        "draws": n_draw,
+        "coords": coords,
+        "variables": {},
+    }
+    for v in variables:
+        shape = (n_chain, n_draw, len(coords[dims[v][0]]))
+        out = np.lib.format.open_memmap(
+            os.path.join(store_folder, v + ".npy"), mode="w+", shape=shape
+        )
+        out[:] = np.nan
+        for folder, index in zip(store_folders, indexes):
+            ix = np.array(index[dims[v][0]], dtype=int)
+            owned = ix >= 0
+            out[:, :, ix[owned]] = load_draws(folder, v)[:, :n_draw][:, :, owned]
+        out.flush()
+        manifest["variables"][v] = get_variable_entry(v, shape, dims)
+    with open(os.path.join(store_folder, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    here = os.path.dirname(os.path.realpath(__file__))
+    n_shards = int(sys.argv[1]) if len(sys.argv) > 1 else N_SHARDS
+    partition_folder = os.path.join(here, RELPATHS["partition_folder"])
+    tables = get_model_tables()
+    stan_codes = get_stan_codes(tables["stoichiometry"])
+    partition = get_partition(tables, stan_codes, n_shards)
+    print(f"Fitting {len(partition)} shards.")
+    for shard in partition:
+        shard["stan_input"]["grainsize"] = GRAINSIZE
+        shard["stan_input"].update(get_output_flags(OUTPUT_PROFILE))
+    get_model(os.path.join(here, RELPATHS["model"]), cpp_options=CPP_OPTIONS)
+    shard_folders = [
+        os.path.join(partition_folder, f"shard-{i + 1}") for i in range(len(partition))
+    ]
+    with ProcessPoolExecutor(len(partition)) as executor:
+        store_folders = list(executor.map(
+            fit_shard,
+            [s["stan_input"] for s in partition],
+            [s["coords"] for s in partition],
+            shard_folders,
+            [SAMPLE_ARGS] * len(partition),
+        ))
+    merge_draws(
+        store_folders,
+        [s["index"] for s in partition],
+        os.path.join(here, RELPATHS["draws_folder"]),
+        get_model_coords(
+            stan_codes, tables["tecrdb"], tables["pkas"], tables["pkmgs"]
+        ),
+    )
+
+
+if __name__ == "__main__":
+    main()
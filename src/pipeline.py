@@ -0,0 +1,471 @@
+"""Run the pipeline's stages, skipping any whose inputs haven't changed.
+
+This does the same job as the Makefile, but decides what to rebuild from
+the contents of files rather than their modification times. Each stage's key
+is a hash of its command, its inputs and its code, i.e. its script and the
+local modules that the script imports, with comments, docstrings and
+formatting ignored. The outputs of every run are saved in a
+content-addressed cache under their stage's key, so that:
+
+   - a stage whose key is unchanged and whose outputs are intact is skipped;
+   - a stage whose key was seen before, e.g. on another branch, has its
+     outputs restored from the cache instead of being run;
+   - a stage that does run but produces the same outputs as before doesn't
+     cause the stages after it to run.
+
+Stages that don't depend on each other are run at the same time.
+
+Usage:
+
+    python pipeline.py run [stage ...] [--jobs 2] [--force stage ...] [--dry-run]
+    python pipeline.py adopt
+
+Without stage names, every stage is run. "adopt" records the existing
+outputs of every stage as up to date with its current inputs, which avoids
+rebuilding everything the first time the pipeline is used.
+
+"""
+
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List, NamedTuple, Optional, Set
+from util import hash_file
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+ROOT = os.path.dirname(HERE)
+RELPATHS = {"cache": ".pipeline_cache"}  # relative to the repository root
+PYTHON = sys.executable
+JOBS = 2
+
+RAW_DATA = ["data/raw/mmc2.xlsx"]
+PROCESSED_DATA = [
+    "data/processed/microspecies.csv",
+    "data/processed/tecrdb.csv",
+    "data/processed/compounds.csv",
+]
+MODEL_INPUT = [
+    "data/model_input/compounds.csv",
+    "data/model_input/pkas.csv",
+    "data/model_input/stan_codes.json",
+    "data/model_input/tecrdb.csv",
+    "data/model_input/stan_model_input.r",
+    "data/model_input/stan_model_input.json",
+    "data/model_input/pkmgs.csv",
+]
+STAN_FILES = ["src/stan/*.stan"]
+SAMPLE_FILES = ["data/model_output/samples/samples-*.csv"]
+WARM_START = ["data/model_output/warm_start/**"]
+DRAWS_STORE = [
+    "data/model_output/draws/manifest.json", "data/model_output/draws/*.npy"
+]
+ANALYSIS = ["analysis/img/*.png"]
+PREDICTIONS = [
+    "data/model_output/dgr_prime_pred.npy", "data/model_output/dgr_prime_pred.csv"
+]
+CONDITION_GRID = ["data/model_output/condition_grid/*"]
+PAPER = ["paper.pdf"]
+
+
+class Stage(NamedTuple):
+    """A step of the pipeline.
+
+    Inputs and outputs are glob patterns relative to the repository root.
+    Python scripts in the command are hashed as code, along with the local
+    modules they import.
+
+    """
+    name: str
+    command: List[str]
+    inputs: List[str]
+    outputs: List[str]
+
+
+STAGES = [
+    Stage("fetch_data", [PYTHON, "src/fetch_data.py"], [], RAW_DATA),
+    Stage("process_data", [PYTHON, "src/process_data.py"], RAW_DATA, PROCESSED_DATA),
+    Stage(
+        "prepare_stan_input",
+        [PYTHON, "src/prepare_stan_input.py"],
+        PROCESSED_DATA,
+        MODEL_INPUT,
+    ),
+    Stage(
+        "run_model",
+        [PYTHON, "src/run_model.py"],
+        MODEL_INPUT + STAN_FILES,
+        SAMPLE_FILES + WARM_START,
+    ),
+    Stage(
+        "draws_store",
+        [PYTHON, "src/draws_store.py"],
+        SAMPLE_FILES + MODEL_INPUT[1:4] + MODEL_INPUT[6:],
+        DRAWS_STORE,
+    ),
+    Stage(
+        "analyse_output",
+        [PYTHON, "src/analyse_output.py"],
+        DRAWS_STORE + MODEL_INPUT[:4] + ["src/sparse.mplstyle"],
+        ANALYSIS,
+    ),
+    Stage(
+        "predict",
+        [PYTHON, "src/predict.py"],
+        DRAWS_STORE + PROCESSED_DATA[:2] + MODEL_INPUT[2:4],
+        PREDICTIONS,
+    ),
+    Stage(
+        "condition_grid",
+        [PYTHON, "src/condition_grid.py"],
+        DRAWS_STORE + PROCESSED_DATA[:1] + MODEL_INPUT[2:3],
+        CONDITION_GRID,
+    ),
+    Stage(
+        "paper",
+        [
+            "pandoc", "paper.org", "-o", "paper.pdf", "--from=org",
+            "--highlight-style=pygments", "--pdf-engine=xelatex",
+            "--bibliography=bibliography.bib",
+        ],
+        ["paper.org", "bibliography.bib"] + ANALYSIS,
+        PAPER,
+    ),
+]
+
+
+def get_upstream(stages: List[Stage]) -> Dict[str, Set[str]]:
+    """Get the names of the stages whose outputs each stage uses."""
+    return {
+        s.name: {
+            other.name for other in stages
+            if other.name != s.name and set(other.outputs) & set(s.inputs)
+        }
+        for s in stages
+    }
+
+
+def hash_bytes(b: bytes) -> str:
+    return hashlib.sha256(b).hexdigest()
+
+
+def normalise_python(source: str) -> str:
+    """Get a representation of some python code that ignores comments,
+    docstrings and formatting.
+
+    """
+    tree = ast.parse(source)
+    for node in ast.walk(tree):
+        if isinstance(
+            node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+        ):
+            body = node.body
+            if (
+                body and isinstance(body[0], ast.Expr)
+                and isinstance(body[0].value, ast.Constant)
+                and isinstance(body[0].value.value, str)
+            ):
+                node.body = body[1:] or [ast.Pass()]
+    return ast.dump(tree)
+
+
+def get_local_imports(path: str, src_folder: str = HERE) -> Set[str]:
+    """Get the paths of the modules in src_folder that a python file imports,
+    directly or indirectly, including the file itself.
+
+    """
+    out: Set[str] = set()
+    todo = [os.path.realpath(path)]
+    while todo:
+        current = todo.pop()
+        if current in out:
+            continue
+        out.add(current)
+        with open(current, "r") as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [a.name for a in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                candidate = os.path.join(src_folder, name.split(".")[0] + ".py")
+                if os.path.exists(candidate):
+                    todo.append(os.path.realpath(candidate))
+    return out
+
+
+class Cache:
+    """Content-addressed storage of files, and of the outputs of each stage's
+    runs.
+
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.stat_path = os.path.join(folder, "stat_cache.json")
+        self.lock = threading.Lock()
+        self.stats: Dict[str, List] = {}
+        if os.path.exists(self.stat_path):
+            with open(self.stat_path, "r") as f:
+                self.stats = json.load(f)
+
+    def hash_file(self, path: str) -> str:
+        """Hash a file, trusting the previous hash if its size and
+        modification time haven't changed.
+
+        """
+        st = os.stat(path)
+        with self.lock:
+            cached = self.stats.get(path)
+        if cached is not None and cached[:2] == [st.st_size, st.st_mtime_ns]:
+            return cached[2]
+        digest = hash_file(path)
+        with self.lock:
+            self.stats[path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.folder, "objects", digest[:2], digest)
+
+    def entry_path(self, stage: str, key: str) -> str:
+        return os.path.join(self.folder, "stages", stage, key + ".json")
+
+    def store(self, path: str) -> str:
+        """Copy a file into the cache and return its hash."""
+        digest = self.hash_file(path)
+        object_path = self.object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp = f"{object_path}.{threading.get_ident()}.tmp"
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, object_path)
+        return digest
+
+    def restore(self, digest: str, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(self.object_path(digest), path)
+
+    def get_entry(self, stage: str, key: str) -> Optional[Dict[str, str]]:
+        try:
+            with open(self.entry_path(stage, key), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put_entry(self, stage: str, key: str, outputs: Dict[str, str]):
+        path = self.entry_path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(outputs, f, indent=2)
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with self.lock, open(self.stat_path, "w") as f:
+            json.dump(self.stats, f)
+
+
+def expand(patterns: List[str], root: str = ROOT) -> List[str]:
+    """Get the paths of the files matching some glob patterns, relative to
+    root.
+
+    """
+    paths = set()
+    for p in patterns:
+        for match in glob.glob(os.path.join(root, p), recursive=True):
+            if os.path.isfile(match):
+                paths.add(os.path.relpath(match, root))
+    return sorted(paths)
+
+
+def get_stage_key(stage: Stage, cache: Cache, root: str = ROOT) -> str:
+    """Get a hash of a stage's command, code and inputs.
+
+    :raises FileNotFoundError: if an input pattern matches no files.
+
+    """
+    code = {}
+    for arg in stage.command:
+        path = os.path.join(root, arg)
+        if arg.endswith(".py") and os.path.exists(path):
+            for module in sorted(get_local_imports(path)):
+                with open(module, "r") as f:
+                    source = normalise_python(f.read())
+                code[os.path.relpath(module, root)] = hash_bytes(source.encode())
+    inputs = {}
+    for pattern in stage.inputs:
+        matches = expand([pattern], root)
+        if not matches:
+            raise FileNotFoundError(f"No inputs match {pattern} for stage {stage.name}.")
+        inputs.update({p: cache.hash_file(os.path.join(root, p)) for p in matches})
+    command = [os.path.basename(a) if a == PYTHON else a for a in stage.command]
+    description = {"command": command, "code": code, "inputs": inputs}
+    return hash_bytes(json.dumps(description, sort_keys=True).encode())
+
+
+def get_outputs(stage: Stage, cache: Cache, root: str = ROOT) -> Dict[str, str]:
+    return {p: cache.hash_file(os.path.join(root, p)) for p in expand(stage.outputs, root)}
+
+
+def outputs_match(stage: Stage, entry: Dict[str, str], cache: Cache, root: str = ROOT) -> bool:
+    return expand(stage.outputs, root) == sorted(entry) and all(
+        cache.hash_file(os.path.join(root, p)) == h for p, h in entry.items()
+    )
+
+
+def run_stage(
+    stage: Stage, cache: Cache, force: bool = False, dry_run: bool = False,
+    root: str = ROOT,
+) -> str:
+    """Bring a stage's outputs up to date and return what was done."""
+    if not stage.inputs and expand(stage.outputs, root) and not force:
+        return "up to date (no inputs)"
+    key = get_stage_key(stage, cache, root)
+    entry = cache.get_entry(stage.name, key)
+    if entry is not None and not force:
+        if outputs_match(stage, entry, cache, root):
+            return "up to date"
+        if dry_run:
+            return "would restore from cache"
+        for p in expand(stage.outputs, root):
+            os.remove(os.path.join(root, p))
+        for p, digest in entry.items():
+            cache.restore(digest, os.path.join(root, p))
+        return "restored from cache"
+    if dry_run:
+        return "would run"
+    start = time.perf_counter()
+    subprocess.run(stage.command, cwd=root, check=True)
+    outputs = get_outputs(stage, cache, root)
+    missing = [p for p in stage.outputs if not expand([p], root)]
+    if missing:
+        raise FileNotFoundError(f"Stage {stage.name} didn't write {missing}.")
+    cache.put_entry(stage.name, key, {p: cache.store(os.path.join(root, p)) for p in outputs})
+    return f"ran in {time.perf_counter() - start:.1f}s"
+
+
+def select_stages(stages: List[Stage], targets: List[str]) -> List[Stage]:
+    """Get the stages needed to make some target stages, in pipeline order."""
+    by_name = {s.name: s for s in stages}
+    unknown = set(targets) - set(by_name)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}; choose from {list(by_name)}.")
+    upstream = get_upstream(stages)
+    needed: Set[str] = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(upstream[name])
+    return [s for s in stages if s.name in needed]
+
+
+def run_pipeline(
+    stages: List[Stage],
+    cache: Cache,
+    jobs: int = JOBS,
+    force: List[str] = None,
+    dry_run: bool = False,
+    root: str = ROOT,
+) -> Dict[str, str]:
+    """Run some stages in dependency order, with independent stages running
+    at the same time, and return what was done for each stage.
+
+    In a dry run, stages after one that would run are reported as "waiting",
+    as their inputs aren't known yet.
+
+    """
+    force = set(force or [])
+    names = {s.name for s in stages}
+    upstream = {k: v & names for k, v in get_upstream(stages).items() if k in names}
+    results: Dict[str, str] = {}
+    running: Dict[Future, Stage] = {}
+    failed = False
+
+    def is_ready(s: Stage) -> bool:
+        return all(u in results for u in upstream[s.name])
+
+    with ThreadPoolExecutor(jobs) as executor:
+        while len(results) < len(stages):
+            started = set(s.name for s in running.values())
+            for s in stages:
+                if s.name in results or s.name in started or not is_ready(s) or failed:
+                    continue
+                if dry_run and any(
+                    results[u].startswith(("would", "waiting")) for u in upstream[s.name]
+                ):
+                    results[s.name] = "waiting"
+                    print(f"{s.name}: waiting")
+                    continue
+                print(f"{s.name}: checking...")
+                running[executor.submit(
+                    run_stage, s, cache, s.name in force, dry_run, root
+                )] = s
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                s = running.pop(future)
+                try:
+                    results[s.name] = future.result()
+                except Exception as e:
+                    results[s.name] = f"failed: {e}"
+                    failed = True
+                print(f"{s.name}: {results[s.name]}")
+    cache.save()
+    return results
+
+
+def adopt(stages: List[Stage], cache: Cache, root: str = ROOT) -> Dict[str, str]:
+    """Record every stage's existing outputs as up to date."""
+    results = {}
+    for s in stages:
+        try:
+            key = get_stage_key(s, cache, root)
+        except FileNotFoundError as e:
+            results[s.name] = f"skipped: {e}"
+            continue
+        outputs = get_outputs(s, cache, root)
+        if not outputs:
+            results[s.name] = "skipped: no outputs"
+            continue
+        cache.put_entry(s.name, key, {p: cache.store(os.path.join(root, p)) for p in outputs})
+        results[s.name] = "adopted"
+    cache.save()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="bring stages up to date")
+    run_parser.add_argument("stages", nargs="*", help="target stages (default: all)")
+    run_parser.add_argument("--jobs", type=int, default=JOBS)
+    run_parser.add_argument("--force", nargs="*", default=[], help="stages to re-run")
+    run_parser.add_argument("--dry-run", action="store_true")
+    subparsers.add_parser("adopt", help="record the existing outputs as up to date")
+    args = parser.parse_args()
+    cache = Cache(os.path.join(ROOT, RELPATHS["cache"]))
+    if args.command == "adopt":
+        for name, result in adopt(STAGES, cache).items():
+            print(f"{name}: {result}")
+        return
+    stages = select_stages(STAGES, args.stages or [s.name for s in STAGES])
+    results = run_pipeline(stages, cache, args.jobs, args.force, args.dry_run)
+    if any(r.startswith("failed") for r in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Predict dgr_prime for new measurements using posterior draws.
+
+The draws of dgf, pka and pkmg are pushed through the vectorised Legendre
+transform in legendre.py, so new conditions can be predicted without
+re-running Stan.
+
+By default the measurements are the processed TECRDB rows that weren't
+fitted. To predict other measurements, pass a csv file in the same format,
+with "reaction_id", "Reaction formula in python dictionary" and condition
+columns, using --measurements.
+
+"""
+
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from draws_store import load_flat_draws
+from typing import Dict, Iterator, List, Tuple
+from legendre import (
+    LegendreIndex, cap_pk_orders, get_dgr_prime_from_arrays, get_legendre_index,
+    get_ms_pk_sums
+)
+from summary import summarise_draws
+from util import FORMULA_COL, get_stoichiometry
+
+RELPATHS = {
+    "draws_folder": "../data/model_output/draws",
+    "stan_codes": "../data/model_input/stan_codes.json",
+    "microspecies": "../data/processed/microspecies.csv",
+    "tecrdb_processed": "../data/processed/tecrdb.csv",
+    "tecrdb_fitted": "../data/model_input/tecrdb.csv",
+    "draws_output": "../data/model_output/dgr_prime_pred.npy",
+    "summary_output": "../data/model_output/dgr_prime_pred.csv",
+}
+CONDITION_COLS = {
+    "I": "Ionic strength",
+    "t": "T(K)",
+    "pH": "pH",
+    "pMg": "pMg",
+}
+R = 8.314e-3
+DRAW_CHUNK_SIZE = 100
+CONDITION_CHUNK_SIZE = 10000
+
+
+def get_pk_counts(
+    microspecies: pd.DataFrame, compound_ids: List[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the number of pkas and pkmgs of every compound, in the same way as
+    prepare_stan_input.
+
+    """
+    return tuple(
+        microspecies
+        .groupby(["compound_id", n])[pk].first()
+        .dropna()
+        .groupby("compound_id").size()
+        .reindex(compound_ids, fill_value=0)
+        .to_numpy()
+        for n, pk in [("nh", "pka"), ("nmg", "pkmg")]
+    )
+
+
+def predict_chunk(
+    index: LegendreIndex,
+    conditions: Dict[str, np.ndarray],
+    dgf: np.ndarray,
+    pka: np.ndarray,
+    pkmg: np.ndarray,
+    n_pka_cpd: np.ndarray,
+    n_pkmg_cpd: np.ndarray,
+    condition_chunk_size: int = CONDITION_CHUNK_SIZE,
+) -> np.ndarray:
+    """Get a (draw, condition) array of dgr_prime for a chunk of draws."""
+    index = cap_pk_orders(index, n_pka_cpd, n_pkmg_cpd)
+    pka_sum = get_ms_pk_sums(pka, n_pka_cpd, index.ms_cpd, index.pka_order)
+    pkmg_sum = get_ms_pk_sums(pkmg, n_pkmg_cpd, index.ms_cpd, index.pkmg_order)
+    n_condition = len(conditions["rxn"])
+    out = np.empty((len(dgf), n_condition))
+    for start in range(0, n_condition, condition_chunk_size):
+        c = slice(start, start + condition_chunk_size)
+        out[:, c] = get_dgr_prime_from_arrays(
+            index,
+            conditions["rxn"][c],
+            conditions["I"][c],
+            conditions["t"][c],
+            conditions["pH"][c],
+            conditions["pMg"][c],
+            R,
+            dgf,
+            pka_sum,
+            pkmg_sum,
+        )
+    return out
+
+
+def iter_dgr_prime_draws(
+    index: LegendreIndex,
+    conditions: pd.DataFrame,
+    draws: Dict[str, np.ndarray],
+    n_pka_cpd: np.ndarray,
+    n_pkmg_cpd: np.ndarray,
+    draw_chunk_size: int = DRAW_CHUNK_SIZE,
+    n_processes: int = 1,
+) -> Iterator[Tuple[slice, np.ndarray]]:
+    """Yield (draw slice, dgr_prime array) pairs, one per chunk of draws.
+
+    :param conditions: dataframe with a "reaction_id" column and the columns in
+    CONDITION_COLS.
+
+    :param draws: dictionary with two-dimensional arrays "dgf", "pka" and
+    "pkmg", each with one row per draw, laid out as in the Stan model.
+
+    :param n_processes: if greater than one, chunks are computed in a process
+    pool of this size.
+
+    """
+    rxn = pd.Index(index.reaction_ids).get_indexer(conditions["reaction_id"])
+    if (rxn == -1).any():
+        raise ValueError("Some reactions are not in the index.")
+    condition_arrays = {
+        k: conditions[col].to_numpy(dtype=float)
+        for k, col in CONDITION_COLS.items()
+    }
+    condition_arrays["rxn"] = rxn
+    n_draw = len(draws["dgf"])
+    slices = [
+        slice(start, min(start + draw_chunk_size, n_draw))
+        for start in range(0, n_draw, draw_chunk_size)
+    ]
+    args = [
+        (
+            index, condition_arrays,
+            draws["dgf"][s], draws["pka"][s], draws["pkmg"][s],
+            n_pka_cpd, n_pkmg_cpd
+        )
+        for s in slices
+    ]
+    if n_processes > 1:
+        with ProcessPoolExecutor(n_processes) as executor:
+            yield from zip(slices, executor.map(predict_chunk, *zip(*args)))
+    else:
+        for s, a in zip(slices, args):
+            yield s, predict_chunk(*a)
+
+
+def predict_dgr_prime(
+    index: LegendreIndex,
+    conditions: pd.DataFrame,
+    draws: Dict[str, np.ndarray],
+    n_pka_cpd: np.ndarray,
+    n_pkmg_cpd: np.ndarray,
+    draw_chunk_size: int = DRAW_CHUNK_SIZE,
+    n_processes: int = 1,
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """Get a (draw, condition) array of dgr_prime.
+
+    :param out: optional array to write into, for example a memory-mapped .npy
+    file, so that large outputs need not fit in memory.
+
+    """
+    if out is None:
+        out = np.empty((len(draws["dgf"]), len(conditions)))
+    for s, chunk in iter_dgr_prime_draws(
+        index, conditions, draws, n_pka_cpd, n_pkmg_cpd,
+        draw_chunk_size, n_processes
+    ):
+        out[s] = chunk
+    return out
+
+
+def get_predictable(
+    measurements: pd.DataFrame, compound_ids: List[str]
+) -> pd.DataFrame:
+    """Get the measurements with known conditions whose reactions only involve
+    modelled compounds.
+
+    """
+    candidates = measurements.loc[
+        lambda df: df[list(CONDITION_COLS.values()) + [FORMULA_COL]]
+        .notnull().all(axis=1)
+    ]
+    stoichiometry = get_stoichiometry(candidates)
+    predictable = (
+        stoichiometry.assign(known=stoichiometry["compound_id"].isin(compound_ids))
+        .groupby("reaction_id")["known"].all()
+        .loc[lambda s: s]
+        .index
+    )
+    return candidates.loc[lambda df: df["reaction_id"].isin(predictable)]
+
+
+def get_held_out_tecrdb(
+    tecrdb: pd.DataFrame, fitted_index: pd.Index, compound_ids: List[str]
+) -> pd.DataFrame:
+    """Get TECRDB rows that were not fitted but could be predicted, e.g.
+    because prepare_stan_input excluded them.
+
+    """
+    held_out = tecrdb.drop(fitted_index, errors="ignore")
+    return get_predictable(held_out, compound_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--measurements",
+        help="csv file of measurements to predict (default: unfitted TECRDB rows)",
+    )
+    args = parser.parse_args()
+    here = os.path.dirname(os.path.realpath(__file__))
+    draws_folder = os.path.join(here, RELPATHS["draws_folder"])
+    stan_codes = json.load(open(os.path.join(here, RELPATHS["stan_codes"]), "r"))
+    compound_ids = list(stan_codes["compound_id"].keys())
+    microspecies = pd.read_csv(
+        os.path.join(here, RELPATHS["microspecies"]), index_col=0
+    ).loc[lambda df: df["compound_id"].isin(compound_ids)]
+    if args.measurements is not None:
+        tecrdb = get_predictable(
+            pd.read_csv(args.measurements, index_col=0), compound_ids
+        )
+    else:
+        fitted = pd.read_csv(
+            os.path.join(here, RELPATHS["tecrdb_fitted"]), index_col=0
+        )
+        tecrdb = get_held_out_tecrdb(
+            pd.read_csv(os.path.join(here, RELPATHS["tecrdb_processed"]), index_col=0),
+            fitted.index,
+            compound_ids
+        )
+    if len(tecrdb) == 0:
+        raise ValueError(
+            "No measurements to predict: every predictable row was fitted or "
+            "lacks conditions. Pass a csv file with --measurements."
+        )
+    draws = load_flat_draws(draws_folder, ["dgf", "pka", "pkmg"])
+    index = get_legendre_index(
+        microspecies, get_stoichiometry(tecrdb), compound_ids=compound_ids
+    )
+    n_pka_cpd, n_pkmg_cpd = get_pk_counts(microspecies, compound_ids)
+    out = np.lib.format.open_memmap(
+        os.path.join(here, RELPATHS["draws_output"]),
+        mode="w+",
+        shape=(len(draws["dgf"]), len(tecrdb)),
+    )
+    predict_dgr_prime(
+        index, tecrdb, draws, n_pka_cpd, n_pkmg_cpd, n_processes=os.cpu_count(),
+        out=out
+    )
+    out.flush()
+    summary = summarise_draws(
+        out, index=tecrdb.index, block_size=CONDITION_CHUNK_SIZE
+    )
+    tecrdb.join(summary).to_csv(os.path.join(here, RELPATHS["summary_output"]))
+
+
+if __name__ == "__main__":
+    main()
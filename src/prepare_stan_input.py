@@ -5,6 +5,8 @@ import os
 import pandas as pd
 from typing import Any, List, Dict, Union, Iterable
 from cmdstanpy.utils import jsondump, rdump
+from instrument import instrumented, stage
+from legendre import ragged_range
 from util import get_stoichiometry
 
 INPUT_PATH_MICROSPECIES = "../data/processed/microspecies.csv"
@@ -16,6 +18,12 @@ OUTPUT_PATH_STAN_CODES = "../data/model_input/stan_codes.json"
 OUTPUT_PATH_TECRDB = "../data/model_input/tecrdb.csv"
 OUTPUT_PATH_COMPOUNDS = "../data/model_input/compounds.csv"
 OUTPUT_PATH_PKAS = "../data/model_input/pkas.csv"
+OUTPUT_PATH_PKMGS = "../data/model_input/pkmgs.csv"
+OUTPUT_PROFILES = {
+    "minimal": [],
+    "predictive": ["dgr_prime", "kpr_rep"],
+    "full": ["dgr_prime", "kpr_rep", "log_lik"],
+}
 
 
 def filter_tecrdb(t: pd.DataFrame) -> pd.Series:
@@ -40,7 +48,12 @@ def stan_encode(i: Iterable[str], codes: Dict[str, int]) -> Iterable[int]:
 
 
 def get_group_first_ix(df: pd.DataFrame, groupcol: str) -> List[int]:
-    return df.groupby(groupcol).apply(lambda d: d.index[0] + 1).tolist()
+    """Get the index of each group's first row plus one, or an empty list for
+    an empty table.
+
+    """
+    first = pd.Series(df.index, index=df[groupcol]).groupby(level=0).first()
+    return (first + 1).tolist()
 
 
 def get_stan_codes(stoichiometry: pd.DataFrame) -> Dict[str, Dict[str, int]]:
@@ -50,6 +63,72 @@ def get_stan_codes(stoichiometry: pd.DataFrame) -> Dict[str, Dict[str, int]]:
     }
 
 
+def get_output_flags(profile: str) -> Dict[str, int]:
+    """Get the data flags that tell the model which generated quantities to
+    write for an output profile.
+
+    """
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError(
+            f"Unknown output profile {profile}: choose from {list(OUTPUT_PROFILES)}."
+        )
+    return {
+        "output_" + q: int(q in OUTPUT_PROFILES[profile])
+        for q in OUTPUT_PROFILES["full"]
+    }
+
+
+def get_condition_index(stan_input: Dict[str, Any]) -> Dict[str, Any]:
+    """Get inputs for computing each compound's dgf_prime once per condition.
+
+    Measurements with identical temperature, ionic strength, pH and pMg share
+    a condition. Every unique (compound, condition) pair gets one entry and
+    dgr_prime is the product of a sparse measurement x (compound, condition)
+    stoichiometric matrix, given in Stan's compressed row storage format, and
+    the vector of dgf_primes.
+
+    Pairs are sorted by condition and measurements are also listed in
+    condition order, so that the likelihood can be split into independent
+    slices of conditions.
+
+    """
+    cnd_cols = ["temperature", "I", "pH", "pMg"]
+    conditions = np.column_stack([stan_input[c] for c in cnd_cols])
+    unique_conditions, cnd = np.unique(conditions, axis=0, return_inverse=True)
+    cnd = cnd.ravel()
+    rxn = np.array(stan_input["rxn"]) - 1
+    n_pair = np.array(stan_input["n_cpd"])[rxn]
+    stoic = ragged_range(np.array(stan_input["fst_stoic"])[rxn] - 1, n_pair)
+    pair_cpd = np.array(stan_input["stoic_cpd"])[stoic]
+    pair_cnd = np.repeat(cnd, n_pair)
+    cnd_cpd, pair_cpd_cnd = np.unique(
+        np.column_stack([pair_cnd, pair_cpd]), axis=0, return_inverse=True
+    )
+    n_cpd_cnd, n_kpr_cnd = (
+        np.bincount(ix, minlength=len(unique_conditions))
+        for ix in [cnd_cpd[:, 0], cnd]
+    )
+    return {
+        "N_condition": len(unique_conditions),
+        "N_cpd_cnd": len(cnd_cpd),
+        "N_stoic_kpr": len(stoic),
+        **{
+            c + "_cnd": unique_conditions[:, i].tolist()
+            for i, c in enumerate(cnd_cols)
+        },
+        "cpd_cnd_cpd": cnd_cpd[:, 1].tolist(),
+        "cpd_cnd_cnd": (cnd_cpd[:, 0] + 1).tolist(),
+        "n_cpd_cnd": n_cpd_cnd.tolist(),
+        "fst_cpd_cnd": (np.cumsum(n_cpd_cnd) - n_cpd_cnd + 1).tolist(),
+        "kpr_by_cnd": (np.argsort(cnd, kind="stable") + 1).tolist(),
+        "n_kpr_cnd": n_kpr_cnd.tolist(),
+        "fst_kpr_cnd": (np.cumsum(n_kpr_cnd) - n_kpr_cnd + 1).tolist(),
+        "stoic_kpr_w": np.array(stan_input["stoic_coef"])[stoic].tolist(),
+        "stoic_kpr_v": (pair_cpd_cnd.ravel() + 1).tolist(),
+        "stoic_kpr_u": (np.concatenate([[0], np.cumsum(n_pair)]) + 1).tolist(),
+    }
+
+
 def get_stan_input(
     tecrdb: pd.DataFrame,
     stoichiometry: pd.DataFrame,
@@ -147,11 +226,18 @@ def get_stan_input(
         "pMg": tecrdb["pMg"].tolist(),
         "prior_loc_dgf": compounds["prior_loc_dgf"].tolist(),
         "prior_regime_dgf": compounds["prior_regime_dgf"].tolist(),
+        "grainsize": 1,
+        **get_output_flags("full"),
     }
+    stan_input.update(get_condition_index(stan_input))
     return stan_input
 
 
-def main():
+def get_model_tables() -> Dict[str, pd.DataFrame]:
+    """Get the tables that the model input is made from, using the measurements
+    that pass filter_tecrdb and the compounds in their reactions.
+
+    """
     here = os.path.dirname(os.path.realpath(__file__))
     input_path_tecrdb = os.path.join(here, INPUT_PATH_TECRDB)
     input_path_compounds = os.path.join(here, INPUT_PATH_COMPOUNDS)
@@ -175,16 +261,35 @@ def main():
         .reset_index()
         for n, pk in [('nh', 'pka'), ('nmg', 'pkmg')]
     )
-    stan_codes = get_stan_codes(stoichiometry)
-    stan_input = get_stan_input(
-        tecrdb, stoichiometry, microspecies, compounds, pkas, pkmgs, stan_codes
+    return {
+        "tecrdb": tecrdb,
+        "stoichiometry": stoichiometry,
+        "microspecies": microspecies,
+        "compounds": compounds,
+        "pkas": pkas,
+        "pkmgs": pkmgs,
+    }
+
+
+@instrumented("prepare_stan_input")
+def main():
+    here = os.path.dirname(os.path.realpath(__file__))
+    with stage("get_model_tables"):
+        tables = get_model_tables()
+    tecrdb, compounds, pkas, pkmgs = (
+        tables[k] for k in ["tecrdb", "compounds", "pkas", "pkmgs"]
     )
-    pkas.to_csv(os.path.join(here, OUTPUT_PATH_PKAS))
-    compounds.to_csv(os.path.join(here, OUTPUT_PATH_COMPOUNDS))
-    tecrdb.to_csv(os.path.join(here, OUTPUT_PATH_TECRDB))
-    jsondump(os.path.join(here, OUTPUT_PATH_STAN_CODES), stan_codes)
-    jsondump(os.path.join(here, OUTPUT_PATH_JSON), stan_input)
-    rdump(os.path.join(here, OUTPUT_PATH_R), stan_input)
+    with stage("get_stan_input"):
+        stan_codes = get_stan_codes(tables["stoichiometry"])
+        stan_input = get_stan_input(**tables, stan_codes=stan_codes)
+    with stage("write_outputs"):
+        pkas.to_csv(os.path.join(here, OUTPUT_PATH_PKAS))
+        pkmgs.to_csv(os.path.join(here, OUTPUT_PATH_PKMGS))
+        compounds.to_csv(os.path.join(here, OUTPUT_PATH_COMPOUNDS))
+        tecrdb.to_csv(os.path.join(here, OUTPUT_PATH_TECRDB))
+        jsondump(os.path.join(here, OUTPUT_PATH_STAN_CODES), stan_codes)
+        jsondump(os.path.join(here, OUTPUT_PATH_JSON), stan_input)
+        rdump(os.path.join(here, OUTPUT_PATH_R), stan_input)
 
 
 if __name__ == "__main__":
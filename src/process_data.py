@@ -6,20 +6,84 @@
 
 """
 
-import math
+import json
 import numpy as np
 import os
 import pandas as pd
-from typing import Dict
-from util import get_stoichiometry
+from itertools import chain
+from pyarrow import feather
+from typing import Dict, List
+from instrument import instrumented, stage
+from util import get_stoichiometry, hash_file
 
 SHEET_PATH = "../data/raw/mmc2.xlsx"
+SHEET_CACHE_DIR = "../data/raw/cache"
+SHEET_NAMES = {
+    "dgf": "Table S3. Compound thermo data",
+    "pka": "Table S4. pKa data",
+    "tecrdb": "Table S1. TECRDB Keqs",
+    "pkmg": "Table S5. Mg binding data",
+}
 
 OUTPUT_PATH_MICROSPECIES = "../data/processed/microspecies.csv"
 OUTPUT_PATH_TECRDB = "../data/processed/tecrdb.csv"
 OUTPUT_PATH_COMPOUNDS = "../data/processed/compounds.csv"
 
 
+def make_arrow_compatible(df: pd.DataFrame) -> pd.DataFrame:
+    """Give every mixed-type object column a single type.
+
+    Arrow needs each column to have a single type. Mostly-numeric columns are
+    converted to numbers, as process_tecrdb would do anyway, and other mixed
+    columns are converted to strings.
+
+    """
+    out = df.copy()
+    for col in out.columns[out.dtypes == object]:
+        notnull = out[col].notnull()
+        types = out.loc[notnull, col].map(type)
+        if types.nunique() == 1:
+            continue
+        if types.isin([int, float]).mean() > 0.5:
+            out[col] = pd.to_numeric(out[col], errors="coerce")
+        else:
+            out.loc[notnull, col] = out.loc[notnull, col].map(str)
+    return out
+
+
+def read_sheets(sheet_path: str, cache_dir: str) -> Dict[str, pd.DataFrame]:
+    """Read the sheets in SHEET_NAMES, using a cache if possible.
+
+    The first time a workbook is seen, all sheets are read in one go and
+    written to feather files whose names include the workbook's hash, and
+    the files of any other workbook are removed. Later calls memory-map
+    these files instead of parsing the workbook again.
+
+    """
+    digest = hash_file(sheet_path)
+    cache_paths = {
+        k: os.path.join(cache_dir, f"{digest}-{k}.feather") for k in SHEET_NAMES
+    }
+    if all(os.path.exists(p) for p in cache_paths.values()):
+        return {
+            k: feather.read_table(p, memory_map=True).to_pandas()
+            for k, p in cache_paths.items()
+        }
+    sheets = pd.read_excel(sheet_path, sheet_name=list(SHEET_NAMES.values()))
+    out = {k: make_arrow_compatible(sheets[name]) for k, name in SHEET_NAMES.items()}
+    os.makedirs(cache_dir, exist_ok=True)
+    for k, df in out.items():
+        # write to a temporary file first so that an interrupted run can't
+        # leave a truncated file that later runs would trust
+        tmp = os.path.join(cache_dir, f".{digest}-{k}.{os.getpid()}")
+        feather.write_feather(df, tmp, compression="uncompressed")
+        os.replace(tmp, cache_paths[k])
+    for f in os.listdir(cache_dir):
+        if f.endswith(".feather") and not f.startswith(digest + "-"):
+            os.remove(os.path.join(cache_dir, f))
+    return out
+
+
 def process_dgf(dgf_in: pd.DataFrame) -> pd.DataFrame:
     out = dgf_in.copy()
     out["compound_id"], _ = zip(*out["Aqueous species id"].str.rsplit("_", 1))
@@ -39,52 +103,68 @@ def process_tecrdb(tecrdb_in: pd.DataFrame) -> pd.DataFrame:
     return out
 
 
+def decode_list_column(col: pd.Series) -> List[list]:
+    """Decode a column of list-valued strings like "[1, 2]" in one pass.
+
+    Missing values are decoded as empty lists.
+
+    """
+    strings = col.where(col.notnull(), "[]").astype(str)
+    return json.loads("[" + ",".join(strings) + "]")
+
+
 def get_protonation_states(pka_in: pd.DataFrame) -> pd.DataFrame:
-    out = pd.DataFrame()
     charge_col = "Charges for different protonation states"
     pka_col = "pKas"
     nH_col = "Number of hydrogen atoms for different protonated states"
-    for _, row in pka_in.iterrows():
-        for i, (charge, nh) in enumerate(zip(
-            eval(row[charge_col]), eval(row[nH_col])
-        )):
-            pka = eval(row[pka_col])[i-1] if i > 0 else np.nan
-            out = out.append({
-                "compound_id": row["Compound id"],
-                "charge": int(charge),
-                "nh": nh,
-                "pka": pka
-            }, ignore_index="True")
+    charges, nhs, pkas = (
+        decode_list_column(pka_in[col]) for col in [charge_col, nH_col, pka_col]
+    )
+    n_states = np.array([len(c) for c in charges])
+    if any(len(p) != n - 1 for p, n in zip(pkas, n_states)):
+        raise ValueError("Every protonation state but the first needs a pKa.")
+    # column order and float dtypes match the original row-wise parser
+    out = pd.DataFrame({
+        "charge": np.fromiter(chain.from_iterable(charges), float, n_states.sum()),
+        "compound_id": np.repeat(pka_in["Compound id"].to_numpy(), n_states),
+        "nh": np.fromiter(chain.from_iterable(nhs), float, n_states.sum()),
+        "pka": np.fromiter(
+            chain.from_iterable([np.nan] + p for p in pkas), float, n_states.sum()
+        ),
+    })
     out["compound_id"] = out["compound_id"].astype("string")
     return out
 
-            
+
 def get_magnesium_binding_states(pkmg_in: pd.DataFrame) -> pd.DataFrame:
-    out = pd.DataFrame()
     id_col = "Aqueous species id"
     pkmg1_col = "pKMg"
     pkmg2_col = "pKMg2 (binding the second Mg)"
     data_col = "Data or predicted"
-    for i, row in pkmg_in.iterrows():
-        cid, charge = row[id_col].rsplit("_", 1)
-        # if there are two or more recorded values, keep only the first
-        if not charge.lstrip('-').isnumeric():
-            if charge[-1] == 'a':
-                charge = charge[:-1]
-            else:
-                continue
-        pkmgs = [np.nan, row[pkmg1_col], row[pkmg2_col]]
-        no_second_pkmg = math.isnan(row[pkmg2_col])
-        nMgs = [0, 1] if no_second_pkmg else [0, 1, 2]
-        for nMg, pkmg in zip(nMgs, pkmgs):
-            predicted = row[data_col] == "predicted" if nMg > 0 else np.nan
-            out = out.append({
-                "nmg": nMg,
-                "compound_id": cid,
-                "charge": int(charge),
-                "pkmg_is_predicted": predicted,
-                "pkmg": pkmg
-            }, ignore_index=True)
+    split = pkmg_in[id_col].str.rsplit("_", n=1, expand=True)
+    cid, charge = split[0], split[1]
+    # if there are two or more recorded values, keep only the first
+    is_numeric = charge.str.lstrip("-").str.isnumeric()
+    is_first = ~is_numeric & charge.str.endswith("a")
+    keep = (is_numeric | is_first).to_numpy()
+    charge = charge.where(~is_first, charge.str[:-1])
+    pkmgs = np.column_stack([
+        np.full(len(pkmg_in), np.nan), pkmg_in[pkmg1_col], pkmg_in[pkmg2_col]
+    ])[keep]
+    n_states = np.where(np.isnan(pkmgs[:, 2]), 2, 3)
+    row = np.repeat(np.arange(keep.sum()), n_states)
+    nmg = (
+        np.arange(n_states.sum())
+        - np.repeat(np.cumsum(n_states) - n_states, n_states)
+    )
+    predicted = (pkmg_in[data_col] == "predicted").to_numpy()[keep][row]
+    out = pd.DataFrame({
+        "nmg": nmg.astype(float),
+        "compound_id": cid.to_numpy()[keep][row],
+        "charge": charge.to_numpy()[keep][row].astype(float),
+        "pkmg": pkmgs[row, nmg],
+        "pkmg_is_predicted": np.where(nmg > 0, predicted, np.nan),
+    })
     out["compound_id"] = out["compound_id"].astype("string")
     return out
 
@@ -127,21 +207,27 @@ def get_compounds(dgf_in, tecrdb, microspecies, pka):
     )
 
 
+@instrumented("process_data")
 def main():
     here = os.path.dirname(os.path.realpath(__file__))
     sheet_path = os.path.join(here, SHEET_PATH)
-    dgf_in = pd.read_excel(sheet_path, sheet_name="Table S3. Compound thermo data")
-    pka_in = pd.read_excel(sheet_path, sheet_name="Table S4. pKa data")
-    tecrdb_in = pd.read_excel(sheet_path, sheet_name="Table S1. TECRDB Keqs")
-    pkmg_in = pd.read_excel(sheet_path, sheet_name="Table S5. Mg binding data")
-
-    microspecies = get_microspecies(pka_in, pkmg_in) 
-    tecrdb = process_tecrdb(tecrdb_in)
-    compounds = get_compounds(dgf_in, tecrdb, microspecies, pka_in)
-
-    microspecies.to_csv(os.path.join(here, OUTPUT_PATH_MICROSPECIES))
-    tecrdb.to_csv(os.path.join(here, OUTPUT_PATH_TECRDB))
-    compounds.to_csv(os.path.join(here, OUTPUT_PATH_COMPOUNDS))
+    with stage("read_sheets"):
+        sheets = read_sheets(sheet_path, os.path.join(here, SHEET_CACHE_DIR))
+    dgf_in, pka_in, tecrdb_in, pkmg_in = (
+        sheets[k] for k in ["dgf", "pka", "tecrdb", "pkmg"]
+    )
+
+    with stage("get_microspecies"):
+        microspecies = get_microspecies(pka_in, pkmg_in) 
+    with stage("process_tecrdb"):
+        tecrdb = process_tecrdb(tecrdb_in)
+    with stage("get_compounds"):
+        compounds = get_compounds(dgf_in, tecrdb, microspecies, pka_in)
+
+    with stage("write_csvs"):
+        microspecies.to_csv(os.path.join(here, OUTPUT_PATH_MICROSPECIES))
+        tecrdb.to_csv(os.path.join(here, OUTPUT_PATH_TECRDB))
+        compounds.to_csv(os.path.join(here, OUTPUT_PATH_COMPOUNDS))
 
 
 if __name__ == "__main__":
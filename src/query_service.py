@@ -0,0 +1,319 @@
+"""Answer dgr_prime queries about arbitrary reactions using a fitted posterior.
+
+The posterior draws of dgf, pka and pkmg and the microspecies table are
+loaded once. Each query is a reaction, in the same format as TECRDB's
+"Reaction formula in python dictionary" column, and a condition; the answer
+is a posterior summary of the reaction's dgr_prime. The draws of each
+compound's dgf_prime in each condition are kept in an LRU cache of at most
+CACHE_BYTES bytes, so compounds like water and ATP that appear in many
+queries are only transformed once per condition.
+
+Usage:
+
+    python query_service.py query queries.json   # or "-" to read stdin
+    python query_service.py serve [--port 8765]
+
+A query looks like this:
+
+    {"reaction": {"CHB_15422": -1, "CHB_16761": 1, "CHB_16027": 1},
+     "pH": 7.2, "pMg": 3, "I": 0.15, "t": 310}
+
+The server listens on localhost. POST a json list of queries to /dgr_prime
+to get a list of results, or GET /stats for the cache statistics.
+
+"""
+
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import sys
+import threading
+from ast import literal_eval
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Hashable, List, Sequence, Tuple
+from draws_store import load_flat_draws
+from legendre import (
+    cap_pk_orders, get_dgr_prime_from_arrays, get_formation_index, get_ms_pk_sums
+)
+from predict import CONDITION_COLS, R, get_pk_counts
+from summary import QUANTILES, get_summary_columns, summarise_draws
+
+RELPATHS = {
+    "draws_folder": "../data/model_output/draws",
+    "stan_codes": "../data/model_input/stan_codes.json",
+    "microspecies": "../data/processed/microspecies.csv",
+}
+CACHE_BYTES = 2 ** 29  # 512 MiB, e.g. 16384 pairs' dgf_prime at 4000 draws
+CHUNK_SIZE = 1000  # (compound, condition) pairs transformed at once
+HOST = "127.0.0.1"
+PORT = 8765
+
+Condition = Tuple[float, float, float, float]  # in the order of CONDITION_COLS
+
+
+class LRUCache:
+    """A dictionary of arrays that forgets its least recently used items
+    when the arrays take up more than maxbytes bytes.
+
+    """
+
+    def __init__(self, maxbytes: int):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Any:
+        if key not in self.data:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.data.move_to_end(key)
+        return self.data[key]
+
+    def put(self, key: Hashable, value: np.ndarray):
+        if key in self.data:
+            self.nbytes -= self.data[key].nbytes
+        self.data[key] = value
+        self.nbytes += value.nbytes
+        self.data.move_to_end(key)
+        while self.nbytes > self.maxbytes and self.data:
+            _, dropped = self.data.popitem(last=False)
+            self.nbytes -= dropped.nbytes
+
+
+def parse_query(query: Dict[str, Any]) -> Tuple[Dict[str, float], Condition]:
+    """Get the stoichiometry and condition of a query.
+
+    Conditions can be given with the keys of CONDITION_COLS or the TECRDB
+    column names, e.g. "t" or "T(K)".
+
+    """
+    reaction = query["reaction"]
+    if isinstance(reaction, str):
+        reaction = literal_eval(reaction)
+    if not isinstance(reaction, dict):
+        raise TypeError(f"A reaction must be a dictionary, not {reaction!r}.")
+    condition = tuple(
+        float(query[k] if k in query else query[col])
+        for k, col in CONDITION_COLS.items()
+    )
+    return {c: float(coef) for c, coef in reaction.items()}, condition
+
+
+class DgrPrimeService:
+    """Posterior dgr_prime for arbitrary reactions and conditions.
+
+    :param draws: dictionary with two-dimensional arrays "dgf", "pka" and
+    "pkmg", each with one row per draw, laid out as in the Stan model.
+
+    """
+
+    def __init__(
+        self,
+        draws: Dict[str, np.ndarray],
+        microspecies: pd.DataFrame,
+        compound_ids: List[str],
+        n_pka_cpd: np.ndarray,
+        n_pkmg_cpd: np.ndarray,
+        cache_bytes: int = CACHE_BYTES,
+        quantiles: Sequence[float] = QUANTILES,
+    ):
+        self.index = cap_pk_orders(
+            get_formation_index(microspecies, compound_ids), n_pka_cpd, n_pkmg_cpd
+        )
+        self.reaction_ix = pd.Index(self.index.reaction_ids)
+        self.dgf = np.asarray(draws["dgf"])
+        self.pka_sum, self.pkmg_sum = (
+            get_ms_pk_sums(np.asarray(draws[p]), n, self.index.ms_cpd, order)
+            for p, n, order in [
+                ("pka", n_pka_cpd, self.index.pka_order),
+                ("pkmg", n_pkmg_cpd, self.index.pkmg_order),
+            ]
+        )
+        self.quantiles = quantiles
+        self.cache = LRUCache(cache_bytes)
+        self.lock = threading.Lock()
+
+    def get_dgf_primes(
+        self, keys: List[Tuple[str, Condition]]
+    ) -> Dict[Tuple[str, Condition], np.ndarray]:
+        """Get draws of dgf_prime for some (compound, condition) pairs,
+        transforming the ones that aren't cached in vectorised chunks.
+
+        """
+        keys = list(dict.fromkeys(keys))
+        with self.lock:
+            out = {k: self.cache.get(k) for k in keys}
+        missing = [k for k, v in out.items() if v is None]
+        for start in range(0, len(missing), CHUNK_SIZE):
+            chunk = missing[start:start + CHUNK_SIZE]
+            rxn = self.reaction_ix.get_indexer([c for c, _ in chunk])
+            I, t, pH, pMg = np.array([cnd for _, cnd in chunk]).T
+            values = get_dgr_prime_from_arrays(
+                self.index, rxn, I, t, pH, pMg, R,
+                self.dgf, self.pka_sum, self.pkmg_sum
+            )
+            with self.lock:
+                for i, k in enumerate(chunk):
+                    out[k] = values[:, i].copy()
+                    out[k].flags.writeable = False
+                    self.cache.put(k, out[k])
+        return out
+
+    def get_dgr_prime_draws(
+        self, queries: List[Dict[str, Any]]
+    ) -> Tuple[np.ndarray, List[str]]:
+        """Get a (draw, query) array of dgr_prime and a list of error messages,
+        which are None for valid queries. Invalid queries' draws are nan.
+
+        """
+        parsed, errors = [], []
+        for q in queries:
+            try:
+                reaction, condition = parse_query(q)
+                unknown = [c for c in reaction if c not in self.reaction_ix]
+                if unknown:
+                    raise ValueError(f"Unknown compounds {unknown}.")
+                parsed.append((reaction, condition))
+                errors.append(None)
+            except (KeyError, TypeError, ValueError, SyntaxError) as e:
+                parsed.append(None)
+                errors.append(f"Invalid query: {e!r}")
+        dgf_primes = self.get_dgf_primes([
+            (c, condition) for p in parsed if p is not None
+            for c in p[0] for condition in [p[1]]
+        ])
+        out = np.full((len(self.dgf), len(queries)), np.nan)
+        for i, p in enumerate(parsed):
+            if p is not None:
+                reaction, condition = p
+                out[:, i] = sum(
+                    coef * dgf_primes[(c, condition)] for c, coef in reaction.items()
+                )
+        return out, errors
+
+    def query(self, queries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Get a posterior summary of dgr_prime for each query."""
+        draws, errors = self.get_dgr_prime_draws(queries)
+        summary = summarise_draws(draws, quantiles=self.quantiles)
+        summary.columns = [str(c) for c in get_summary_columns(self.quantiles)]
+        return [
+            {"error": e} if e is not None else row
+            for e, row in zip(errors, summary.to_dict(orient="records"))
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "size": len(self.cache.data),
+                "nbytes": self.cache.nbytes,
+                "maxbytes": self.cache.maxbytes,
+                "hits": self.cache.hits,
+                "misses": self.cache.misses,
+            }
+
+
+def load_service(cache_bytes: int = CACHE_BYTES) -> DgrPrimeService:
+    """Get a DgrPrimeService for the model's posterior draws."""
+    here = os.path.dirname(os.path.realpath(__file__))
+    draws_folder = os.path.join(here, RELPATHS["draws_folder"])
+    stan_codes = json.load(open(os.path.join(here, RELPATHS["stan_codes"]), "r"))
+    compound_ids = list(stan_codes["compound_id"].keys())
+    microspecies = pd.read_csv(
+        os.path.join(here, RELPATHS["microspecies"]), index_col=0
+    ).loc[lambda df: df["compound_id"].isin(compound_ids)]
+    return DgrPrimeService(
+        load_flat_draws(draws_folder, ["dgf", "pka", "pkmg"]),
+        microspecies,
+        compound_ids,
+        *get_pk_counts(microspecies, compound_ids),
+        cache_bytes=cache_bytes,
+    )
+
+
+def make_handler(service: DgrPrimeService):
+    """Get a request handler class that answers queries with a service."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status: int, body: Any):
+            content = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self.send_json(200, service.stats())
+            else:
+                self.send_json(404, {"error": f"Not found: {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/dgr_prime":
+                self.send_json(404, {"error": f"Not found: {self.path}"})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                queries = json.loads(self.rfile.read(length))
+            except json.JSONDecodeError as e:
+                self.send_json(400, {"error": f"Invalid json: {e}"})
+                return
+            if isinstance(queries, dict):
+                queries = [queries]
+            if not isinstance(queries, list):
+                self.send_json(
+                    400, {"error": "Expected a query or a list of queries."}
+                )
+                return
+            self.send_json(200, service.query(queries))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(service: DgrPrimeService, host: str = HOST, port: int = PORT) -> ThreadingHTTPServer:
+    """Get a server that answers queries, ready to serve_forever."""
+    return ThreadingHTTPServer((host, port), make_handler(service))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    query_parser = subparsers.add_parser("query", help="answer queries in a json file")
+    query_parser.add_argument("path", help="json list of queries, or - for stdin")
+    serve_parser = subparsers.add_parser("serve", help="answer queries over http")
+    serve_parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument(
+        "--cache-mb", type=int, default=CACHE_BYTES // 2 ** 20,
+        help="memory budget of the dgf_prime cache in MiB"
+    )
+    args = parser.parse_args()
+    service = load_service(args.cache_mb * 2 ** 20)
+    if args.command == "query":
+        f = sys.stdin if args.path == "-" else open(args.path, "r")
+        queries = json.load(f)
+        if isinstance(queries, dict):
+            queries = [queries]
+        if not isinstance(queries, list):
+            raise ValueError("Expected a query or a list of queries.")
+        json.dump(service.query(queries), sys.stdout, indent=2)
+        print()
+    else:
+        server = serve(service, port=args.port)
+        print(f"Answering queries on http://{HOST}:{args.port}/dgr_prime")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,226 @@
-from cmdstanpy import CmdStanModel
+"""Sample from the model's posterior distribution.
+
+Sampling configuration comes from the defaults below, optionally overridden
+by a json file and then by command line arguments, e.g.
+
+    python run_model.py --config my_config.json --threads-per-chain 4
+
+The output profile (see prepare_stan_input.OUTPUT_PROFILES) controls which
+generated quantities are written. To fill them in later without re-sampling,
+run with --generate-quantities and the desired profile.
+
+Every run saves its chains' final state. Run with --warm-start to start from
+the last saved state with a much shorter warmup, e.g. after adding a few
+measurements.
+
+Run with --method variational or --method optimize for a fast approximate
+fit (see approximate.py), whose draws go to a separate draws store. If
+there is also a NUTS fit, a report comparing the two is written.
+
+Run with --monitor to check convergence while sampling (see monitor.py),
+stopping as soon as the target effective sample size is reached.
+
+"""
+
+import argparse
+import json
 import os
+from typing import Any, Dict
+import draws_store
+from instrument import instrumented, stage
+from approximate import METHODS, write_approximation, write_report
+from model_cache import get_model
+from monitor import sample_with_monitor
+from prepare_stan_input import OUTPUT_PROFILES, get_output_flags
+from warm_start import (
+    WARM_START_SAMPLE_ARGS, get_parameter_labels, get_warm_start_args,
+    save_warm_start
+)
 
 RELATIVE_PATHS = {
     "model": "stan/model.stan",
     "model_input": "../data/model_input/stan_model_input.json",
-    "model_output_dir": "../data/model_output/samples"
+    "model_output_dir": "../data/model_output/samples",
+    "gq_output_dir": "../data/model_output/generated_quantities",
+    "warm_start_dir": "../data/model_output/warm_start",
+    "draws_dir": "../data/model_output/draws",
+    "approx_draws_dir": "../data/model_output/draws_approx",
+    "approx_report": "../data/model_output/approximation_report.csv",
+    "stan_codes": "../data/model_input/stan_codes.json",
 }
 
 SAMPLE_ARGS = {
     "chains": 2,
-    "cores": 2,
+    "parallel_chains": 2,
+    "threads_per_chain": 1,
     "iter_warmup": 400,
-    "save_warmup": True,
+    "save_warmup": False,
     "iter_sampling": 400,
     "max_treedepth": 10
 }
+GRAINSIZE = 1
+OUTPUT_PROFILE = "predictive"  # use "full" to compare models with log_lik
+CPP_OPTIONS = {"STAN_THREADS": True}
+
 
-def standardise_csv_filename(path_in: str, output_dir: str) -> str:
+def standardise_csv_filename(
+    path_in: str, output_dir: str, prefix: str = "samples"
+) -> str:
     directory, filename = os.path.split(path_in)
     _, chain_num, _ = filename.rsplit('-', 2)
-    new_filename = '-'.join(["samples", str(chain_num)]) + ".csv"
+    new_filename = '-'.join([prefix, str(chain_num)]) + ".csv"
     return os.path.join(output_dir, new_filename)
 
 
+def get_config(argv=None) -> Dict[str, Any]:
+    """Get the sampling configuration from defaults, a file and the CLI.
+
+    The config has keys "sample_args", which are passed to
+    CmdStanModel.sample, "grainsize", which is passed to the model's
+    reduce_sum call, "output_profile", "method", "generate_quantities",
+    "warm_start" and "monitor".
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--config",
+        help="json file with any of the keys 'sample_args', 'grainsize' and "
+        "'output_profile'"
+    )
+    for arg in [
+        "chains", "parallel_chains", "threads_per_chain", "iter_warmup",
+        "iter_sampling"
+    ]:
+        parser.add_argument("--" + arg.replace("_", "-"), type=int)
+    parser.add_argument("--save-warmup", action=argparse.BooleanOptionalAction)
+    parser.add_argument("--grainsize", type=int)
+    parser.add_argument("--output-profile", choices=list(OUTPUT_PROFILES))
+    parser.add_argument(
+        "--method",
+        choices=["sample"] + METHODS,
+        default="sample",
+        help="sample with NUTS, or fit approximately"
+    )
+    parser.add_argument(
+        "--generate-quantities",
+        action="store_true",
+        help="re-run generated quantities for the existing samples"
+    )
+    parser.add_argument(
+        "--warm-start",
+        action="store_true",
+        help="start from the state saved by the previous run"
+    )
+    parser.add_argument(
+        "--monitor",
+        action="store_true",
+        help="stop sampling early once the chains have converged"
+    )
+    args = parser.parse_args(argv)
+    config = {
+        "sample_args": SAMPLE_ARGS.copy(),
+        "grainsize": GRAINSIZE,
+        "output_profile": OUTPUT_PROFILE,
+        "method": args.method,
+        "generate_quantities": args.generate_quantities,
+        "warm_start": args.warm_start,
+        "monitor": args.monitor,
+    }
+    if args.warm_start:
+        config["sample_args"].update(WARM_START_SAMPLE_ARGS)
+    if args.config is not None:
+        with open(args.config, "r") as f:
+            from_file = json.load(f)
+        config["sample_args"].update(from_file.get("sample_args", {}))
+        for k in ["grainsize", "output_profile"]:
+            config[k] = from_file.get(k, config[k])
+    for k in SAMPLE_ARGS.keys():
+        if getattr(args, k, None) is not None:
+            config["sample_args"][k] = getattr(args, k)
+    for k in ["grainsize", "output_profile"]:
+        if getattr(args, k) is not None:
+            config[k] = getattr(args, k)
+    return config
+
+
+def generate_quantities(model, data: Dict, sample_dir: str, gq_dir: str):
+    """Re-run the generated quantities block for saved samples and add the
+    results to the draws store.
+
+    """
+    csvs = sorted(
+        os.path.join(sample_dir, f) for f in os.listdir(sample_dir)
+        if f.endswith("csv")
+    )
+    gq = model.generate_quantities(data=data, mcmc_sample=csvs)
+    os.makedirs(gq_dir, exist_ok=True)
+    for f in gq.runset.csv_files:
+        os.replace(f, standardise_csv_filename(f, gq_dir, prefix="gq"))
+    draws_store.write_model_draws_store(gq_dir, update=True)
+
+
+@instrumented("run_model")
 def main():
+    config = get_config()
     here = os.path.dirname(os.path.realpath(__file__))
     model_path = os.path.join(here, RELATIVE_PATHS["model"])
     input_path = os.path.join(here, RELATIVE_PATHS["model_input"])
     output_dir = os.path.join(here, RELATIVE_PATHS["model_output_dir"])
-    model = CmdStanModel(stan_file=model_path)
-    mcmc = model.sample(data=input_path, **SAMPLE_ARGS)
-    for f in mcmc.runset.csv_files:
-        os.replace(f, standardise_csv_filename(f, output_dir))
-
+    with stage("read_input"):
+        with open(input_path, "r") as f:
+            data = json.load(f)
+    data["grainsize"] = config["grainsize"]
+    data.update(get_output_flags(config["output_profile"]))
+    with stage("get_model"):
+        model = get_model(model_path, cpp_options=CPP_OPTIONS)
+    if config["generate_quantities"]:
+        gq_dir = os.path.join(here, RELATIVE_PATHS["gq_output_dir"])
+        with stage("generate_quantities"):
+            generate_quantities(model, data, output_dir, gq_dir)
+        return
+    if config["method"] != "sample":
+        approx_dir = os.path.join(here, RELATIVE_PATHS["approx_draws_dir"])
+        with stage(config["method"]):
+            write_approximation(
+                model,
+                data,
+                config["method"],
+                approx_dir,
+                coords=draws_store.load_model_coords(),
+                dims=draws_store.DIMS,
+            )
+        write_report(
+            os.path.join(here, RELATIVE_PATHS["draws_dir"]),
+            approx_dir,
+            os.path.join(here, RELATIVE_PATHS["approx_report"]),
+        )
+        return
+    stan_codes = json.load(open(os.path.join(here, RELATIVE_PATHS["stan_codes"]), "r"))
+    labels = get_parameter_labels(data, stan_codes)
+    warm_start_dir = os.path.join(here, RELATIVE_PATHS["warm_start_dir"])
+    sample_args = config["sample_args"].copy()
+    if config["warm_start"]:
+        sample_args.update(get_warm_start_args(
+            warm_start_dir,
+            labels,
+            sample_args["chains"],
+            os.path.join(warm_start_dir, "cmdstan_input")
+        ))
+    with stage("sample"):
+        if config["monitor"]:
+            csvs_in = sample_with_monitor(
+                model,
+                data,
+                sample_args,
+                os.path.join(output_dir, "monitor")
+            )
+        else:
+            csvs_in = model.sample(data=data, **sample_args).runset.csv_files
+    csvs = [standardise_csv_filename(f, output_dir) for f in csvs_in]
+    for f, new_f in zip(csvs_in, csvs):
+        os.replace(f, new_f)
+    with stage("save_warm_start"):
+        save_warm_start(csvs, labels, warm_start_dir)
 
 
 if __name__ == "__main__":
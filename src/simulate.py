@@ -1,14 +1,37 @@
-"""Generate some simulated data about the adk reaction"""
+"""Generate simulated data.
 
-from legendre import get_dgr_prime
+Running this script with no arguments simulates some measurements of the adk
+reaction. With --n-compound, --n-reaction and --n-measurement, it instead
+generates a random synthetic network of that size, draws true parameters
+from the model's priors, simulates measurements and writes a Stan input file
+compatible with model.stan, e.g.
+
+    python simulate.py --n-compound 20000 --n-reaction 10000 --n-measurement 400000
+
+Measurements are simulated in chunks in parallel. Each chunk has its own
+seed, spawned from the main seed, so the output only depends on the seed and
+not on the number of processes.
+
+"""
+
+import argparse
+import json
 import numpy as np
+import os
 import pandas as pd
-from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+from cmdstanpy.utils import jsondump
+from legendre import (
+    LegendreIndex, cap_pk_orders, get_dgr_prime_batch, get_dgr_prime_from_arrays,
+    get_legendre_index, get_ms_pk_sums, ragged_range
+)
+from prepare_stan_input import get_stan_codes, get_stan_input
 
 STOICHIOMETRY = pd.DataFrame({
     "reaction_id": ["rxn_61", "rxn_61", "rxn_61"],
     "compound_id": ["CHB_16761", "CHB_15422", "CHB_16027"],
-    "coef": [-2, 1, 1],
+    "coefficient": [-2, 1, 1],
 })
 MICROSPECIES = pd.DataFrame({
     "microspecies_id": [
@@ -100,19 +123,47 @@ ERROR_SDS = {
     'pkmg': 0.2,
     'dg': 0.2,
 }
+# synthetic networks
+MODEL_ERROR_SDS = {"pka": 0.2, "pkmg": 0.2, "dg": 10}  # as in model.stan
+SIGMA_DGF = {1: 30, 2: 500}  # prior sd of dgf by prior regime, as in model.stan
+DGF_OBS_SD = 100  # sd of the observed formation energies used as prior locations
+OBSERVED_DGF_FRACTION = 0.8
+MEAN_EXTRA_REACTANTS = 2  # reactions have 2 + Poisson(this) compounds...
+MAX_REACTANTS = 6  # ...up to this many
+MEAN_N_PKA = 3
+MAX_N_PKA = 6
+N_PKMG_PROBS = [0.5, 0.3, 0.2]  # probability of 0, 1 and 2 pkmgs
+MAX_ABS_DGR = 1000  # at reference conditions, so every K' is a finite float
+MAX_DGF_REDRAWS = 1000
+MAX_PK_REDRAWS = 10000
+REFERENCE_CONDITIONS = {"I": 0.1, "t": 298.15, "pH": 7.0, "pMg": 3.0}
+TEMPERATURES = [298.15, 303.15, 310.15, 311.15]
+CONDITION_RANGES = {"pH": (5.0, 9.0), "pMg": (2.0, 7.0), "I": (0.01, 0.5)}
+MEASUREMENT_CHUNK_SIZE = 10000
+SYNTHETIC_OUTPUT_FILES = {
+    "stan_input": "stan_model_input.json",
+    "stan_codes": "stan_codes.json",
+    "tecrdb": "tecrdb.csv",
+    "compounds": "compounds.csv",
+    "pkas": "pkas.csv",
+    "pkmgs": "pkmgs.csv",
+    "true_params": "true_params.json",
+}
 
 
 def simulate_pk_measurements(
     measurement_positions: Dict[str, List[int]],
     true_pks: Dict[str, List[float]],
     pk_type: str,
-    error_sd: float
+    error_sd: float,
+    rng: np.random.Generator = None,
 ):
+    rng = rng if rng is not None else np.random.default_rng()
     out = pd.DataFrame()
     for cpd_id, cpd_true_pks in true_pks.items():
         cpd_measurement_positions = measurement_positions[cpd_id]
         pk_hat = [cpd_true_pks[pos] for pos in cpd_measurement_positions]
-        pk_meas = np.random.normal(pk_hat, error_sd)
+        pk_meas = rng.normal(pk_hat, error_sd)
         cpd_measurements = pd.DataFrame({
             "compound_id": cpd_id,
             pk_type + "_order": cpd_measurement_positions,
@@ -129,36 +180,336 @@ def simulate_dg_measurements(
     true_pkmgs: Dict[str, float],
     microspecies: pd.DataFrame,
     stoichiometry: pd.DataFrame,
-    error_sd: float
+    error_sd: float,
+    rng: np.random.Generator = None,
 ):
+    rng = rng if rng is not None else np.random.default_rng()
     dg_measurements = dg_measurement_conditions.copy()
-    for i, row in dg_measurements.iterrows():
-        rxn_stoichiometry = (
-            stoichiometry
-            .loc[lambda df: df["reaction_id"] == row["reaction_id"]]
-            .set_index("compound_id")
-            ["coef"]
-            .to_dict()
+    index = get_legendre_index(microspecies, stoichiometry)
+    dg_hat = get_dgr_prime_batch(
+        index,
+        dg_measurements["reaction_id"],
+        dg_measurements["I"],
+        dg_measurements["t"],
+        dg_measurements["ph"],
+        dg_measurements["pmg"],
+        R,
+        true_pkas,
+        true_pkmgs,
+        true_dgfs
+    )
+    dg_measurements["true_dgr_prime"] = dg_hat
+    dg_measurements["measured_dgr_prime"] = rng.normal(dg_hat, error_sd)
+    return dg_measurements
+
+
+def get_ids(prefix: str, n: int) -> List[str]:
+    """Get n ids that sort in numerical order."""
+    width = len(str(n))
+    return [f"{prefix}_{i + 1:0{width}d}" for i in range(n)]
+
+
+def simulate_stoichiometry(
+    n_compound: int, n_reaction: int, rng: np.random.Generator
+) -> pd.DataFrame:
+    """Get a random stoichiometry table in which every compound takes part in
+    at least one reaction and no reaction has the same compound twice.
+
+    The first half of each reaction's compounds, rounded up, are substrates
+    with coefficient -1 and the rest are products with coefficient 1, except
+    that in reactions with an odd number of compounds one product has
+    coefficient 2, so that the coefficients sum to zero.
+
+    """
+    n_cpd = np.minimum(
+        2 + rng.poisson(MEAN_EXTRA_REACTANTS, n_reaction),
+        min(MAX_REACTANTS, n_compound)
+    )
+    if n_cpd.sum() < n_compound:
+        raise ValueError(
+            f"{n_reaction} reactions are too few for {n_compound} compounds."
         )
-        dg_hat = get_dgr_prime(
-            row["I"],
-            row["t"],
-            row["ph"],
-            row["pmg"],
-            R,
-            microspecies,
-            true_pkas,
-            true_pkmgs,
-            rxn_stoichiometry,
-            true_dgfs
+    rxn = np.repeat(np.arange(n_reaction), n_cpd)
+    cpd = rng.integers(0, n_compound, len(rxn))
+    fixed = np.zeros(len(rxn), dtype=bool)
+    fixed[rng.choice(len(rxn), n_compound, replace=False)] = True
+    cpd[fixed] = rng.permutation(n_compound)
+    while True:  # redraw random compounds that are already in their reaction
+        order = np.lexsort([~fixed, cpd, rxn])
+        key = rxn[order] * n_compound + cpd[order]
+        dup = order[1:][key[1:] == key[:-1]]
+        if len(dup) == 0:
+            break
+        cpd[dup] = rng.integers(0, n_compound, len(dup))
+    within = np.arange(len(rxn)) - np.repeat(np.cumsum(n_cpd) - n_cpd, n_cpd)
+    n_substrate = np.repeat(n_cpd - n_cpd // 2, n_cpd)
+    coefficient = np.where(within < n_substrate, -1.0, 1.0)
+    coefficient[(within == n_substrate) & (np.repeat(n_cpd, n_cpd) % 2 == 1)] = 2.0
+    return pd.DataFrame({
+        "compound_id": np.array(get_ids("cpd", n_compound))[cpd],
+        "reaction_id": np.array(get_ids("rxn", n_reaction))[rxn],
+        "coefficient": coefficient,
+    })
+
+
+def simulate_microspecies(
+    compound_ids: List[str], rng: np.random.Generator
+) -> pd.DataFrame:
+    """Get a random microspecies table.
+
+    Each compound has a random number of pkas and pkmgs, and a microspecies
+    for every combination of bound protons and magnesium ions.
+
+    """
+    n = len(compound_ids)
+    n_pka = np.minimum(rng.poisson(MEAN_N_PKA, n), MAX_N_PKA)
+    n_pkmg = rng.choice(len(N_PKMG_PROBS), n, p=N_PKMG_PROBS)
+    n_ms = (n_pka + 1) * (n_pkmg + 1)
+    ms_cpd = np.repeat(np.arange(n), n_ms)
+    within = ragged_range(np.zeros(n, dtype=int), n_ms)
+    n_bound_h, n_bound_mg = np.divmod(within, (n_pkmg + 1)[ms_cpd])
+    base_nh = rng.integers(0, 3, n)
+    base_charge = rng.integers(-4, 1, n)
+    return pd.DataFrame({
+        "compound_id": np.array(compound_ids)[ms_cpd],
+        "charge": (base_charge[ms_cpd] + n_bound_h + 2 * n_bound_mg).astype(float),
+        "nh": (base_nh[ms_cpd] + n_bound_h).astype(float),
+        "nmg": n_bound_mg.astype(float),
+    })
+
+
+def simulate_pks(
+    microspecies: pd.DataFrame,
+    n: str,
+    pk: str,
+    first_loc: float,
+    first_sd: float,
+    rng: np.random.Generator,
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Get a table of measured pks, in the same format as prepare_stan_input,
+    and the true pks, drawn from the model's prior.
+
+    As model.stan requires measured pks to be non-negative, the pks of any
+    compound with a negative measurement are redrawn until there are none.
+
+    """
+    pks = (
+        microspecies.groupby(["compound_id", n]).size().reset_index()[["compound_id", n]]
+        .assign(order=lambda df: df.groupby("compound_id").cumcount())
+        .loc[lambda df: df["order"] > 0]
+        .reset_index(drop=True)
+    )
+    first = pks["order"].to_numpy() == 1
+    group = np.cumsum(first) - 1
+    group_start = np.flatnonzero(first)[group]
+    true, measured = np.zeros(len(pks)), np.full(len(pks), -1.0)
+    for _ in range(MAX_PK_REDRAWS):
+        bad_group = np.zeros(first.sum(), dtype=bool)
+        bad_group[group[measured < 0]] = True
+        redraw = bad_group[group]
+        if not redraw.any():
+            pks[pk] = measured
+            pks["name"] = pks["compound_id"]
+            return pks.drop(columns="order"), true
+        steps = np.where(
+            first,
+            -rng.normal(first_loc, first_sd, len(pks)),
+            rng.lognormal(np.log(3), 1, len(pks)),
         )
-        dg_meas = np.random.normal(dg_hat, error_sd)
-        dg_measurements.loc[i, "true_dgr_prime"] = dg_hat
-        dg_measurements.loc[i, "measured_dgr_prime"] = dg_meas
-    return dg_measurements
+        cumulative = np.cumsum(steps)
+        new_true = -(cumulative - cumulative[group_start] + steps[group_start])
+        true[redraw] = new_true[redraw]
+        measured[redraw] = rng.normal(true[redraw], MODEL_ERROR_SDS[pk])
+    raise ValueError(f"Couldn't draw non-negative {pk}s in {MAX_PK_REDRAWS} tries.")
+
+
+def simulate_dgf(
+    index: LegendreIndex,
+    pka_sum: np.ndarray,
+    pkmg_sum: np.ndarray,
+    rng: np.random.Generator,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Get observed formation energies (nan if unobserved) and true formation
+    energies drawn from the model's prior.
+
+    The formation energies of compounds in reactions whose dgr_prime at
+    REFERENCE_CONDITIONS is bigger than MAX_ABS_DGR are redrawn until there
+    are no such reactions.
+
+    """
+    n = len(index.compound_ids)
+    observed = rng.random(n) < OBSERVED_DGF_FRACTION
+    sd = np.where(observed, SIGMA_DGF[1], SIGMA_DGF[2])
+    loc, dgf = np.zeros(n), np.zeros(n)
+    redraw = np.arange(n)
+    rxn = np.arange(len(index.reaction_ids))
+    ref = {k: np.full(len(rxn), v) for k, v in REFERENCE_CONDITIONS.items()}
+    for _ in range(MAX_DGF_REDRAWS):
+        loc[redraw] = np.where(
+            observed[redraw], rng.normal(0, DGF_OBS_SD, len(redraw)), 0
+        )
+        dgf[redraw] = loc[redraw] + rng.normal(0, 1, len(redraw)) * sd[redraw]
+        dgr = get_dgr_prime_from_arrays(
+            index, rxn, ref["I"], ref["t"], ref["pH"], ref["pMg"], R,
+            dgf, pka_sum, pkmg_sum
+        )
+        bad = np.abs(dgr) > MAX_ABS_DGR
+        if not bad.any():
+            return np.where(observed, loc, np.nan), dgf
+        bad_stoic = ragged_range(index.fst_stoic[bad], index.n_stoic[bad])
+        redraw = np.unique(index.stoic_cpd[bad_stoic])
+    raise ValueError(
+        f"{bad.sum()} reactions still have |dgr_prime| > {MAX_ABS_DGR} after "
+        f"{MAX_DGF_REDRAWS} redraws."
+    )
+
+
+def simulate_measurement_chunk(
+    index: LegendreIndex,
+    rxn: np.ndarray,
+    dgf: np.ndarray,
+    pka_sum: np.ndarray,
+    pkmg_sum: np.ndarray,
+    seed: np.random.SeedSequence,
+) -> pd.DataFrame:
+    """Simulate measurements of some reactions in random conditions."""
+    rng = np.random.default_rng(seed)
+    n = len(rxn)
+    conditions = {
+        "T(K)": rng.choice(TEMPERATURES, n),
+        **{
+            k: rng.uniform(lo, hi, n).round(3 if k == "I" else 2)
+            for k, (lo, hi) in CONDITION_RANGES.items()
+        },
+    }
+    dgr = get_dgr_prime_from_arrays(
+        index, rxn, conditions["I"], conditions["T(K)"], conditions["pH"],
+        conditions["pMg"], R, dgf, pka_sum, pkmg_sum
+    )
+    dgr_measured = rng.normal(dgr, MODEL_ERROR_SDS["dg"])
+    return pd.DataFrame({
+        "reaction_id": np.array(index.reaction_ids)[rxn],
+        "K'": np.exp(-dgr_measured / (R * conditions["T(K)"])),
+        "T(K)": conditions["T(K)"],
+        "Ionic strength": conditions["I"],
+        "pH": conditions["pH"],
+        "pMg": conditions["pMg"],
+        "true_dgr_prime": dgr,
+    })
+
+
+def simulate_network(
+    n_compound: int,
+    n_reaction: int,
+    n_measurement: int,
+    seed: int = None,
+    n_processes: int = None,
+    chunk_size: int = MEASUREMENT_CHUNK_SIZE,
+) -> Dict[str, Any]:
+    """Simulate a synthetic network and its measurements.
+
+    The output has the model input tables (as from
+    prepare_stan_input.get_model_tables), "stan_codes", "stan_input" and
+    "true_params", with the true dgf, pka and pkmg in the model's order.
+
+    """
+    n_chunk = -(-n_measurement // chunk_size)
+    network_seed, *chunk_seeds = np.random.SeedSequence(seed).spawn(n_chunk + 1)
+    rng = np.random.default_rng(network_seed)
+    stoichiometry = simulate_stoichiometry(n_compound, n_reaction, rng)
+    compound_ids = get_ids("cpd", n_compound)
+    microspecies = simulate_microspecies(compound_ids, rng)
+    (pkas, true_pka), (pkmgs, true_pkmg) = (
+        simulate_pks(microspecies, "nh", "pka", 7, 3, rng),
+        simulate_pks(microspecies, "nmg", "pkmg", 5, 2, rng),
+    )
+    n_pka_cpd, n_pkmg_cpd = (
+        pks.groupby("compound_id").size()
+        .reindex(compound_ids, fill_value=0).to_numpy()
+        for pks in (pkas, pkmgs)
+    )
+    index = cap_pk_orders(
+        get_legendre_index(microspecies, stoichiometry, compound_ids),
+        n_pka_cpd,
+        n_pkmg_cpd,
+    )
+    pka_sum = get_ms_pk_sums(true_pka, n_pka_cpd, index.ms_cpd, index.pka_order)
+    pkmg_sum = get_ms_pk_sums(true_pkmg, n_pkmg_cpd, index.ms_cpd, index.pkmg_order)
+    dgf_obs, dgf = simulate_dgf(index, pka_sum, pkmg_sum, rng)
+    n_covered = min(n_measurement, n_reaction)
+    rxn = np.concatenate([
+        rng.permutation(n_reaction)[:n_covered],
+        rng.integers(0, n_reaction, n_measurement - n_covered),
+    ])
+    args = [
+        (index, rxn[i * chunk_size:(i + 1) * chunk_size], dgf, pka_sum, pkmg_sum, s)
+        for i, s in enumerate(chunk_seeds)
+    ]
+    if n_processes == 1:
+        chunks = [simulate_measurement_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(n_processes) as executor:
+            chunks = list(executor.map(simulate_measurement_chunk, *zip(*args)))
+    tecrdb = pd.concat(chunks, ignore_index=True)
+    compounds = pd.DataFrame({
+        "compound_id": compound_ids, "name": compound_ids, "dgf_obs": dgf_obs
+    })
+    tables = {
+        "tecrdb": tecrdb,
+        "stoichiometry": stoichiometry,
+        "microspecies": microspecies,
+        "compounds": compounds,
+        "pkas": pkas,
+        "pkmgs": pkmgs,
+    }
+    stan_codes = get_stan_codes(stoichiometry)
+    stan_input = get_stan_input(
+        **{k: v.copy() for k, v in tables.items()}, stan_codes=stan_codes
+    )
+    return {
+        **tables,
+        "stan_codes": stan_codes,
+        "stan_input": stan_input,
+        "true_params": {
+            "dgf": dgf.tolist(), "pka": true_pka.tolist(), "pkmg": true_pkmg.tolist()
+        },
+    }
+
+
+def write_network(network: Dict[str, Any], output_dir: str):
+    """Write a simulated network's Stan input, codes and tables."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {
+        k: os.path.join(output_dir, f) for k, f in SYNTHETIC_OUTPUT_FILES.items()
+    }
+    jsondump(paths["stan_input"], network["stan_input"])
+    jsondump(paths["stan_codes"], network["stan_codes"])
+    with open(paths["true_params"], "w") as f:
+        json.dump(network["true_params"], f)
+    for k in ["tecrdb", "compounds", "pkas", "pkmgs"]:
+        network[k].to_csv(paths[k])
 
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--n-compound", type=int)
+    parser.add_argument("--n-reaction", type=int)
+    parser.add_argument("--n-measurement", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n-processes", type=int)
+    parser.add_argument(
+        "--output-dir", default=os.path.join(OUTDIR, "synthetic"),
+        help="relative to this script's folder"
+    )
+    args = parser.parse_args()
+    sizes = [args.n_compound, args.n_reaction, args.n_measurement]
+    if any(size is not None for size in sizes):
+        if any(size is None for size in sizes):
+            parser.error("Give all of --n-compound, --n-reaction and --n-measurement.")
+        here = os.path.dirname(os.path.realpath(__file__))
+        network = simulate_network(*sizes, args.seed, args.n_processes)
+        write_network(network, os.path.join(here, args.output_dir))
+        return
     pka_measurements, pkmg_measurements = (
         simulate_pk_measurements(
             PK_MEASUREMENT_POSITIONS[p], TRUE_PARAMS[p], p, ERROR_SDS[p]
@@ -0,0 +1,126 @@
+"""Read selected variables from cmdstan output csv files.
+
+Only the requested columns are parsed, in chunks, and warmup draws are
+skipped, so reading a few variables doesn't require loading every generated
+quantity into memory.
+
+"""
+
+import math
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterator, List, Tuple
+
+CHUNKSIZE = 1000
+
+
+def read_stan_csv_header(path: str) -> Tuple[Dict[str, str], List[str]]:
+    """Get the configuration and column names of a cmdstan output csv file.
+
+    The configuration is a dictionary of the "key = value" pairs in the
+    initial comment lines, with values as strings.
+
+    """
+    config = {}
+    with open(path, "r") as f:
+        for line in f:
+            if not line.startswith("#"):
+                return config, line.strip().split(",")
+            key_val = line.lstrip(" #\t").replace("(Default)", "").split("=")
+            if len(key_val) == 2:
+                config[key_val[0].strip()] = key_val[1].strip()
+    raise ValueError(f"No column names found in {path}.")
+
+
+def get_n_warmup_rows(config: Dict[str, str]) -> int:
+    """Get the number of saved warmup draws at the start of a csv file."""
+    if config.get("save_warmup") != "1" or config.get("algorithm") == "fixed_param":
+        return 0
+    return math.ceil(int(config["num_warmup"]) / int(config.get("thin", "1")))
+
+
+def get_variable_columns(
+    columns: List[str], variables: List[str]
+) -> Dict[str, List[str]]:
+    """Get the csv columns of each variable, e.g. "dgf.1", "dgf.2", ..."""
+    out = {
+        v: [c for c in columns if c == v or c.split(".", 1)[0] == v]
+        for v in variables
+    }
+    missing = [v for v, cols in out.items() if len(cols) == 0]
+    if missing:
+        raise ValueError(f"Variables {missing} not found.")
+    return out
+
+
+def get_variable_names(columns: List[str]) -> List[str]:
+    """Get the distinct variable names in a list of csv columns, in order."""
+    return list(dict.fromkeys(c.split(".", 1)[0] for c in columns))
+
+
+def iter_stan_csv(
+    path: str, variables: List[str], chunksize: int = CHUNKSIZE
+) -> Iterator[Dict[str, np.ndarray]]:
+    """Yield chunks of post-warmup draws, as a (draw, dim) array for each
+    variable.
+
+    """
+    config, columns = read_stan_csv_header(path)
+    variable_columns = get_variable_columns(columns, variables)
+    usecols = [c for cols in variable_columns.values() for c in cols]
+    n_skip = get_n_warmup_rows(config)
+    reader = pd.read_csv(
+        path, comment="#", usecols=usecols, dtype=float, chunksize=chunksize
+    )
+    for chunk in reader:
+        if n_skip >= len(chunk):
+            n_skip -= len(chunk)
+            continue
+        chunk = chunk.iloc[n_skip:]
+        n_skip = 0
+        yield {v: chunk[cols].to_numpy() for v, cols in variable_columns.items()}
+
+
+def read_stan_csv(
+    path: str, variables: List[str], chunksize: int = CHUNKSIZE
+) -> Dict[str, np.ndarray]:
+    """Get a (draw, dim) array of post-warmup draws for each variable."""
+    chunks = list(iter_stan_csv(path, variables, chunksize))
+    if len(chunks) == 0:
+        _, columns = read_stan_csv_header(path)
+        return {
+            v: np.empty((0, len(cols)))
+            for v, cols in get_variable_columns(columns, variables).items()
+        }
+    return {v: np.concatenate([c[v] for c in chunks]) for v in variables}
+
+
+def read_stan_csvs(
+    paths: List[str], variables: List[str], chunksize: int = CHUNKSIZE
+) -> Dict[str, np.ndarray]:
+    """Get a (chain, draw, dim) array of post-warmup draws for each variable,
+    with one chain per csv file.
+
+    """
+    by_chain = [read_stan_csv(p, variables, chunksize) for p in paths]
+    return {v: np.stack([c[v] for c in by_chain]) for v in variables}
+
+
+def read_adaptation(path: str) -> Tuple[float, np.ndarray]:
+    """Get the adapted step size and diagonal inverse metric of a chain from
+    the comments that cmdstan writes after warmup.
+
+    """
+    step_size = None
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("# Step size"):
+                step_size = float(line.split("=")[1])
+            elif line.startswith("# Diagonal elements of inverse mass matrix"):
+                inv_metric = np.array(
+                    [float(x) for x in next(f).lstrip("# ").split(",")]
+                )
+                if step_size is None:
+                    break
+                return step_size, inv_metric
+    raise ValueError(f"No adapted step size and diagonal metric found in {path}.")
@@ -0,0 +1,84 @@
+"""Summarise posterior draws without going through long-format pandas tables.
+
+Summaries are computed directly on (chain, draw, dim) arrays, a block of
+dims at a time, so that memory-mapped draws are only ever partly in memory.
+
+"""
+
+import numpy as np
+import pandas as pd
+from typing import List, Sequence
+
+QUANTILES = [0.1, 0.5, 0.9]
+BLOCK_SIZE = 1000
+
+
+def get_hdi(draws: np.ndarray, prob: float) -> np.ndarray:
+    """Get a (2, dim) array with the lower and upper bounds of the narrowest
+    interval containing prob of a (draw, dim) array of draws.
+
+    """
+    n = len(draws)
+    n_in = int(np.floor(prob * n))
+    s = np.sort(draws, axis=0)
+    widths = s[n_in:] - s[:n - n_in]
+    lo_ix = np.argmin(widths, axis=0)
+    cols = np.arange(draws.shape[1])
+    return np.stack([s[lo_ix, cols], s[lo_ix + n_in, cols]])
+
+
+def summarise_block(
+    draws: np.ndarray, quantiles: Sequence[float], hdi_prob: float = None
+) -> np.ndarray:
+    """Get a (dim, statistic) array of summary statistics for a (draw, dim)
+    array, with statistics in the same order as get_summary_columns.
+
+    """
+    stats: List[np.ndarray] = [
+        draws.mean(axis=0),
+        draws.std(axis=0, ddof=1),
+        *np.quantile(draws, quantiles, axis=0),
+    ]
+    if hdi_prob is not None:
+        stats += list(get_hdi(draws, hdi_prob))
+    return np.stack(stats, axis=1)
+
+
+def get_summary_columns(
+    quantiles: Sequence[float], hdi_prob: float = None
+) -> List:
+    """Get the column names of a summary table."""
+    cols = ["mean", "sd"] + list(quantiles)
+    return cols + (["hdi_low", "hdi_high"] if hdi_prob is not None else [])
+
+
+def summarise_draws(
+    draws: np.ndarray,
+    index: Sequence = None,
+    quantiles: Sequence[float] = QUANTILES,
+    hdi_prob: float = None,
+    block_size: int = BLOCK_SIZE,
+) -> pd.DataFrame:
+    """Get a table with one row per dim summarising an array of draws.
+
+    :param draws: (chain, draw, dim) or (draw, dim) array, for example from
+    draws_store.load_draws.
+
+    :param index: labels of the dim axis, e.g. the tecrdb index for a variable
+    with one value per measurement.
+
+    :param hdi_prob: if given, also get the bounds of the highest density
+    interval with this probability.
+
+    """
+    draws = draws.reshape(-1, draws.shape[-1])
+    n_dim = draws.shape[1]
+    out = np.empty((n_dim, len(get_summary_columns(quantiles, hdi_prob))))
+    for start in range(0, n_dim, block_size):
+        block = np.asarray(draws[:, start:start + block_size])
+        out[start:start + block_size] = summarise_block(block, quantiles, hdi_prob)
+    return pd.DataFrame(
+        out,
+        index=index if index is not None else pd.RangeIndex(n_dim),
+        columns=get_summary_columns(quantiles, hdi_prob),
+    )
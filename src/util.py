@@ -1,16 +1,68 @@
+import hashlib
 import numpy as np
 import pandas as pd
+from ast import literal_eval
+from collections import OrderedDict
+from itertools import chain
 from math import isnan
 
+FORMULA_COL = "Reaction formula in python dictionary"
+STOICHIOMETRY_CACHE_SIZE = 32
+STOICHIOMETRY_CACHE: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+
+
+def hash_file(path: str, block_size: int = 2 ** 20) -> str:
+    """Get the sha256 hash of a file's contents, reading it a block at a
+    time.
+
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def hash_series(s: pd.Series) -> str:
+    """Get a hash of a series's index and values."""
+    hashes = pd.util.hash_pandas_object(s, index=True).to_numpy()
+    return hashlib.sha1(hashes.tobytes()).hexdigest()
+
+
+def parse_stoichiometries(formulas: pd.Series) -> pd.DataFrame:
+    """Get a long-format stoichiometry table from a series of formula strings
+    indexed by reaction id.
+
+    Formulas are python dictionary literals mapping compound ids to
+    coefficients. Non-string formulas are ignored.
+
+    """
+    formulas = formulas.loc[lambda s: s.map(type) == str]
+    dicts = [literal_eval(f) for f in formulas]
+    n_cpd = np.array([len(d) for d in dicts], dtype=int)
+    return pd.DataFrame({
+        "compound_id": list(chain.from_iterable(d.keys() for d in dicts)),
+        "reaction_id": np.repeat(formulas.index.to_numpy(), n_cpd),
+        "coefficient": np.fromiter(
+            chain.from_iterable(d.values() for d in dicts), float, n_cpd.sum()
+        ),
+    })
+
+
 def get_stoichiometry(tecrdb):
-    out = pd.DataFrame()
-    formula_col = "Reaction formula in python dictionary"
-    rxn_stoichiometries = tecrdb.groupby('reaction_id')[formula_col].first()
-    for rid, stoichiometry in rxn_stoichiometries.iteritems():
-        if type(stoichiometry) is not str:
-            continue
-        for cid, coef in eval(stoichiometry).items():
-            out = out.append({
-                "compound_id": cid, "reaction_id": rid, "coefficient": coef
-            }, ignore_index=True)
-    return out
+    """Get a long-format stoichiometry table from a TECRDB table.
+
+    Results are memoised by the hash of the reaction formulas, so repeated
+    calls with the same reactions are free. Only the STOICHIOMETRY_CACHE_SIZE
+    most recently used results are kept.
+
+    """
+    rxn_stoichiometries = tecrdb.groupby('reaction_id')[FORMULA_COL].first()
+    key = hash_series(rxn_stoichiometries)
+    if key in STOICHIOMETRY_CACHE:
+        STOICHIOMETRY_CACHE.move_to_end(key)
+    else:
+        STOICHIOMETRY_CACHE[key] = parse_stoichiometries(rxn_stoichiometries)
+        if len(STOICHIOMETRY_CACHE) > STOICHIOMETRY_CACHE_SIZE:
+            STOICHIOMETRY_CACHE.popitem(last=False)
+    return STOICHIOMETRY_CACHE[key].copy()
@@ -0,0 +1,151 @@
+"""Save and reuse the state of a previous fit to warm-start sampling.
+
+After each run, the adapted step size, diagonal inverse metric and last draw
+of every chain are saved with each parameter value labelled by compound id,
+e.g. "CHB_15346" for dgf_z or "CHB_15346[2]" for the second pka difference.
+When the data changes, a new fit is initialised by matching these labels
+against the new model input, so compounds that are already known start
+where they left off and new ones start at their prior centres.
+
+"""
+
+import json
+import numpy as np
+import os
+from typing import Any, Dict, List
+from stan_csv import read_adaptation, read_stan_csv
+
+PARAMETERS = ["dgf_z", "first_pka", "first_pkmg", "pka_diffs", "pkmg_diffs"]
+DEFAULT_INITS = {  # prior centres, for parameters that weren't in the old fit
+    "dgf_z": 0.0,
+    "first_pka": 7.0,
+    "first_pkmg": 5.0,
+    "pka_diffs": 3.0,
+    "pkmg_diffs": 3.0,
+}
+WARM_START_SAMPLE_ARGS = {
+    "iter_warmup": 100,
+    "adapt_init_phase": 15,
+    "adapt_metric_window": 25,
+    "adapt_step_size": 50,
+}
+
+
+def get_parameter_labels(
+    stan_input: Dict[str, Any], stan_codes: Dict[str, Dict[str, int]]
+) -> Dict[str, List[str]]:
+    """Get a label for every element of every parameter in PARAMETERS."""
+    compound_ids = sorted(
+        stan_codes["compound_id"], key=lambda c: stan_codes["compound_id"][c]
+    )
+    ms_cpd = np.array(stan_input["ms_cpd"])
+    labels = {"dgf_z": compound_ids}
+    for pk in ["pka", "pkmg"]:
+        n_pk = np.array(stan_input["n_" + pk])
+        n_pk_cpd = [n_pk[ms_cpd == i + 1].max() for i in range(len(compound_ids))]
+        pk_compounds = [(c, n) for c, n in zip(compound_ids, n_pk_cpd) if n > 0]
+        labels["first_" + pk] = [c for c, _ in pk_compounds]
+        labels[pk + "_diffs"] = [
+            f"{c}[{i}]" for c, n in pk_compounds for i in range(1, n)
+        ]
+    return labels
+
+
+def get_chain_state(
+    csv: str, labels: Dict[str, List[str]]
+) -> Dict[str, Any]:
+    """Get the step size, inverse metric and last draw of a chain, with
+    labelled parameter values.
+
+    """
+    step_size, inv_metric = read_adaptation(csv)
+    non_empty = [p for p in PARAMETERS if len(labels[p]) > 0]
+    last = {p: draws[-1] for p, draws in read_stan_csv(csv, non_empty).items()}
+    flat_labels = [f"{p}:{label}" for p in PARAMETERS for label in labels[p]]
+    if len(inv_metric) != len(flat_labels):
+        raise ValueError(
+            f"Inverse metric in {csv} has {len(inv_metric)} elements, but "
+            f"there are {len(flat_labels)} parameters."
+        )
+    return {
+        "step_size": step_size,
+        "inv_metric": dict(zip(flat_labels, inv_metric.tolist())),
+        "inits": {
+            p: dict(zip(labels[p], last[p].tolist())) if p in last else {}
+            for p in PARAMETERS
+        },
+    }
+
+
+def save_warm_start(
+    csvs: List[str], labels: Dict[str, List[str]], output_dir: str
+) -> List[str]:
+    """Save the state of each chain to a json file."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for i, csv in enumerate(csvs):
+        path = os.path.join(output_dir, f"chain-{i + 1}.json")
+        with open(path, "w") as f:
+            json.dump(get_chain_state(csv, labels), f)
+        paths.append(path)
+    return paths
+
+
+def map_chain_state(
+    state: Dict[str, Any], labels: Dict[str, List[str]]
+) -> Dict[str, Any]:
+    """Get inits, an inverse metric and a step size for new parameter labels
+    from a saved chain state.
+
+    Parameters that weren't in the saved state get their prior centre as an
+    init and the mean of the saved inverse metric.
+
+    """
+    inits = {
+        p: [state["inits"][p].get(label, DEFAULT_INITS[p]) for label in labels[p]]
+        for p in PARAMETERS
+    }
+    default_metric = float(np.mean(list(state["inv_metric"].values())))
+    inv_metric = [
+        state["inv_metric"].get(f"{p}:{label}", default_metric)
+        for p in PARAMETERS for label in labels[p]
+    ]
+    return {
+        "inits": inits, "inv_metric": inv_metric, "step_size": state["step_size"]
+    }
+
+
+def get_warm_start_args(
+    state_dir: str,
+    labels: Dict[str, List[str]],
+    chains: int,
+    output_dir: str,
+) -> Dict[str, Any]:
+    """Get CmdStanModel.sample arguments that warm-start each chain from the
+    states saved in state_dir.
+
+    If there are more chains than saved states, states are reused in turn.
+    The init and metric files that cmdstan needs are written to output_dir.
+
+    """
+    state_paths = sorted(
+        os.path.join(state_dir, f) for f in os.listdir(state_dir)
+        if f.startswith("chain-") and f.endswith(".json")
+    )
+    if len(state_paths) == 0:
+        raise ValueError(f"No saved chain states in {state_dir}.")
+    os.makedirs(output_dir, exist_ok=True)
+    inits, metrics, step_sizes = [], [], []
+    for chain in range(chains):
+        with open(state_paths[chain % len(state_paths)], "r") as f:
+            mapped = map_chain_state(json.load(f), labels)
+        init_path = os.path.join(output_dir, f"inits-{chain + 1}.json")
+        metric_path = os.path.join(output_dir, f"metric-{chain + 1}.json")
+        with open(init_path, "w") as f:
+            json.dump(mapped["inits"], f)
+        with open(metric_path, "w") as f:
+            json.dump({"inv_metric": mapped["inv_metric"]}, f)
+        inits.append(init_path)
+        metrics.append(metric_path)
+        step_sizes.append(mapped["step_size"])
+    return {"inits": inits, "metric": metrics, "step_size": step_sizes}
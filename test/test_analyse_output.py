@@ -0,0 +1,30 @@
+import os
+import numpy as np
+import pandas as pd
+from analyse_output import plot_pka, render_figures
+
+
+def test_render_figures(tmp_path):
+    """Test that large tables are split into several pages."""
+    n = 25
+    rng = np.random.default_rng(0)
+    med = rng.normal(7, 2, n)
+    pkas = pd.DataFrame({
+        "name": [f"compound {i}" for i in range(n)],
+        "nh": np.arange(n, dtype=float),
+        "pka": np.where(np.arange(n) % 2 == 0, med, np.nan),
+        0.1: med - 1,
+        0.5: med,
+        0.9: med + 1,
+    })
+    here = os.path.dirname(os.path.realpath(__file__))
+    style = os.path.join(here, "../src/sparse.mplstyle")
+    stale = tmp_path / "pka-4.png"
+    stale.write_bytes(b"")
+    paths = render_figures(
+        [(plot_pka, pkas, 0.5, "pka.png")], str(tmp_path), style, page_size=10,
+        n_processes=2
+    )
+    assert [os.path.basename(p) for p in paths] == ["pka.png", "pka-2.png", "pka-3.png"]
+    assert all(os.path.exists(p) for p in paths)
+    assert not stale.exists()
@@ -0,0 +1,24 @@
+import numpy as np
+from approximate import compare_approximation
+from draws_store import load_draws, load_manifest, write_draws_array
+
+
+def test_compare_approximation(tmp_path):
+    rng = np.random.default_rng(0)
+    columns = ["lp__", "dgf[1]", "dgf[2]", "pka[1]"]
+    coords = {"compound": ["a", "b"], "pka": ["p"]}
+    dims = {"dgf": ["compound"], "pka": ["pka"]}
+    nuts = rng.normal([0, 1, 2, 7], 1, size=(2, 4000, 4))
+    approx = rng.normal([0, 1.5, 2, 7], 0.5, size=(1, 4000, 4))
+    nuts_store, approx_store = str(tmp_path / "nuts"), str(tmp_path / "approx")
+    write_draws_array(nuts, columns, nuts_store, "sample", coords, dims)
+    write_draws_array(approx, columns, approx_store, "variational", coords, dims)
+    manifest = load_manifest(approx_store)
+    assert manifest["method"] == "variational"
+    assert manifest["variables"]["dgf"]["shape"] == [1, 4000, 2]
+    np.testing.assert_array_equal(load_draws(approx_store, "dgf"), approx[:, :, 1:3])
+    report = compare_approximation(nuts_store, approx_store)
+    assert list(report.index) == ["a", "b", "p"]
+    assert list(report["variable"]) == ["dgf", "dgf", "pka"]
+    np.testing.assert_allclose(report["median_error"], [0.5, 0, 0], atol=0.1)
+    np.testing.assert_allclose(report["width_ratio"], 0.5, atol=0.05)
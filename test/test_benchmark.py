@@ -0,0 +1,30 @@
+from benchmark import add_formulas, benchmark_tables, compare_results, time_function
+from simulate import simulate_network
+
+
+def test_benchmark_tables():
+    network = simulate_network(20, 10, 50, seed=1, n_processes=1)
+    tables = {
+        k: network[k]
+        for k in ["tecrdb", "stoichiometry", "microspecies", "compounds", "pkas", "pkmgs"]
+    }
+    tables["tecrdb"] = add_formulas(tables["tecrdb"], tables["stoichiometry"])
+    timings = benchmark_tables(tables, repeats=1)
+    assert set(timings) == {
+        "get_stoichiometry", "get_stan_input", "get_dgr_prime", "get_dgr_prime_batch"
+    }
+    assert timings["get_dgr_prime"]["n"] == 50
+    assert all(t["median"] > 0 for t in timings.values())
+
+
+def test_compare_results():
+    assert time_function(lambda x: x, repeats=3, setup=lambda: (1,))["repeats"] == 3
+    baseline = {"results": {
+        "a/x": {"median": 1.0}, "a/y": {"median": 1.0}, "a/z": {"skipped": "no"}
+    }}
+    results = {"results": {
+        "a/x": {"median": 1.1}, "a/y": {"median": 2.0}, "a/z": {"median": 1.0},
+        "a/new": {"median": 1.0},
+    }}
+    comparison = compare_results(results, baseline, threshold=1.2)
+    assert comparison["slower"].to_dict() == {"a/x": False, "a/y": True}
@@ -0,0 +1,54 @@
+import arviz as az
+import json
+import numpy as np
+import os
+import pytest
+from compare_models import compare_models, get_loo
+
+
+def write_store(folder, arrays):
+    os.makedirs(folder)
+    manifest = {"variables": {}}
+    for v, a in arrays.items():
+        np.save(os.path.join(folder, v + ".npy"), a)
+        manifest["variables"][v] = {"file": v + ".npy", "shape": list(a.shape)}
+    with open(os.path.join(folder, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+
+def test_get_loo(tmp_path):
+    """Test that chunked results agree with arviz and are cached."""
+    rng = np.random.default_rng(0)
+    dgf = rng.normal(size=(2, 200, 3))
+    log_lik = rng.normal(-1, 0.5, size=(2, 200, 23))
+    folder = str(tmp_path / "a")
+    write_store(folder, {"dgf": dgf, "log_lik_dgr": log_lik})
+    idata = az.from_dict(posterior={"dgf": dgf}, log_likelihood={"y": log_lik})
+    expected = az.loo(idata)
+    summary, pointwise = get_loo(folder, chunk_size=5, n_processes=1)
+    assert np.isclose(summary["elpd_loo"], expected["elpd_loo"])
+    assert np.isclose(summary["se_loo"], expected["se"])
+    assert np.isclose(summary["elpd_waic"], az.waic(idata)["elpd_waic"])
+    np.testing.assert_allclose(pointwise[:, 2], expected["pareto_k"].values)
+    assert os.path.exists(os.path.join(folder, "loo", "summary.json"))
+    cached_summary, _ = get_loo(folder, chunk_size=5, n_processes=1)
+    assert cached_summary == summary
+
+
+def test_compare_models(tmp_path):
+    rng = np.random.default_rng(1)
+    dgf = rng.normal(size=(2, 100, 3))
+    folders = [str(tmp_path / "good"), str(tmp_path / "bad")]
+    write_store(folders[0], {"dgf": dgf, "log_lik_dgr": rng.normal(-1, 0.1, (2, 100, 10))})
+    write_store(folders[1], {"dgf": dgf, "log_lik_dgr": rng.normal(-3, 0.1, (2, 100, 10))})
+    comparison = compare_models(folders[::-1], chunk_size=4, n_processes=2)
+    assert list(comparison.index) == folders
+    assert comparison.loc[folders[0], "elpd_diff"] == 0
+    assert comparison.loc[folders[1], "elpd_diff"] > 0
+
+
+def test_get_loo_without_log_lik(tmp_path):
+    folder = str(tmp_path / "predictive")
+    write_store(folder, {"dgf": np.zeros((2, 10, 3))})
+    with pytest.raises(ValueError, match="--output-profile full"):
+        get_loo(folder)
@@ -0,0 +1,59 @@
+import numpy as np
+from condition_grid import (
+    dh_scale, get_interpolation_error, get_value_labels, interpolate_dgr_prime,
+    inverse_dh_scale, load_grid, tabulate_dgf_prime, write_grid
+)
+from legendre import get_dgr_prime_batch, get_legendre_index
+from simulate import MICROSPECIES, STOICHIOMETRY, TRUE_PARAMS
+
+
+def test_condition_grid(tmp_path):
+    """Test that interpolation matches the exact transform at and between grid
+    points, and that tables of draws add up to reactions.
+
+    """
+    cids = sorted(STOICHIOMETRY["compound_id"].unique())
+    n_pka_cpd, n_pkmg_cpd = (
+        np.array([len(TRUE_PARAMS[p].get(c, [])) for c in cids])
+        for p in ["pka", "pkmg"]
+    )
+    draws = {
+        "dgf": np.array([[TRUE_PARAMS["dgf"][c] for c in cids]]),
+        **{
+            p: np.concatenate([TRUE_PARAMS[p].get(c, []) for c in cids])[None, :]
+            for p in ["pka", "pkmg"]
+        },
+    }
+    axes = {
+        "I": inverse_dh_scale(np.linspace(dh_scale(0.05), dh_scale(0.2), 4)),
+        "t": [298.15, 304.15, 310.15],
+        "pH": np.arange(6, 8.01, 0.25),
+        "pMg": np.arange(2, 4.01, 0.5),
+    }
+    grid = tabulate_dgf_prime(
+        MICROSPECIES, cids, draws, n_pka_cpd, n_pkmg_cpd, axes=axes,
+        values=get_value_labels([], 1), chunk_size=100,
+    )
+    assert grid.table.shape == (len(cids), 4, 3, 9, 5, 1)
+    write_grid(grid, str(tmp_path))
+    grid = load_grid(str(tmp_path))
+    reaction = (
+        STOICHIOMETRY.loc[lambda df: df["reaction_id"] == STOICHIOMETRY["reaction_id"][0]]
+        .set_index("compound_id")["coefficient"].to_dict()
+    )
+    pH, pMg = np.array([[6.0], [7.1]]), np.array([2.0, 3.3, 4.0])
+    actual = interpolate_dgr_prime(grid, reaction, 0.1, 298.15, pH, pMg)
+    assert actual.shape == (2, 3, 1)
+    index = get_legendre_index(MICROSPECIES, STOICHIOMETRY, cids)
+    pH, pMg = np.broadcast_arrays(pH, pMg)
+    n = pH.size
+    expected = get_dgr_prime_batch(
+        index, [STOICHIOMETRY["reaction_id"][0]] * n, [0.1] * n, [298.15] * n,
+        pH.ravel(), pMg.ravel(), 8.314e-3, TRUE_PARAMS["pka"], TRUE_PARAMS["pkmg"],
+        TRUE_PARAMS["dgf"],
+    )
+    assert np.allclose(actual[..., 0].ravel(), expected, atol=0.5)
+    # pH 6 and pMg 2 or 4 are on the grid
+    assert np.allclose(actual[0, [0, 2], 0], expected.reshape(2, 3)[0, [0, 2]], atol=1e-3)
+    error = get_interpolation_error(grid, MICROSPECIES, draws, n_pka_cpd, n_pkmg_cpd, 200)
+    assert error < 0.5
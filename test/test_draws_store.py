@@ -0,0 +1,41 @@
+import numpy as np
+from draws_store import load_draws, load_manifest, write_draws_store
+
+CSV = """# method = sample (Default)
+#   sample
+#     num_samples = 3
+#     num_warmup = 1
+#     save_warmup = 1
+lp__,dgf.1,dgf.2,sigma
+-1,0,0,0
+# Adaptation terminated
+{sampling}
+"""
+
+
+def test_write_draws_store(tmp_path):
+    csvs = []
+    for chain in range(2):
+        path = str(tmp_path / f"samples-{chain + 1}.csv")
+        rows = "\n".join(
+            f"-1,{chain}{i},{chain}{i}.5,{i}" for i in range(1, 4)
+        )
+        with open(path, "w") as f:
+            f.write(CSV.format(sampling=rows))
+        csvs.append(path)
+    store = str(tmp_path / "draws")
+    write_draws_store(
+        csvs,
+        store,
+        coords={"compound": ["a", "b"]},
+        dims={"dgf": ["compound"]},
+        chunksize=2
+    )
+    manifest = load_manifest(store)
+    assert manifest["variables"]["dgf"]["dims"] == ["chain", "draw", "compound"]
+    assert manifest["variables"]["dgf"]["shape"] == [2, 3, 2]
+    assert manifest["coords"]["compound"] == ["a", "b"]
+    dgf = load_draws(store, "dgf")
+    assert isinstance(dgf, np.memmap)
+    np.testing.assert_array_equal(dgf[1, :, 1], [11.5, 12.5, 13.5])
+    np.testing.assert_array_equal(load_draws(store, "sigma")[:, :, 0], [[1, 2, 3]] * 2)
@@ -0,0 +1,36 @@
+import json
+import os
+import pytest
+from instrument import ENV_PROFILE, instrumented, stage
+
+
+def test_instrumented(tmp_path, monkeypatch):
+    monkeypatch.setenv(ENV_PROFILE, "inner:tracemalloc")
+
+    @instrumented("inner_script", log_folder=str(tmp_path))
+    def inner():
+        with stage("inner"):
+            return [0] * 100000
+
+    @instrumented("script", log_folder=str(tmp_path))
+    def main():
+        with stage("outer"):
+            inner()
+        with stage("fail"):
+            raise ValueError("oops")
+
+    with stage("no_run") as record:
+        assert record is None
+    with pytest.raises(ValueError):
+        main()
+    logs = [f for f in os.listdir(tmp_path) if f.endswith(".json")]
+    assert len(logs) == 1 and logs[0].startswith("script-")
+    with open(tmp_path / logs[0], "r") as f:
+        log = json.load(f)
+    names = [s["name"] for s in log["stages"]]
+    assert names == ["outer", "outer/inner_script", "outer/inner_script/inner", "fail"]
+    assert log["error"] == "ValueError('oops')"
+    stages = {s["name"]: s for s in log["stages"]}
+    assert stages["outer"]["peak_rss"] >= stages["outer/inner_script/inner"]["peak_rss"]
+    assert stages["outer"]["wall"] >= stages["outer/inner_script"]["wall"] >= 0
+    assert os.path.exists(stages["outer/inner_script/inner"]["profile"])
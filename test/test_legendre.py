@@ -0,0 +1,48 @@
+import numpy as np
+from legendre import get_dgr_prime, get_dgr_prime_batch, get_legendre_index
+from simulate import (
+    DG_MEASUREMENT_CONDITIONS, MICROSPECIES, STOICHIOMETRY, TRUE_PARAMS, R
+)
+
+
+def check_batch_matches_scalar(pka, pkmg):
+    conditions = DG_MEASUREMENT_CONDITIONS
+    index = get_legendre_index(MICROSPECIES, STOICHIOMETRY)
+    rxn_stoichiometry = STOICHIOMETRY.set_index("compound_id")["coefficient"]
+    expected = [
+        get_dgr_prime(
+            row["I"], row["t"], row["ph"], row["pmg"], R, MICROSPECIES,
+            pka, pkmg,
+            rxn_stoichiometry.to_dict(), TRUE_PARAMS["dgf"]
+        )
+        for _, row in conditions.iterrows()
+    ]
+    actual = get_dgr_prime_batch(
+        index,
+        conditions["reaction_id"],
+        conditions["I"],
+        conditions["t"],
+        conditions["ph"],
+        conditions["pmg"],
+        R,
+        pka,
+        pkmg,
+        TRUE_PARAMS["dgf"],
+        chunk_size=4,
+    )
+    assert np.allclose(actual, expected)
+
+
+def test_get_dgr_prime_batch():
+    """Test that the batched and one-at-a-time dgr_prime calculations agree."""
+    check_batch_matches_scalar(TRUE_PARAMS["pka"], TRUE_PARAMS["pkmg"])
+
+
+def test_get_dgr_prime_batch_missing_pks():
+    """Test that the calculations agree when compounds have fewer pks than
+    bound states, so that microspecies's pk orders are truncated.
+
+    """
+    pka = {cid: pks[:-1] for cid, pks in TRUE_PARAMS["pka"].items()}
+    pkmg = {cid: pks[:-1] for cid, pks in TRUE_PARAMS["pkmg"].items()}
+    check_batch_matches_scalar(pka, pkmg)
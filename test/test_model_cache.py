@@ -0,0 +1,48 @@
+import os
+from model_cache import get_model_hash, get_stan_sources
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_get_model_hash(tmp_path):
+    """Test that the hash depends on included files, not modification times."""
+    include_dir = tmp_path / "include"
+    include_dir.mkdir()
+    model = str(tmp_path / "model.stan")
+    write(model, "functions {\n#include f.stan\n}\nmodel {}\n")
+    write(str(include_dir / "f.stan"), "#include g.stan\nreal f(){return 1;}\n")
+    write(str(include_dir / "g.stan"), "real g(){return 1;}\n")
+    sources = get_stan_sources(model, [str(include_dir)])
+    assert [os.path.basename(s) for s in sources] == [
+        "model.stan", "f.stan", "g.stan"
+    ]
+    before = get_model_hash(model, "cmdstan-2.26.1", [str(include_dir)])
+    os.utime(model, (0, 0))
+    assert get_model_hash(model, "cmdstan-2.26.1", [str(include_dir)]) == before
+    assert get_model_hash(model, "cmdstan-2.27.0", [str(include_dir)]) != before
+    assert get_model_hash(
+        model, "cmdstan-2.26.1", [str(include_dir)], cpp_options={"STAN_THREADS": True}
+    ) != before
+    write(str(include_dir / "g.stan"), "real g(){return 2;}\n")
+    assert get_model_hash(model, "cmdstan-2.26.1", [str(include_dir)]) != before
+
+
+def test_get_model_hash_location(tmp_path):
+    """Test that the hash doesn't depend on where the files are."""
+    hashes = []
+    for checkout in ["a", "b"]:
+        include_dir = tmp_path / checkout / "include"
+        include_dir.mkdir(parents=True)
+        model = str(tmp_path / checkout / "model.stan")
+        write(model, "functions {\n#include f.stan\n}\nmodel {}\n")
+        write(str(include_dir / "f.stan"), "real f(){return 1;}\n")
+        hashes.append(get_model_hash(
+            model,
+            "cmdstan-2.26.1",
+            [str(include_dir)],
+            stanc_options={"include_paths": [str(include_dir)]},
+        ))
+    assert hashes[0] == hashes[1]
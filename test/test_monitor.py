@@ -0,0 +1,38 @@
+import numpy as np
+from monitor import check_convergence, new_tail, read_new_draws, truncate_csv
+from stan_csv import read_stan_csv, read_stan_csv_header
+
+HEADER = """# method = sample (Default)
+#   sample
+#     num_samples = 4
+#     num_warmup = 1
+#     save_warmup = 1
+lp__,dgf.1,dgf.2,sigma
+-1,9,9,9
+# Adaptation terminated
+"""
+
+
+def test_read_new_draws(tmp_path):
+    path = str(tmp_path / "samples-1.csv")
+    tail = new_tail()
+    with open(path, "w") as f:
+        f.write(HEADER + "-1,1,2,0\n-1,3,")
+    read_new_draws(path, tail, ["dgf"])
+    assert len(tail["draws"]) == 1
+    np.testing.assert_array_equal(tail["draws"][0], [[1, 2]])
+    with open(path, "a") as f:
+        f.write("4,0\n-1,5,6,0\n")
+    read_new_draws(path, tail, ["dgf"])
+    np.testing.assert_array_equal(np.concatenate(tail["draws"]), [[1, 2], [3, 4], [5, 6]])
+    truncate_csv(path, 2)
+    config, _ = read_stan_csv_header(path)
+    assert config["num_samples"] == "2"
+    np.testing.assert_array_equal(read_stan_csv(path, ["dgf"])["dgf"], [[1, 2], [3, 4]])
+
+
+def test_check_convergence():
+    good = {"rhat": 1.005, "ess_bulk": 500, "ess_tail": 450}
+    assert check_convergence(good, target_ess=400) == "converged"
+    assert check_convergence({**good, "ess_tail": 100}, target_ess=400) == "running"
+    assert check_convergence({**good, "rhat": 3.0}, target_ess=400) == "diverged"
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+from draws_store import (
+    DIMS, get_model_coords, load_draws, load_flat_draws, write_draws_array
+)
+from partition import get_components, get_partition, get_shards, merge_draws
+from predict import CONDITION_COLS
+from query_service import DgrPrimeService
+from simulate import simulate_network
+
+
+def test_get_components_and_shards():
+    stoichiometry = pd.DataFrame({
+        "reaction_id": ["r1", "r1", "r2", "r2", "r3", "r3", "r4", "r4"],
+        "compound_id": ["a", "w", "a", "b", "c", "w", "d", "e"],
+    })
+    components = get_components(stoichiometry, shared_compounds=["w"])
+    assert components.to_dict() == {"r1": 0, "r2": 0, "r3": 1, "r4": 2}
+    assert get_components(stoichiometry, []).nunique() == 2
+    tecrdb = pd.DataFrame({"reaction_id": ["r1", "r2", "r2", "r3", "r4", "r4"]})
+    shards = get_shards(components, tecrdb, n_shards=2)
+    assert shards.to_dict() == {"r1": 0, "r2": 0, "r3": 1, "r4": 1}
+
+
+def test_merge_draws(tmp_path):
+    coords = {"compound": ["a", "b", "w"]}
+    dims = {"dgf": ["compound"]}
+    shard_stores, indexes = [], []
+    for i, (cpds, index) in enumerate([(2, [0, 2]), (2, [1, -1])]):
+        draws = np.full((2, 3, cpds + 1), float(i))
+        folder = str(tmp_path / f"shard-{i}")
+        columns = ["lp__"] + [f"dgf.{j + 1}" for j in range(cpds)]
+        write_draws_array(draws, columns, folder, "sample")
+        shard_stores.append(folder)
+        indexes.append({"compound": index})
+    store = str(tmp_path / "draws")
+    manifest = merge_draws(shard_stores, indexes, store, coords, dims)
+    assert manifest["variables"]["dgf"]["shape"] == [2, 3, 3]
+    np.testing.assert_array_equal(load_draws(store, "dgf")[0, 0], [0, 1, 0])
+
+
+def test_merged_store_loads(tmp_path):
+    """Test that a store merged from shards has the dgf, pka and pkmg draws that
+    predict and the query service load, in the whole model's order.
+
+    The shards' draws are the true parameters, so the merged store should
+    reproduce the simulated measurements' true dgr_prime.
+
+    """
+    network = simulate_network(12, 8, 30, seed=0, n_processes=1)
+    stan_codes = network["stan_codes"]
+    counts = network["stoichiometry"]["compound_id"].value_counts()
+    shared = counts.index[counts > 1].tolist()
+    partition = get_partition(network, stan_codes, n_shards=2, shared_compounds=shared)
+    assert len(partition) == 2
+    true = {p: np.array(v) for p, v in network["true_params"].items()}
+    shard_stores = []
+    for i, shard in enumerate(partition):
+        coords = shard["coords"]
+        global_ix = {
+            "dgf": [stan_codes["compound_id"][c] - 1 for c in coords["compound"]],
+            "pka": coords["pka"],
+            "pkmg": coords["pkmg"],
+        }
+        columns = [
+            f"{p}.{j + 1}" for p, ix in global_ix.items() for j in range(len(ix))
+        ]
+        values = np.concatenate([true[p][ix] for p, ix in global_ix.items()])
+        folder = str(tmp_path / f"shard-{i}")
+        write_draws_array(
+            np.tile(values, (2, 3, 1)), columns, folder, "sample", coords, DIMS
+        )
+        shard_stores.append(folder)
+    store = str(tmp_path / "draws")
+    coords = get_model_coords(
+        stan_codes, network["tecrdb"], network["pkas"], network["pkmgs"]
+    )
+    merge_draws(shard_stores, [s["index"] for s in partition], store, coords)
+    draws = load_flat_draws(store, ["dgf", "pka", "pkmg"])
+    for p, d in draws.items():
+        np.testing.assert_array_equal(d, np.tile(true[p], (6, 1)))
+    cids = list(stan_codes["compound_id"].keys())
+    n_pka_cpd, n_pkmg_cpd = (
+        network[k].groupby("compound_id").size()
+        .reindex(cids, fill_value=0).to_numpy()
+        for k in ["pkas", "pkmgs"]
+    )
+    service = DgrPrimeService(
+        draws, network["microspecies"], cids, n_pka_cpd, n_pkmg_cpd
+    )
+    reactions = {
+        r: d.set_index("compound_id")["coefficient"].to_dict()
+        for r, d in network["stoichiometry"].groupby("reaction_id")
+    }
+    queries = [
+        {
+            "reaction": reactions[row["reaction_id"]],
+            **row[list(CONDITION_COLS.values())].to_dict(),
+        }
+        for _, row in network["tecrdb"].iterrows()
+    ]
+    actual, errors = service.get_dgr_prime_draws(queries)
+    assert errors == [None] * len(queries)
+    assert np.allclose(actual, network["tecrdb"]["true_dgr_prime"].to_numpy())
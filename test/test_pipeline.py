@@ -0,0 +1,54 @@
+import sys
+from pipeline import Cache, Stage, normalise_python, run_pipeline, select_stages
+
+SCRIPT = """# {comment}
+import sys
+with open(sys.argv[1]) as f_in, open(sys.argv[2], "w") as f_out:
+    f_out.write(f_in.read().strip().{method}())
+with open("runs.txt", "a") as f:
+    f.write(sys.argv[2] + "\\n")
+"""
+
+
+def test_normalise_python():
+    assert normalise_python('"""Doc."""\nx = 1  # one\n') == normalise_python("x = (1)")
+    assert normalise_python("x = 1") != normalise_python("x = 2")
+
+
+def test_run_pipeline(tmp_path):
+    def write_script(comment, method):
+        (tmp_path / "step.py").write_text(SCRIPT.format(comment=comment, method=method))
+
+    def get_runs():
+        runs = tmp_path / "runs.txt"
+        return runs.read_text().split() if runs.exists() else []
+
+    stages = [
+        Stage("a", [sys.executable, "step.py", "in.txt", "mid.txt"], ["in.txt", "step.py"], ["mid.txt"]),
+        Stage("b", [sys.executable, "step.py", "mid.txt", "out.txt"], ["mid.txt"], ["out.txt"]),
+    ]
+    assert [s.name for s in select_stages(stages, ["b"])] == ["a", "b"]
+    assert [s.name for s in select_stages(stages, ["a"])] == ["a"]
+
+    def run():
+        cache = Cache(str(tmp_path / "cache"))
+        return run_pipeline(stages, cache, jobs=2, root=str(tmp_path))
+
+    write_script("first", "upper")
+    (tmp_path / "in.txt").write_text("x")
+    assert run()["b"].startswith("ran")
+    assert (tmp_path / "out.txt").read_text() == "X"
+    assert run() == {"a": "up to date", "b": "up to date"}
+    # only a comment changes, but step.py is also an input of a, so a runs;
+    # its output is the same, so b doesn't
+    write_script("second", "upper")
+    results = run()
+    assert results["a"].startswith("ran") and results["b"] == "up to date"
+    assert get_runs() == ["mid.txt", "out.txt", "mid.txt"]
+    # new input, then back to the old one, which is restored from the cache
+    (tmp_path / "in.txt").write_text("y")
+    assert all(r.startswith("ran") for r in run().values())
+    (tmp_path / "in.txt").write_text("x")
+    assert run() == {"a": "restored from cache", "b": "restored from cache"}
+    assert (tmp_path / "out.txt").read_text() == "X"
+    assert len(get_runs()) == 5
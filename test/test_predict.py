@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+from legendre import get_dgr_prime_batch, get_legendre_index
+from predict import get_held_out_tecrdb, predict_dgr_prime
+from util import FORMULA_COL
+from simulate import (
+    DG_MEASUREMENT_CONDITIONS, MICROSPECIES, STOICHIOMETRY, TRUE_PARAMS
+)
+
+
+def test_predict_dgr_prime():
+    """Test that chunked prediction over draws matches one draw at a time."""
+    R = 8.314e-3
+    conditions = DG_MEASUREMENT_CONDITIONS.rename(
+        columns={"I": "Ionic strength", "t": "T(K)", "ph": "pH", "pmg": "pMg"}
+    )
+    index = get_legendre_index(MICROSPECIES, STOICHIOMETRY)
+    cids = index.compound_ids
+    n_pka_cpd, n_pkmg_cpd = (
+        np.array([len(TRUE_PARAMS[p].get(c, [])) for c in cids])
+        for p in ["pka", "pkmg"]
+    )
+    rng = np.random.default_rng(1234)
+    n_draw = 5
+    draws = {
+        "dgf": np.array([TRUE_PARAMS["dgf"][c] for c in cids])
+        + rng.normal(0, 10, (n_draw, len(cids))),
+        **{
+            p: np.concatenate([TRUE_PARAMS[p].get(c, []) for c in cids])
+            + rng.normal(0, 0.1, (n_draw, n))
+            for p, n in [("pka", n_pka_cpd.sum()), ("pkmg", n_pkmg_cpd.sum())]
+        }
+    }
+    expected = []
+    for d in range(n_draw):
+        pk_dicts = {
+            p: dict(zip(cids, np.split(draws[p][d], np.cumsum(n)[:-1])))
+            for p, n in [("pka", n_pka_cpd), ("pkmg", n_pkmg_cpd)]
+        }
+        expected.append(get_dgr_prime_batch(
+            index,
+            conditions["reaction_id"],
+            conditions["Ionic strength"],
+            conditions["T(K)"],
+            conditions["pH"],
+            conditions["pMg"],
+            R,
+            pk_dicts["pka"],
+            pk_dicts["pkmg"],
+            dict(zip(cids, draws["dgf"][d])),
+        ))
+    for n_processes in [1, 2]:
+        actual = predict_dgr_prime(
+            index, conditions, draws, n_pka_cpd, n_pkmg_cpd,
+            draw_chunk_size=2, n_processes=n_processes
+        )
+        assert np.allclose(actual, np.array(expected))
+
+
+def test_get_held_out_tecrdb():
+    """Test that held-out rows are unfitted rows with known conditions and
+    compounds.
+
+    """
+    known = "{'cpd_a': -1, 'cpd_b': 1}"
+    tecrdb = pd.DataFrame({
+        "reaction_id": ["rxn_0", "rxn_0", "rxn_0", "rxn_1"],
+        FORMULA_COL: [known, known, known, "{'cpd_a': -1, 'cpd_c': 1}"],
+        "Ionic strength": [0.1, 0.1, 0.1, 0.1],
+        "T(K)": [298.15, 303.15, 298.15, 298.15],
+        "pH": [7.0, 7.5, 7.0, 7.0],
+        "pMg": [3.0, 3.0, np.nan, 3.0],
+        "exclude": ["no", "yes", "no", "no"],
+    })
+    held_out = get_held_out_tecrdb(tecrdb, pd.Index([0]), ["cpd_a", "cpd_b"])
+    assert held_out.index.tolist() == [1]
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from prepare_stan_input import (
+    get_condition_index, get_group_first_ix, get_output_flags
+)
+
+
+def test_get_condition_index():
+    """Test that the sparse matrix reproduces each measurement's reaction.
+
+    Reaction 1 is A -> B and reaction 2 is A + C -> 2B. The first two
+    measurements share a condition.
+
+    """
+    stan_input = {
+        "rxn": [1, 2, 1],
+        "n_cpd": [2, 3],
+        "fst_stoic": [1, 3],
+        "stoic_cpd": [1, 2, 1, 3, 2],
+        "stoic_coef": [-1, 1, -1, -1, 2],
+        "temperature": [298.15, 298.15, 310.0],
+        "I": [0.1, 0.1, 0.1],
+        "pH": [7.0, 7.0, 7.0],
+        "pMg": [3.0, 3.0, 3.0],
+    }
+    ci = get_condition_index(stan_input)
+    assert ci["N_condition"] == 2
+    assert ci["N_cpd_cnd"] == 5
+    dense = np.zeros((3, ci["N_cpd_cnd"]))
+    for m in range(3):
+        for k in range(ci["stoic_kpr_u"][m] - 1, ci["stoic_kpr_u"][m + 1] - 1):
+            dense[m, ci["stoic_kpr_v"][k] - 1] = ci["stoic_kpr_w"][k]
+    cpd_cnd = list(zip(ci["cpd_cnd_cpd"], ci["cpd_cnd_cnd"]))
+    expected = np.zeros((3, 5))
+    for m, (reactants, cnd) in enumerate([
+        ({1: -1, 2: 1}, 1), ({1: -1, 3: -1, 2: 2}, 1), ({1: -1, 2: 1}, 2)
+    ]):
+        for cpd, coef in reactants.items():
+            expected[m, cpd_cnd.index((cpd, cnd))] = coef
+    assert np.array_equal(dense, expected)
+    # each condition's slices hold its measurements and (compound, condition)
+    # pairs
+    assert ci["temperature_cnd"] == [298.15, 310.0]
+    expected_kprs = [[1, 2], [3]]
+    expected_cpds = [[1, 2, 3], [1, 2]]
+    for c in range(ci["N_condition"]):
+        kpr, pair = (
+            slice(ci["fst_" + k][c] - 1, ci["fst_" + k][c] - 1 + ci["n_" + k][c])
+            for k in ["kpr_cnd", "cpd_cnd"]
+        )
+        assert ci["kpr_by_cnd"][kpr] == expected_kprs[c]
+        assert ci["cpd_cnd_cnd"][pair] == [c + 1] * len(expected_cpds[c])
+        assert sorted(ci["cpd_cnd_cpd"][pair]) == expected_cpds[c]
+
+
+def test_get_output_flags():
+    assert get_output_flags("minimal") == {
+        "output_dgr_prime": 0, "output_kpr_rep": 0, "output_log_lik": 0
+    }
+    assert get_output_flags("predictive") == {
+        "output_dgr_prime": 1, "output_kpr_rep": 1, "output_log_lik": 0
+    }
+
+
+def test_get_group_first_ix():
+    df = pd.DataFrame({"cpd": [2, 1, 2, 1, 3]}, index=[5, 6, 7, 8, 9])
+    assert get_group_first_ix(df, "cpd") == [7, 6, 10]
+    assert get_group_first_ix(df.iloc[:0], "cpd") == []
@@ -0,0 +1,71 @@
+import numpy as np
+import os
+import pandas as pd
+from process_data import (
+    SHEET_NAMES, get_magnesium_binding_states, get_protonation_states, read_sheets
+)
+
+
+def test_get_protonation_states():
+    pka_in = pd.DataFrame({
+        "Compound id": ["C1", "C2"],
+        "Charges for different protonation states": ["[-2, -1, 0]", "[0]"],
+        "pKas": ["[9.5, 4.1]", np.nan],
+        "Number of hydrogen atoms for different protonated states": [
+            "[4, 5, 6]", "[2]"
+        ],
+    })
+    out = get_protonation_states(pka_in)
+    assert out["compound_id"].tolist() == ["C1", "C1", "C1", "C2"]
+    assert out["charge"].tolist() == [-2, -1, 0, 0]
+    assert out["nh"].tolist() == [4, 5, 6, 2]
+    assert np.allclose(out["pka"], [np.nan, 9.5, 4.1, np.nan], equal_nan=True)
+
+
+def test_get_magnesium_binding_states():
+    pkmg_in = pd.DataFrame({
+        "Aqueous species id": ["C1_-2", "C1_-1a", "C1_-1b", "C2_0"],
+        "pKMg": [3.0, 2.0, 2.5, 1.0],
+        "pKMg2 (binding the second Mg)": [1.5, np.nan, np.nan, np.nan],
+        "Data or predicted": ["data", "predicted", "data", "data"],
+    })
+    out = get_magnesium_binding_states(pkmg_in)
+    assert out["compound_id"].tolist() == ["C1"] * 5 + ["C2"] * 2
+    assert out["charge"].tolist() == [-2, -2, -2, -1, -1, 0, 0]
+    assert out["nmg"].tolist() == [0, 1, 2, 0, 1, 0, 1]
+    assert np.allclose(
+        out["pkmg"], [np.nan, 3.0, 1.5, np.nan, 2.0, np.nan, 1.0], equal_nan=True
+    )
+    assert np.allclose(
+        out["pkmg_is_predicted"],
+        [np.nan, 0, 0, np.nan, 1, np.nan, 0],
+        equal_nan=True
+    )
+
+
+def test_read_sheets(tmp_path):
+    """Test that sheets are cached, and that changing the workbook replaces
+    the cache.
+
+    """
+    sheet_path = str(tmp_path / "sheets.xlsx")
+    cache_dir = str(tmp_path / "cache")
+
+    def write_workbook(value):
+        with pd.ExcelWriter(sheet_path) as writer:
+            for name in SHEET_NAMES.values():
+                pd.DataFrame({"x": [value, 2.0]}).to_excel(
+                    writer, sheet_name=name, index=False
+                )
+
+    write_workbook(1.0)
+    first = read_sheets(sheet_path, cache_dir)
+    assert first["dgf"]["x"].tolist() == [1.0, 2.0]
+    old_files = set(os.listdir(cache_dir))
+    assert len(old_files) == len(SHEET_NAMES)
+    cached = read_sheets(sheet_path, cache_dir)
+    assert all(cached[k].equals(first[k]) for k in SHEET_NAMES)
+    write_workbook(3.0)
+    assert read_sheets(sheet_path, cache_dir)["pka"]["x"].tolist() == [3.0, 2.0]
+    new_files = set(os.listdir(cache_dir))
+    assert len(new_files) == len(SHEET_NAMES) and not new_files & old_files
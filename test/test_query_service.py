@@ -0,0 +1,122 @@
+import json
+import numpy as np
+import threading
+import urllib.error
+import urllib.request
+from legendre import get_dgr_prime_batch, get_legendre_index
+from query_service import DgrPrimeService, LRUCache, serve
+from simulate import (
+    DG_MEASUREMENT_CONDITIONS, MICROSPECIES, STOICHIOMETRY, TRUE_PARAMS
+)
+
+
+def get_service():
+    cids = sorted(STOICHIOMETRY["compound_id"].unique())
+    n_pka_cpd, n_pkmg_cpd = (
+        np.array([len(TRUE_PARAMS[p].get(c, [])) for c in cids])
+        for p in ["pka", "pkmg"]
+    )
+    rng = np.random.default_rng(1234)
+    n_draw = 5
+    draws = {
+        "dgf": np.array([TRUE_PARAMS["dgf"][c] for c in cids])
+        + rng.normal(0, 10, (n_draw, len(cids))),
+        **{
+            p: np.concatenate([TRUE_PARAMS[p].get(c, []) for c in cids])
+            + rng.normal(0, 0.1, (n_draw, n))
+            for p, n in [("pka", n_pka_cpd.sum()), ("pkmg", n_pkmg_cpd.sum())]
+        }
+    }
+    service = DgrPrimeService(
+        draws, MICROSPECIES, cids, n_pka_cpd, n_pkmg_cpd, quantiles=[0.5]
+    )
+    return service, draws, n_pka_cpd, n_pkmg_cpd
+
+
+def get_queries():
+    return [
+        {
+            "reaction": STOICHIOMETRY.loc[lambda df: df["reaction_id"] == row["reaction_id"]]
+            .set_index("compound_id")["coefficient"].to_dict(),
+            "I": row["I"], "T(K)": row["t"], "pH": row["ph"], "pMg": row["pmg"],
+        }
+        for _, row in DG_MEASUREMENT_CONDITIONS.iterrows()
+    ]
+
+
+def test_dgr_prime_service():
+    """Test that the service matches one draw at a time and reuses its cache."""
+    R = 8.314e-3
+    service, draws, n_pka_cpd, n_pkmg_cpd = get_service()
+    cids = service.index.compound_ids
+    index = get_legendre_index(MICROSPECIES, STOICHIOMETRY, cids)
+    c = DG_MEASUREMENT_CONDITIONS
+    expected = []
+    for d in range(len(draws["dgf"])):
+        pk_dicts = {
+            p: dict(zip(cids, np.split(draws[p][d], np.cumsum(n)[:-1])))
+            for p, n in [("pka", n_pka_cpd), ("pkmg", n_pkmg_cpd)]
+        }
+        expected.append(get_dgr_prime_batch(
+            index, c["reaction_id"], c["I"], c["t"], c["ph"], c["pmg"], R,
+            pk_dicts["pka"], pk_dicts["pkmg"], dict(zip(cids, draws["dgf"][d])),
+        ))
+    queries = get_queries()
+    actual, errors = service.get_dgr_prime_draws(queries)
+    assert errors == [None] * len(queries)
+    assert np.allclose(actual, np.array(expected))
+    misses = service.stats()["misses"]
+    service.get_dgr_prime_draws(queries)
+    assert service.stats()["misses"] == misses
+    bad_reactions = [{"nonsense": 1}, ["CHB_15377"], 5, "['CHB_15377']"]
+    bad = service.query(
+        [{**queries[0], "reaction": r} for r in bad_reactions] + [queries[0]]
+    )
+    assert all("error" in b for b in bad[:-1])
+    assert np.isclose(bad[-1]["0.5"], np.median(actual[:, 0]))
+
+
+def test_serve():
+    service, *_ = get_service()
+    server = serve(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        request = urllib.request.Request(
+            url + "/dgr_prime", data=json.dumps(get_queries()[:2]).encode()
+        )
+        with urllib.request.urlopen(request) as response:
+            results = json.load(response)
+        assert len(results) == 2 and "mean" in results[0]
+        with urllib.request.urlopen(url + "/stats") as response:
+            assert json.load(response)["size"] > 0
+        request = urllib.request.Request(url + "/dgr_prime", data=b"5")
+        try:
+            urllib.request.urlopen(request)
+            assert False, "expected a 400 response"
+        except urllib.error.HTTPError as e:
+            assert e.code == 400
+        request = urllib.request.Request(
+            url + "/dgr_prime",
+            data=json.dumps([{**get_queries()[0], "reaction": [1]}]).encode(),
+        )
+        with urllib.request.urlopen(request) as response:
+            assert "error" in json.load(response)[0]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_lru_cache():
+    """Test that the cache forgets the least recently used arrays when it
+    gets too big.
+
+    """
+    cache = LRUCache(maxbytes=3 * 8 * 10)
+    for k in "abc":
+        cache.put(k, np.zeros(10))
+    cache.get("a")
+    cache.put("d", np.zeros(10))
+    assert list(cache.data) == ["c", "a", "d"]
+    assert cache.nbytes == 3 * 8 * 10
@@ -0,0 +1,39 @@
+import json
+import numpy as np
+from simulate import simulate_network, write_network
+
+
+def test_simulate_network(tmp_path):
+    """Test that a synthetic network is valid model input and doesn't depend
+    on the number of processes.
+
+    """
+    network = simulate_network(30, 20, 150, seed=1, n_processes=1, chunk_size=40)
+    stan_input = network["stan_input"]
+    assert stan_input["N_compound"] == 30
+    assert stan_input["N_reaction"] == 20
+    assert stan_input["N_measurement_kpr"] == 150
+    assert network["stoichiometry"].groupby("reaction_id")["coefficient"].sum().eq(0).all()
+    assert np.all(np.isfinite(np.log(stan_input["kpr_obs"])))
+    assert min(stan_input["pka_obs"] + stan_input["pkmg_obs"]) >= 0
+    assert len(network["true_params"]["pka"]) == stan_input["N_pka"]
+    parallel = simulate_network(30, 20, 150, seed=1, n_processes=2, chunk_size=40)
+    assert parallel["stan_input"] == stan_input
+    write_network(network, str(tmp_path))
+    with open(tmp_path / "stan_model_input.json", "r") as f:
+        assert json.load(f)["N_measurement_kpr"] == 150
+
+
+def test_simulate_tiny_network():
+    """Test that networks too small to have every kind of pk are still valid
+    model input.
+
+    """
+    network = simulate_network(2, 1, 3, seed=0, n_processes=1)
+    stan_input = network["stan_input"]
+    assert stan_input["N_pkmg"] == stan_input["N_Mgable_compound"] == 0
+    assert stan_input["n_pkmg_cpd"] == [] and set(stan_input["fst_pkmg"]) == {0}
+    assert len(network["true_params"]["pkmg"]) == 0
+    for seed in range(20):
+        stan_input = simulate_network(3, 2, 10, seed=seed, n_processes=1)["stan_input"]
+        assert len(stan_input["fst_pka"]) == stan_input["N_microspecies"]
@@ -1,5 +1,8 @@
-from cmdstanpy import CmdStanModel
+import numpy as np
 import os
+from model_cache import get_model
+from prepare_stan_input import get_output_flags
+from simulate import SIGMA_DGF, simulate_network
 
 
 def test_ordered_ragged_array():
@@ -18,9 +21,42 @@ def test_ordered_ragged_array():
         "diffs": [1, 2, 1],
     }
     expected = [2., 3., 2., 5., 3., 2.]
-    model = CmdStanModel(
-        stan_file=stan_file, stanc_options={"include_paths": [include_path]}
-    )
+    model = get_model(stan_file, include_paths=[include_path])
     samples = model.sample(data=data, fixed_param=True, iter_sampling=1)
     actual = samples.get_drawset(params=["actual"]).loc[0].tolist()
     assert actual == expected
+
+
+def test_model_dgr_prime():
+    """Test that the model's dgr_prime matches legendre.py's on synthetic
+    networks, given the true parameters.
+
+    The second network is so small that none of its compounds bind magnesium.
+
+    """
+    here = os.path.dirname(os.path.realpath(__file__))
+    model = get_model(os.path.join(here, "../src/stan/model.stan"))
+    for network in [
+        simulate_network(8, 5, 20, seed=1234, n_processes=1),
+        simulate_network(2, 1, 3, seed=0, n_processes=1),
+    ]:
+        stan_input = {**network["stan_input"], **get_output_flags("predictive")}
+        true = {k: np.array(v) for k, v in network["true_params"].items()}
+        sigma_dgf = np.array([SIGMA_DGF[r] for r in stan_input["prior_regime_dgf"]])
+        inits = {
+            "dgf_z": (true["dgf"] - stan_input["prior_loc_dgf"]) / sigma_dgf,
+        }
+        for p in ["pka", "pkmg"]:
+            first = np.cumsum(stan_input[f"n_{p}_cpd"]) - stan_input[f"n_{p}_cpd"]
+            is_first = np.isin(np.arange(len(true[p])), first)
+            inits[f"first_{p}"] = true[p][is_first]
+            inits[f"{p}_diffs"] = -np.diff(true[p])[~is_first[1:]]
+        samples = model.sample(
+            data=stan_input,
+            inits={k: v.tolist() for k, v in inits.items()},
+            fixed_param=True,
+            iter_sampling=1,
+        )
+        actual = samples.get_drawset(params=["dgr_prime"]).iloc[0].to_numpy()
+        expected = network["tecrdb"]["true_dgr_prime"].to_numpy()
+        assert np.allclose(actual, expected)
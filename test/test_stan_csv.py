@@ -0,0 +1,45 @@
+import numpy as np
+from stan_csv import read_stan_csvs
+
+CSV = """# model = model_model
+# method = sample (Default)
+#   sample
+#     num_samples = 2
+#     num_warmup = 3
+#     save_warmup = 1
+#     thin = 1 (Default)
+lp__,accept_stat__,dgf.1,dgf.2,sigma,dgf_z.1
+{warmup}
+# Adaptation terminated
+# Step size = 0.5
+# Diagonal elements of inverse mass matrix:
+# 1, 1
+{sampling}
+#  Elapsed Time: 0.1 seconds (Warm-up)
+"""
+
+
+def make_rows(start, n):
+    return "\n".join(
+        ",".join(str(x) for x in [-i, 0.9, i, 10 * i, 100 * i, 0.0])
+        for i in range(start, start + n)
+    )
+
+
+def test_read_stan_csvs(tmp_path):
+    paths = []
+    for chain in range(2):
+        path = str(tmp_path / f"samples-{chain + 1}.csv")
+        with open(path, "w") as f:
+            f.write(CSV.format(
+                warmup=make_rows(100 * chain, 3),
+                sampling=make_rows(100 * chain + 3, 2)
+            ))
+        paths.append(path)
+    draws = read_stan_csvs(paths, ["dgf", "sigma"], chunksize=2)
+    assert set(draws.keys()) == {"dgf", "sigma"}
+    assert draws["dgf"].shape == (2, 2, 2)
+    np.testing.assert_array_equal(
+        draws["dgf"][1], np.array([[103, 1030], [104, 1040]])
+    )
+    np.testing.assert_array_equal(draws["sigma"][:, :, 0], [[300, 400], [10300, 10400]])
@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+from summary import summarise_draws
+
+
+def test_summarise_draws():
+    """Test that summarise_draws agrees with pandas, whatever the block size."""
+    rng = np.random.default_rng(0)
+    draws = rng.normal(size=(2, 500, 7))
+    flat = pd.DataFrame(draws.reshape(-1, 7), columns=list("abcdefg"))
+    expected = flat.quantile([0.1, 0.5, 0.9]).T
+    actual = summarise_draws(draws, index=list("abcdefg"), hdi_prob=0.9, block_size=3)
+    pd.testing.assert_frame_equal(
+        actual[[0.1, 0.5, 0.9]], expected, check_names=False, check_column_type=False
+    )
+    pd.testing.assert_series_equal(actual["sd"], flat.std(), check_names=False)
+    width = actual["hdi_high"] - actual["hdi_low"]
+    central = flat.quantile(0.95) - flat.quantile(0.05)
+    assert np.allclose(width, central, rtol=0.05)
+    inside = ((flat >= actual["hdi_low"]) & (flat <= actual["hdi_high"])).mean()
+    assert (inside >= 0.9).all()
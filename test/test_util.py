@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import util
+from util import get_stoichiometry
+
+
+def test_get_stoichiometry():
+    tecrdb = pd.DataFrame({
+        "reaction_id": ["rxn_0", "rxn_0", "rxn_1", "rxn_2"],
+        "Reaction formula in python dictionary": [
+            "{'C1': -1, 'C2': 1}", "{'C1': -1, 'C2': 1}", "{'C3': -2.5}", np.nan
+        ],
+    })
+    expected = pd.DataFrame({
+        "compound_id": ["C1", "C2", "C3"],
+        "reaction_id": ["rxn_0", "rxn_0", "rxn_1"],
+        "coefficient": [-1.0, 1.0, -2.5],
+    })
+    first = get_stoichiometry(tecrdb)
+    first["coefficient"] = 0  # callers may modify the output
+    pd.testing.assert_frame_equal(get_stoichiometry(tecrdb), expected)
+
+
+def test_get_stoichiometry_cache_size(monkeypatch):
+    monkeypatch.setattr(util, "STOICHIOMETRY_CACHE_SIZE", 2)
+    util.STOICHIOMETRY_CACHE.clear()
+    tecrdbs = [
+        pd.DataFrame({
+            "reaction_id": ["rxn_0"],
+            "Reaction formula in python dictionary": [f"{{'C{i}': -1}}"],
+        })
+        for i in range(3)
+    ]
+    for tecrdb in tecrdbs:
+        get_stoichiometry(tecrdb)
+    assert len(util.STOICHIOMETRY_CACHE) == 2
+    assert get_stoichiometry(tecrdbs[0])["compound_id"].tolist() == ["C0"]
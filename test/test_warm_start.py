@@ -0,0 +1,60 @@
+import json
+import os
+from warm_start import (
+    get_parameter_labels, get_warm_start_args, map_chain_state, save_warm_start
+)
+
+CSV = """# method = sample (Default)
+#     num_samples = 2
+#     num_warmup = 10
+lp__,dgf_z.1,dgf_z.2,first_pka.1,first_pkmg.1,pka_diffs.1,dgf.1
+# Adaptation terminated
+# Step size = 0.25
+# Diagonal elements of inverse mass matrix:
+# 1, 2, 3, 4, 5
+-1,0.1,0.2,7.1,5.1,2.1,99
+-1,0.3,0.4,7.3,5.3,2.3,99
+"""
+
+
+def test_warm_start(tmp_path):
+    """Test saving a fit's state and mapping it onto a bigger model.
+
+    Compound A has two pkas and a pkmg. In the new model, compound B is
+    added, with one pka.
+
+    """
+    old_input = {"ms_cpd": [1, 1, 1, 2], "n_pka": [0, 1, 2, 0], "n_pkmg": [0, 1, 0, 0]}
+    old_codes = {"compound_id": {"A": 1, "Z": 2}}
+    labels = get_parameter_labels(old_input, old_codes)
+    assert labels == {
+        "dgf_z": ["A", "Z"],
+        "first_pka": ["A"],
+        "pka_diffs": ["A[1]"],
+        "first_pkmg": ["A"],
+        "pkmg_diffs": [],
+    }
+    csv = str(tmp_path / "samples-1.csv")
+    with open(csv, "w") as f:
+        f.write(CSV)
+    state_dir = str(tmp_path / "state")
+    save_warm_start([csv], labels, state_dir)
+    with open(os.path.join(state_dir, "chain-1.json"), "r") as f:
+        state = json.load(f)
+    assert state["step_size"] == 0.25
+    assert state["inits"]["first_pka"] == {"A": 7.3}
+    new_input = {
+        "ms_cpd": [1, 1, 1, 2, 2, 3],
+        "n_pka": [0, 1, 2, 0, 1, 0],
+        "n_pkmg": [0, 1, 0, 0, 0, 0]
+    }
+    new_codes = {"compound_id": {"A": 1, "B": 2, "Z": 3}}
+    mapped = map_chain_state(state, get_parameter_labels(new_input, new_codes))
+    assert mapped["inits"]["dgf_z"] == [0.3, 0.0, 0.4]
+    assert mapped["inits"]["first_pka"] == [7.3, 7.0]
+    assert mapped["inv_metric"] == [1, 3, 2, 3, 3, 4, 5]
+    args = get_warm_start_args(
+        state_dir, get_parameter_labels(new_input, new_codes), 2, str(tmp_path / "in")
+    )
+    assert args["step_size"] == [0.25, 0.25]
+    assert len(set(args["inits"])) == 2